@@ -1,12 +1,35 @@
 import sys
 from enum import Enum
-import pynput.mouse
-import pynput.keyboard
-from pynput.keyboard import Key
-from pynput.mouse import Button
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pynput
+    from pynput.keyboard import Key
+    from pynput.mouse import Button
+
+# pynput connects to the display as soon as it is imported, so it is only
+# imported once the first input is sent. Everything that only needs the
+# Action names, the daemon with --no-input, the IPC client or batch.py,
+# also runs without a display.
+_mouse = None
+_keyboard = None
+
+
+def mouse() -> "pynput.mouse.Controller":
+    global _mouse
+    if _mouse is None:
+        import pynput.mouse
+        _mouse = pynput.mouse.Controller()
+    return _mouse
+
+
+def keyboard() -> "pynput.keyboard.Controller":
+    global _keyboard
+    if _keyboard is None:
+        import pynput.keyboard
+        _keyboard = pynput.keyboard.Controller()
+    return _keyboard
 
-mouse = pynput.mouse.Controller()
-keyboard = pynput.keyboard.Controller()
 
 mouse_sensitivity = 10
 if "-s" in sys.argv:
@@ -22,6 +45,8 @@ class Action(Enum):
     MOUSE_DOWN = 2
     MOUSE_LEFT = 3
     MOUSE_RIGHT = 4
+    MOUSE_POSITION_X = 5
+    MOUSE_POSITION_Y = 6
     ARROW_UP = 10
     ARROW_DOWN = 11
     ARROW_LEFT = 12
@@ -44,33 +69,68 @@ class Action(Enum):
         value = abs(value)
         match self:
             case Action.MOUSE_UP:
-                mouse.move(0, -value * mouse_sensitivity)
+                mouse().move(0, -value * mouse_sensitivity)
             case Action.MOUSE_DOWN:
-                mouse.move(0, value * mouse_sensitivity)
+                mouse().move(0, value * mouse_sensitivity)
             case Action.MOUSE_LEFT:
-                mouse.move(-value * mouse_sensitivity, 0)
+                mouse().move(-value * mouse_sensitivity, 0)
             case Action.MOUSE_RIGHT:
-                mouse.move(value * mouse_sensitivity, 0)
+                mouse().move(value * mouse_sensitivity, 0)
+            case _:
+                from pynput.mouse import Button
+                target = self.get_input()
+                if value <= 0 or target is None:
+                    return
+                if isinstance(target, Button):
+                    mouse().click(target, 1)
+                else:
+                    keyboard().tap(target)
+
+    def get_input(self) -> "Button | Key | str | None":
+        from pynput.keyboard import Key
+        from pynput.mouse import Button
+        match self:
             case Action.MOUSE_BUTTON_LEFT:
-                if value > 0:
-                    mouse.click(Button.left, 1)
+                return Button.left
             case Action.MOUSE_BUTTON_RIGHT:
-                if value > 0:
-                    mouse.click(Button.right, 1)
+                return Button.right
             case Action.ARROW_UP:
-                if value > 0:
-                    keyboard.tap(Key.up)
+                return Key.up
             case Action.ARROW_DOWN:
-                if value > 0:
-                    keyboard.tap(Key.down)
+                return Key.down
             case Action.ARROW_LEFT:
-                if value > 0:
-                    keyboard.tap(Key.left)
+                return Key.left
             case Action.ARROW_RIGHT:
-                if value > 0:
-                    keyboard.tap(Key.right)
+                return Key.right
             case _:
-                if self.name.startswith("PRESS_") and value > 0:
-                    key = self.name.split('_', 1)[1].lower()
-                    keyboard.tap(key)
-                    return
+                if self.name.startswith("PRESS_"):
+                    return self.name.split('_', 1)[1].lower()
+                return None
+
+    def press(self):
+        from pynput.mouse import Button
+        target = self.get_input()
+        if isinstance(target, Button):
+            mouse().press(target)
+        elif target is not None:
+            keyboard().press(target)
+
+    def release(self):
+        from pynput.mouse import Button
+        target = self.get_input()
+        if isinstance(target, Button):
+            mouse().release(target)
+        elif target is not None:
+            keyboard().release(target)
+
+
+MOUSE_DIRECTIONS = {
+    Action.MOUSE_UP: (0, -1),
+    Action.MOUSE_DOWN: (0, 1),
+    Action.MOUSE_LEFT: (-1, 0),
+    Action.MOUSE_RIGHT: (1, 0),
+}
+
+# Absolute pointer positions, 0 to 1 across the screen area the gaze was
+# calibrated on.
+MOUSE_POSITIONS = [Action.MOUSE_POSITION_X, Action.MOUSE_POSITION_Y]
@@ -0,0 +1,22 @@
+import sys
+
+
+def has_flag(*flags) -> bool:
+    return any(flag in sys.argv for flag in flags)
+
+
+def arg_value(*flags, default=None):
+    for flag in flags:
+        if flag in sys.argv:
+            i = sys.argv.index(flag)
+            if len(sys.argv) > i + 1:
+                return sys.argv[i + 1]
+    return default
+
+
+def arg_values(*flags) -> list[str]:
+    values = []
+    for i, arg in enumerate(sys.argv[:-1]):
+        if arg in flags:
+            values.append(sys.argv[i + 1])
+    return values
@@ -0,0 +1,348 @@
+import json
+import math
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import cv2
+import numpy as np
+import mediapipe as mp
+from mediapipe.tasks.python import vision
+from args import arg_value
+from calibration import load_program
+from filters import create_filter
+from landmarks import BLENDSHAPE_NAMES, NUM_BLENDSHAPES, LandmarkProcessor
+from mapper import ActionParameterMapper, ParamName
+from pipeline import create_landmarker_options
+
+# A track is a directory with the columns below, one row per video frame,
+# split into chunks of a fixed number of frames. Every chunk of a column is
+# its own .npy file, NAME.CHUNK.npy, and tracks.json lists the chunks in
+# order together with the column names. Frames without a face keep their
+# parameters and blendshapes at zero.
+TRACK_COLUMNS = {
+    "timestamps": (np.int64, ()),
+    "present": (np.bool_, ()),
+    "parameters": (np.float32, (len(ParamName),)),
+    "blendshapes": (np.float32, (NUM_BLENDSHAPES,)),
+}
+TRACK_INFO = "tracks.json"
+
+
+def chunk_path(path: str, name: str, chunk: int) -> str:
+    return os.path.join(path, f"{name}.{chunk:05d}.npy")
+
+
+def load_tracks(path: str) -> dict[str, np.ndarray]:
+    with open(os.path.join(path, TRACK_INFO)) as file:
+        info = json.load(file)
+    return {name: np.concatenate(
+        [np.load(chunk_path(path, name, chunk), mmap_mode="r")
+         for chunk, _ in info["chunks"]]
+        or [np.zeros((0,) + shape, dtype)])
+        for name, (dtype, shape) in TRACK_COLUMNS.items()}
+
+
+# Buffers one chunk of rows and writes it out once full, so memory stays
+# flat however long the video is.
+class TrackWriter:
+    path: str
+    chunk: int
+    chunks: list[tuple[int, int]]
+
+    def __init__(self, path, chunk_frames, first_frame=0):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk = first_frame // chunk_frames
+        self.chunks = []
+        self.rows = 0
+        self.columns = {name: np.zeros((chunk_frames,) + shape, dtype)
+                        for name, (dtype, shape) in TRACK_COLUMNS.items()}
+
+    def add(self, timestamp_ms: int, parameters=None, blendshapes=None):
+        row = self.rows
+        columns = self.columns
+        columns["timestamps"][row] = timestamp_ms
+        columns["present"][row] = parameters is not None
+        if parameters is not None:
+            columns["parameters"][row] = parameters
+            columns["blendshapes"][row] = blendshapes
+        else:
+            columns["parameters"][row] = 0.0
+            columns["blendshapes"][row] = 0.0
+        self.rows += 1
+        if self.rows == len(columns["timestamps"]):
+            self.flush()
+
+    def flush(self):
+        if self.rows == 0:
+            return
+        for name, column in self.columns.items():
+            np.save(chunk_path(self.path, name, self.chunk),
+                    column[:self.rows])
+        self.chunks.append((self.chunk, self.rows))
+        self.chunk += 1
+        self.rows = 0
+
+
+# A video, or with splitting one stretch of it, always starting on a chunk
+# boundary.
+class BatchTask:
+    source: str
+    output: str
+    first_frame: int
+    last_frame: int | None
+
+    def __init__(self, source, output, first_frame=0, last_frame=None):
+        self.source = source
+        self.output = output
+        self.first_frame = first_frame
+        self.last_frame = last_frame
+
+
+class TaskResult:
+    task: BatchTask
+    frames: int
+    chunks: list[tuple[int, int]]
+
+    def __init__(self, task, frames, chunks, fps, width, height):
+        self.task = task
+        self.frames = frames
+        self.chunks = chunks
+        self.fps = fps
+        self.width = width
+        self.height = height
+
+
+# One per pool process, with one FaceLandmarker in VIDEO mode that is kept
+# for every task the process gets. Frames are read one at a time into the
+# same buffer and go through the same LandmarkProcessor as in the app.
+class BatchWorker:
+    def __init__(self, progress, chunk_frames, filter_name=None,
+                 profile_path=None):
+        # Every process runs on a core of its own, threads inside them would
+        # only compete with the other processes.
+        cv2.setNumThreads(1)
+        self.progress = progress
+        self.chunk_frames = chunk_frames
+        self.filter_name = filter_name
+        self.program = load_program(profile_path)
+        self.landmarker = vision.FaceLandmarker.create_from_options(
+            create_landmarker_options(vision.RunningMode.VIDEO))
+        self.clock_ms = 0
+
+    def run(self, task: BatchTask) -> TaskResult:
+        vc = cv2.VideoCapture(task.source)
+        fps = vc.get(cv2.CAP_PROP_FPS) or 30.0
+        width = int(vc.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(vc.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if task.first_frame:
+            vc.set(cv2.CAP_PROP_POS_FRAMES, task.first_frame)
+        parameter_filter = create_filter(self.filter_name) \
+            if self.filter_name is not None else None
+        processor = LandmarkProcessor(ActionParameterMapper(),
+                                      program=self.program,
+                                      parameter_filter=parameter_filter)
+        writer = TrackWriter(task.output, self.chunk_frames, task.first_frame)
+
+        # The landmarker's timestamps have to keep increasing from task to
+        # task, and an empty frame in between drops the face it tracked, so
+        # the first frame of a new video looks for a face from scratch.
+        self.clock_ms += 1000
+        self.landmarker.detect_for_video(
+            mp.Image(image_format=mp.ImageFormat.SRGB,
+                     data=np.zeros((64, 64, 3), np.uint8)), self.clock_ms)
+        clock_start_ms = self.clock_ms + 1
+
+        frame = None
+        index = task.first_frame
+        reported = index
+        while task.last_frame is None or index < task.last_frame:
+            rval, frame = vc.read(frame)
+            if not rval:
+                break
+            timestamp_ms = int(index * 1000 / fps)
+            self.clock_ms = clock_start_ms + int(
+                (index - task.first_frame) * 1000 / fps)
+            result = self.landmarker.detect_for_video(
+                mp.Image(image_format=mp.ImageFormat.SRGB, data=frame),
+                self.clock_ms)
+            values = processor.process_result(result, timestamp_ms)
+            if values is None:
+                writer.add(timestamp_ms)
+            else:
+                writer.add(timestamp_ms, values,
+                           processor.history.latest_scores())
+            index += 1
+            if index - reported >= 30:
+                self.progress.put(index - reported)
+                reported = index
+        self.progress.put(index - reported)
+        writer.flush()
+        vc.release()
+        return TaskResult(task, index - task.first_frame, writer.chunks, fps,
+                          width, height)
+
+
+worker = None
+
+
+def start_worker(*args):
+    global worker
+    worker = BatchWorker(*args)
+
+
+def run_task(task: BatchTask) -> TaskResult:
+    return worker.run(task)
+
+
+def output_paths(sources: list[str], output: str) -> list[str]:
+    # One directory per video, named after the file, numbered if two videos
+    # share a name.
+    paths = []
+    for source in sources:
+        name = os.path.splitext(os.path.basename(source))[0]
+        path = os.path.join(output, name)
+        number = 1
+        while path in paths:
+            path = os.path.join(output, f"{name}-{number}")
+            number += 1
+        paths.append(path)
+    return paths
+
+
+def plan_tasks(sources: list[str], output: str,
+               split_frames=None) -> tuple[list[BatchTask], int]:
+    # Long videos come first so the pool does not end waiting on one of
+    # them. With splitting, videos are cut into stretches of `split_frames`
+    # that run side by side, the tracking starts over at each cut.
+    tasks = []
+    total = 0
+    for source, path in zip(sources, output_paths(sources, output)):
+        vc = cv2.VideoCapture(source)
+        frames = max(int(vc.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        vc.release()
+        total += frames
+        if split_frames is None or frames <= split_frames:
+            tasks.append((frames, BatchTask(source, path)))
+            continue
+        for first in range(0, frames, split_frames):
+            last = first + split_frames
+            tasks.append((min(last, frames) - first, BatchTask(
+                source, path, first, last if last < frames else None)))
+    tasks.sort(key=lambda item: -item[0])
+    return [task for _, task in tasks], total
+
+
+def write_info(path: str, source: str, results: list[TaskResult],
+               chunk_frames: int):
+    results = sorted(results, key=lambda result: result.task.first_frame)
+    first = results[0]
+    info = {
+        "source": os.path.abspath(source),
+        "frames": sum(result.frames for result in results),
+        "fps": first.fps,
+        "width": first.width,
+        "height": first.height,
+        "chunk_frames": chunk_frames,
+        "chunks": sorted(chunk for result in results
+                         for chunk in result.chunks),
+        "columns": {name: [np.dtype(dtype).name, list(shape)]
+                    for name, (dtype, shape) in TRACK_COLUMNS.items()},
+        "parameters": [name.name for name in ParamName],
+        "blendshapes": BLENDSHAPE_NAMES,
+    }
+    with open(os.path.join(path, TRACK_INFO), "w") as file:
+        json.dump(info, file, indent=2)
+
+
+def print_progress(done: int, total: int, elapsed: float, final=False):
+    rate = done / elapsed if elapsed > 0 else 0.0
+    line = f"{done}/{total} frames, {rate:.0f} frames/s"
+    if not final and rate > 0 and total > done:
+        line += f", {(total - done) / rate:.0f} s left"
+    if sys.stdout.isatty():
+        print("\r" + line.ljust(60), end="\n" if final else "", flush=True)
+    else:
+        print(line, flush=True)
+
+
+def run_batch(sources: list[str], output: str, jobs: int, chunk_frames=1800,
+              split_frames=None, filter_name=None, profile_path=None,
+              progress_interval=1.0) -> dict:
+    tasks, total = plan_tasks(sources, output, split_frames)
+    context = multiprocessing.get_context("spawn")
+    progress = context.Queue()
+    results = {}
+    done = 0
+    start = time.perf_counter()
+    last_print = start
+    with context.Pool(jobs, initializer=start_worker,
+                      initargs=(progress, chunk_frames, filter_name,
+                                profile_path)) as pool:
+        pending = pool.imap_unordered(run_task, tasks)
+        finished = 0
+        while finished < len(tasks):
+            try:
+                result = pending.next(0.1)
+                results.setdefault(result.task.output, []).append(result)
+                finished += 1
+            except multiprocessing.TimeoutError:
+                pass
+            while True:
+                try:
+                    done += progress.get_nowait()
+                except queue.Empty:
+                    break
+            now = time.perf_counter()
+            if now - last_print >= progress_interval:
+                print_progress(done, total, now - start)
+                last_print = now
+    # Frame counts from the container are estimates, the frames read are
+    # what counts.
+    done = sum(result.frames for parts in results.values()
+               for result in parts)
+    elapsed = time.perf_counter() - start
+    print_progress(done, done, elapsed, final=True)
+    for source, path in zip(sources, output_paths(sources, output)):
+        if path in results:
+            write_info(path, source, results[path], chunk_frames)
+    return {"videos": len(sources), "frames": done, "seconds": elapsed,
+            "frames_per_second": done / elapsed if elapsed > 0 else 0.0,
+            "jobs": jobs}
+
+
+VALUE_FLAGS = ["--out", "--jobs", "--chunk", "--split", "--filter",
+               "--profile"]
+
+
+def main():
+    sources = [arg for previous, arg in zip(sys.argv, sys.argv[1:])
+               if not arg.startswith("--") and previous not in VALUE_FLAGS]
+    output = arg_value("--out")
+    if not sources or output is None:
+        print("usage: python src/batch.py VIDEO ... --out DIR [--jobs N] "
+              "[--chunk FRAMES] [--split FRAMES] [--filter NAME] "
+              "[--profile FILE]")
+        return 1
+    jobs = arg_value("--jobs", default=str(os.cpu_count() or 1))
+    jobs = int(jobs) if jobs.isdecimal() and int(jobs) > 0 else 1
+    chunk = arg_value("--chunk", default="1800")
+    chunk_frames = int(chunk) if chunk.isdecimal() and int(chunk) > 0 \
+        else 1800
+    split_frames = None
+    split = arg_value("--split")
+    if split is not None and split.isdecimal() and int(split) > 0:
+        # Cuts fall on chunk boundaries, every chunk comes from one task.
+        split_frames = math.ceil(int(split) / chunk_frames) * chunk_frames
+    report = run_batch(sources, output, jobs, chunk_frames, split_frames,
+                       arg_value("--filter"), arg_value("--profile"))
+    print(f"{report['frames']} frames of {report['videos']} videos in "
+          f"{report['seconds']:.1f} s, {report['frames_per_second']:.0f} "
+          f"frames/s with {jobs} processes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
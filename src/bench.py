@@ -0,0 +1,185 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import mediapipe as mp
+import numpy as np
+from args import arg_value, arg_values, has_flag
+from capture import Camera
+from gestures import default_gestures
+from instrumentation import StageTimers
+from landmarks import LandmarkProcessor
+from pipeline import FacePipeline, create_landmarker_options
+from roi import AdaptiveInput
+from scheduling import InferenceScheduler
+from telemetry import Telemetry
+from tracking import LandmarkTracker
+from replay import (ActionLog, LandmarkRecording, SessionRecorder,
+                    create_replay_mapper, replay_landmarks)
+
+
+def run_pipeline(source: str, mappings: list[str], preview: bool,
+                 record_path: str | None, adaptive_input=None, tracker=None,
+                 scheduler=None, telemetry=None) -> dict:
+    gestures = default_gestures()
+    mapper = create_replay_mapper(mappings, gestures=gestures)
+    landmark_processor = LandmarkProcessor(mapper, gestures=gestures)
+    camera = Camera(source, pace=True)
+    if not camera.open():
+        raise RuntimeError(f"could not read {source}")
+    sink = ActionLog()
+    timers = StageTimers(capacity=100000, enabled=True)
+    recorder = SessionRecorder(record_path) \
+        if record_path is not None else None
+    pipeline = FacePipeline(
+        create_landmarker_options(mp.tasks.vision.RunningMode.LIVE_STREAM),
+        mapper, landmark_processor, camera, sink, recorder=recorder,
+        timers=timers, adaptive_input=adaptive_input, tracker=tracker,
+        scheduler=scheduler, telemetry=telemetry)
+
+    consumer = None
+    if preview:
+        pipeline.set_preview_visible(True)
+        pipeline.set_preview_size(640, 480)
+
+        def consume():
+            while pipeline.running or not pipeline.preview.closed:
+                if pipeline.preview.take(0.1)[0] is None \
+                        and pipeline.preview.closed:
+                    break
+        consumer = threading.Thread(target=consume, daemon=True)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    pipeline.start()
+    if consumer is not None:
+        consumer.start()
+    pipeline.threads[0].join()
+    # Let the stages behind inference drain before shutting down.
+    while len(pipeline.detections) or len(pipeline.dispatches):
+        time.sleep(0.01)
+    time.sleep(0.1)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    pipeline.stop()
+
+    detections = int(timers.counts[timers.index["inference"]])
+    stats = camera.stats
+    return {
+        "source": source,
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "cpu_utilization": cpu / wall if wall > 0 else 0.0,
+        "cpu_ms_per_detection": cpu * 1000 / detections if detections else 0.0,
+        "detections": detections,
+        "detection_fps": detections / wall if wall > 0 else 0.0,
+        "frames_captured": stats.captured,
+        "frames_dropped": stats.dropped,
+        "frames_stale": stats.stale,
+        "queue_drops": {
+            "detections": pipeline.detections.dropped,
+            "dispatches": pipeline.dispatches.dropped,
+            "previews": pipeline.previews.dropped,
+            "recordings": pipeline.recordings.dropped,
+        },
+        "action_events": len(sink.events),
+        "inference_scale": adaptive_input.scale
+        if adaptive_input is not None else 1.0,
+        "frames_tracked": tracker.tracked if tracker is not None else 0,
+        "tracking_lost": tracker.lost if tracker is not None else 0,
+        "scheduler": scheduler.stats(pipeline.inference_ms)
+        if scheduler is not None else {},
+        "telemetry_frames": telemetry.count if telemetry is not None else 0,
+        "stages": timers.summary(),
+    }
+
+
+def measure_allocations(record_path: str, mappings: list[str]) -> dict:
+    # Separate pass, tracemalloc would distort the timings above. Replays the
+    # landmarks of the run and tracks the transient allocation peak per frame
+    # of parameter extraction and action evaluation.
+    recording = LandmarkRecording(record_path)
+    gestures = default_gestures()
+    mapper = create_replay_mapper(mappings, gestures=gestures)
+    landmark_processor = LandmarkProcessor(mapper, gestures=gestures)
+    sink = ActionLog()
+    replay_landmarks(recording, landmark_processor, sink)
+
+    peaks = np.zeros(len(recording))
+    tracemalloc.start()
+    for i in range(len(recording)):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        if recording.present[i]:
+            landmark_processor.history.push_scores(recording.blendshapes[i],
+                                                   recording.matrices[i])
+            landmark_processor.process(int(recording.timestamps[i]))
+        sink.submit(mapper.action_values())
+        peaks[i] = tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    if len(peaks) == 0:
+        return {}
+    return {
+        "frames": len(peaks),
+        "alloc_peak_bytes_mean": float(peaks.mean()),
+        "alloc_peak_bytes_max": float(peaks.max()),
+    }
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("usage: python src/bench.py VIDEO|RECORDING [--json FILE] "
+              "[--preview] [--crop] [--budget MS] [--track] [--power-save] "
+              "[--telemetry] "
+              "[--map ACTION=TRANSFORMER ...]")
+        return 1
+    source = sys.argv[1]
+    if os.path.isdir(source):
+        source = LandmarkRecording(source).video_path
+        if source is None:
+            print("the recording has no frames, record it with "
+                  "--record-video")
+            return 1
+    mappings = arg_values("--map")
+    adaptive_input = None
+    budget = arg_value("--budget")
+    budget_ms = int(budget) if budget is not None and budget.isdecimal() \
+        else None
+    if has_flag("--crop") or budget_ms is not None:
+        adaptive_input = AdaptiveInput(has_flag("--crop"), budget_ms=budget_ms)
+
+    tracker = LandmarkTracker() if has_flag("--track") else None
+    scheduler = InferenceScheduler() if has_flag("--power-save") else None
+    # Collects the telemetry as if its panel was open.
+    telemetry = Telemetry(enabled=True) if has_flag("--telemetry") else None
+
+    if scheduler is not None:
+        # A recording counts as using the results and would keep the
+        # scheduler from ever going idle, so the allocations, which are
+        # measured on one, are left out.
+        report = run_pipeline(source, mappings, has_flag("--preview"), None,
+                              adaptive_input, tracker, scheduler, telemetry)
+        report["allocations"] = {}
+    else:
+        with tempfile.TemporaryDirectory() as record_path:
+            report = run_pipeline(source, mappings, has_flag("--preview"),
+                                  record_path, adaptive_input, tracker,
+                                  scheduler, telemetry)
+            report["allocations"] = measure_allocations(record_path,
+                                                        mappings)
+    report["time"] = time.time()
+
+    output = json.dumps(report, indent=2)
+    json_path = arg_value("--json")
+    if json_path is not None:
+        with open(json_path, "w") as file:
+            file.write(output)
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
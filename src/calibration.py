@@ -0,0 +1,289 @@
+import configparser
+import os
+import sys
+import numpy as np
+from args import arg_value
+from landmarks import (DEFAULT_CHANNELS, NUM_BLENDSHAPES, SOURCE_INDEX,
+                       Channel, ParameterProgram, blendshapes_to_array)
+
+
+def default_profile_path() -> str:
+    directory = os.environ.get("XDG_CONFIG_HOME",
+                               os.path.join(os.path.expanduser("~"),
+                                            ".config"))
+    return os.path.join(directory, "face_controller", "profile.ini")
+
+
+# P² estimate of one quantile for many values at once (Jain and Chlamtac,
+# 1985). Five markers per value follow the minimum, the quantile, the
+# maximum and two points in between, so memory stays constant however long
+# the calibration runs.
+class StreamingQuantile:
+    p: float
+    count: int
+
+    def __init__(self, p, size):
+        self.p = p
+        self.count = 0
+        self.first = np.zeros((5, size))
+        self.heights = None
+        self.positions = None
+        self.desired = np.array([0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0])
+        self.increments = np.array([0.0, p / 2, p, (1 + p) / 2, 1.0])
+
+    def add(self, x: np.ndarray):
+        if self.count < 5:
+            self.first[self.count] = x
+            self.count += 1
+            if self.count == 5:
+                self.heights = np.sort(self.first, axis=0).T.copy()
+                self.positions = np.tile(np.arange(5.0), (len(x), 1))
+            return
+        self.count += 1
+        q = self.heights
+        n = self.positions
+        q[:, 0] = np.minimum(q[:, 0], x)
+        q[:, 4] = np.maximum(q[:, 4], x)
+        cell = np.count_nonzero(x[:, None] >= q[:, 1:4], axis=1)
+        n += np.arange(5) > cell[:, None]
+        self.desired += self.increments
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in (1, 2, 3):
+                d = self.desired[i] - n[:, i]
+                move = ((d >= 1) & (n[:, i + 1] - n[:, i] > 1)) \
+                    | ((d <= -1) & (n[:, i - 1] - n[:, i] < -1))
+                if not move.any():
+                    continue
+                s = np.sign(d)
+                parabolic = q[:, i] + s / (n[:, i + 1] - n[:, i - 1]) * (
+                    (n[:, i] - n[:, i - 1] + s) * (q[:, i + 1] - q[:, i])
+                    / (n[:, i + 1] - n[:, i])
+                    + (n[:, i + 1] - n[:, i] - s) * (q[:, i] - q[:, i - 1])
+                    / (n[:, i] - n[:, i - 1]))
+                neighbour = np.where(s > 0, i + 1, i - 1)
+                rows = np.arange(len(x))
+                linear = q[:, i] + s * (q[rows, neighbour] - q[:, i]) \
+                    / (n[rows, neighbour] - n[:, i])
+                inside = (q[:, i - 1] < parabolic) & (parabolic < q[:, i + 1])
+                q[:, i] = np.where(move, np.where(inside, parabolic, linear),
+                                   q[:, i])
+                n[:, i] += np.where(move, s, 0.0)
+
+    def value(self) -> np.ndarray:
+        if self.count == 0:
+            return np.full(self.first.shape[1], np.nan)
+        if self.count < 5:
+            return np.quantile(self.first[:self.count], self.p, axis=0)
+        return self.heights[:, 2].copy()
+
+
+# Per user statistics of every source a channel reads: the resting value
+# and its jitter from the neutral pose, and how far the face reaches in
+# either direction over the whole calibration.
+class CalibrationProfile:
+    sources: list[str]
+    neutral: np.ndarray
+    noise: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+
+    # Resting jitter the range starts above, in units of the noise.
+    NOISE_MARGIN = 2.0
+    # Ranges narrower than this share of the default range were never
+    # really exercised during the calibration and keep the default.
+    MIN_SPAN = 0.25
+
+    def __init__(self, sources, neutral, noise, low, high):
+        self.sources = list(sources)
+        self.neutral = np.asarray(neutral, dtype=float)
+        self.noise = np.asarray(noise, dtype=float)
+        self.low = np.asarray(low, dtype=float)
+        self.high = np.asarray(high, dtype=float)
+
+    def channels(self, defaults=DEFAULT_CHANNELS) -> dict[str, Channel]:
+        index = {name: i for i, name in enumerate(self.sources)}
+        channels = {}
+        for name, channel in defaults.items():
+            i = index.get(channel.source)
+            channels[name] = channel if i is None \
+                else self.calibrate(channel, i)
+        return channels
+
+    def calibrate(self, channel: Channel, i: int) -> Channel:
+        default_span = channel.scale_max - channel.scale_min
+        if channel.scale_min == -channel.scale_max:
+            # Signed channels are centred on the resting pose and reach as
+            # far as the larger of the two directions. Without a usable range
+            # the resting pose is still centred.
+            half = max(self.neutral[i] - self.low[i],
+                       self.high[i] - self.neutral[i])
+            if not 2 * half >= self.MIN_SPAN * default_span:
+                half = default_span / 2
+            if np.isnan(self.neutral[i]):
+                return channel
+            scale_min = self.neutral[i] - half
+            scale_max = self.neutral[i] + half
+        else:
+            scale_min = self.neutral[i] + self.NOISE_MARGIN * self.noise[i]
+            scale_max = self.high[i]
+            if not scale_max - scale_min >= self.MIN_SPAN * default_span:
+                return channel
+        return Channel(channel.source, scale_min, scale_max,
+                       channel.clip_min, channel.clip_max, channel.invert,
+                       channel.gain, channel.offset, channel.out_min,
+                       channel.out_max)
+
+    def save(self, path: str):
+        config = configparser.ConfigParser(interpolation=None)
+        config.optionxform = str
+        for i, name in enumerate(self.sources):
+            config[name] = {"neutral": f"{self.neutral[i]:.6g}",
+                            "noise": f"{self.noise[i]:.6g}",
+                            "low": f"{self.low[i]:.6g}",
+                            "high": f"{self.high[i]:.6g}"}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as file:
+            config.write(file)
+
+    @classmethod
+    def load(cls, path: str) -> "CalibrationProfile":
+        config = configparser.ConfigParser(interpolation=None)
+        config.optionxform = str
+        with open(path) as file:
+            config.read_file(file)
+        sources = [name for name in config.sections() if name in SOURCE_INDEX]
+        return cls(sources,
+                   *([config.getfloat(name, key) for name in sources]
+                     for key in ("neutral", "noise", "low", "high")))
+
+
+# Collects the sources of every frame. The neutral phase comes first, the
+# range over all frames then includes the resting pose as well.
+class Calibrator:
+    sources: list[str]
+    frames: int
+
+    def __init__(self, sources=None):
+        if sources is None:
+            sources = list(dict.fromkeys(
+                channel.source for channel in DEFAULT_CHANNELS.values()))
+        self.sources = sources
+        self.columns = np.array([SOURCE_INDEX[name] for name in sources],
+                                dtype=np.intp)
+        self.program = ParameterProgram()
+        self.frames = 0
+        size = len(sources)
+        self.resting = [StreamingQuantile(p, size) for p in (0.1, 0.5, 0.9)]
+        self.range = [StreamingQuantile(p, size) for p in (0.02, 0.98)]
+
+    def add(self, scores, trans_mat, neutral: bool):
+        self.program.load_sources(scores, trans_mat)
+        values = self.program.sources[self.columns]
+        if neutral:
+            for estimator in self.resting:
+                estimator.add(values)
+        for estimator in self.range:
+            estimator.add(values)
+        self.frames += 1
+
+    def profile(self) -> CalibrationProfile:
+        q10, median, q90 = (estimator.value() for estimator in self.resting)
+        low, high = (estimator.value() for estimator in self.range)
+        return CalibrationProfile(self.sources, median, (q90 - q10) / 2,
+                                  low, high)
+
+
+def load_program(path=None) -> ParameterProgram:
+    # An explicitly given profile must exist, the default one only once the
+    # user went through a calibration.
+    if path is None:
+        path = default_profile_path()
+        if not os.path.exists(path):
+            return ParameterProgram()
+    return ParameterProgram(CalibrationProfile.load(path).channels())
+
+
+NEUTRAL_SECONDS = 3.0
+PROMPTS = [
+    "Close both eyes",
+    "Open your mouth wide",
+    "Smile",
+    "Push your lower lip up",
+    "Move your mouth left and right",
+    "Raise your eyebrows",
+    "Look left, right, up and down",
+    "Turn your head left and right",
+    "Nod your head up and down",
+    "Tilt your head to both shoulders",
+    "Move your head left, right, up and down",
+]
+
+
+def main():
+    import mediapipe as mp
+    from mediapipe.tasks.python import vision
+    from capture import Camera
+    from pipeline import create_landmarker_options
+
+    source = arg_value("--source", default="0")
+    path = arg_value("--out", default=default_profile_path())
+    seconds = arg_value("--seconds", default="2")
+    prompt_seconds = float(seconds) if seconds.replace(".", "", 1) \
+        .isdecimal() else 2.0
+    camera = Camera(int(source) if source.isdecimal() else source,
+                    pace=not source.isdecimal())
+    if not camera.open():
+        print(f"Could not open {source}")
+        return 1
+    options = create_landmarker_options(vision.RunningMode.VIDEO)
+    calibrator = Calibrator()
+    schedule = [(NEUTRAL_SECONDS, "Keep a relaxed, neutral face and look "
+                 "straight at the camera")] \
+        + [(prompt_seconds, prompt) for prompt in PROMPTS]
+    scores = np.zeros(NUM_BLENDSHAPES, dtype=np.float32)
+    start_ms = None
+    last_timestamp_ms = 0
+    step = -1
+    with vision.FaceLandmarker.create_from_options(options) as landmarker:
+        camera.start()
+        while True:
+            frame, captured_ms = camera.take(0.5)
+            if frame is None:
+                if camera.slot.closed:
+                    break
+                continue
+            timestamp_ms = max(int(captured_ms), last_timestamp_ms + 1)
+            last_timestamp_ms = timestamp_ms
+            if start_ms is None:
+                start_ms = timestamp_ms
+            elapsed = (timestamp_ms - start_ms) / 1000
+            current = 0
+            while current < len(schedule) \
+                    and elapsed >= schedule[current][0]:
+                elapsed -= schedule[current][0]
+                current += 1
+            if current == len(schedule):
+                break
+            if current != step:
+                step = current
+                print(schedule[step][1])
+            result = landmarker.detect_for_video(
+                mp.Image(image_format=mp.ImageFormat.SRGB, data=frame),
+                timestamp_ms)
+            if result.face_blendshapes:
+                blendshapes_to_array(result.face_blendshapes[0], scores)
+                calibrator.add(scores, result.facial_transformation_matrixes[0],
+                               neutral=step == 0)
+    camera.stop()
+    if step < len(schedule) - 1 or calibrator.resting[0].count == 0:
+        print("The calibration ended early, no profile was written")
+        return 1
+    calibrator.profile().save(path)
+    print(f"Saved the profile of {calibrator.frames} frames to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import threading
+import time
+import cv2
+import numpy as np
+
+
+class CaptureStats:
+    captured: int
+    taken: int
+    dropped: int
+    stale: int
+
+    def __init__(self):
+        self.captured = 0
+        self.taken = 0
+        self.dropped = 0
+        self.stale = 0
+
+
+# Triple buffer: the camera thread fills `back`, publishing swaps it with
+# `latest` and taking swaps `latest` with `front`. No frame array is
+# allocated unless the frame size changes and a taken frame stays valid until
+# the consumer takes the next one.
+class LatestFrame:
+    def __init__(self, frame: np.ndarray, stale_after_ms=100.0):
+        self.back = np.empty_like(frame)
+        self.latest = np.empty_like(frame)
+        self.front = np.empty_like(frame)
+        self.latest_timestamp_ms = 0.0
+        self.front_timestamp_ms = 0.0
+        self.sequence = 0
+        self.taken_sequence = 0
+        self.closed = False
+        self.stale_after_ms = stale_after_ms
+        self.stats = CaptureStats()
+        self.condition = threading.Condition()
+
+    @property
+    def pending(self) -> bool:
+        return self.sequence > self.taken_sequence
+
+    def back_buffer(self, shape, dtype=np.uint8) -> np.ndarray:
+        # Only the writer touches `back`. A size change reallocates it once
+        # and the new shape spreads through the other slots by swapping.
+        if self.back.shape != shape or self.back.dtype != dtype:
+            self.back = np.empty(shape, dtype)
+        return self.back
+
+    def publish(self, timestamp_ms: float):
+        with self.condition:
+            if self.sequence > self.taken_sequence:
+                self.stats.dropped += 1
+            self.back, self.latest = self.latest, self.back
+            self.latest_timestamp_ms = timestamp_ms
+            self.sequence += 1
+            self.stats.captured += 1
+            self.condition.notify_all()
+
+    def take(self, timeout=None) -> tuple[np.ndarray | None, float]:
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.sequence > self.taken_sequence
+                    or self.closed, timeout):
+                return None, 0.0
+            if self.sequence <= self.taken_sequence:
+                return None, 0.0
+            self.front, self.latest = self.latest, self.front
+            self.front_timestamp_ms = self.latest_timestamp_ms
+            self.taken_sequence = self.sequence
+            self.stats.taken += 1
+            age_ms = time.perf_counter() * 1000 - self.front_timestamp_ms
+            if age_ms > self.stale_after_ms:
+                self.stats.stale += 1
+            return self.front, self.front_timestamp_ms
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+# `index` may also be a video file, `pace` then plays it back at its frame
+# rate instead of reading it as fast as possible.
+class Camera:
+    index: int | str
+    width: int | None
+    height: int | None
+    fps: float | None
+    slot: LatestFrame | None
+
+    def __init__(self, index=0, width=None, height=None, fps=None,
+                 pace=False):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.pace = pace
+        self.frame_interval = 0.0
+        self.slot = None
+        self.timers = None
+        self.running = False
+        self.vc = None
+        self.thread = threading.Thread(name="capture", target=self.run,
+                                       daemon=True)
+
+    def open(self) -> bool:
+        self.vc = cv2.VideoCapture(self.index)
+        if not self.vc.isOpened():
+            return False
+        if self.width is not None:
+            self.vc.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        if self.height is not None:
+            self.vc.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.fps is not None:
+            self.vc.set(cv2.CAP_PROP_FPS, self.fps)
+        rval, frame = self.vc.read()
+        if not rval:
+            return False
+        stale_after_ms = 100.0
+        camera_fps = self.vc.get(cv2.CAP_PROP_FPS)
+        if camera_fps > 0:
+            stale_after_ms = 2000.0 / camera_fps
+            if self.pace:
+                self.frame_interval = 1.0 / camera_fps
+        self.slot = LatestFrame(frame, stale_after_ms)
+        return True
+
+    @property
+    def stats(self) -> CaptureStats:
+        return self.slot.stats if self.slot is not None else CaptureStats()
+
+    def start(self):
+        if self.slot is None:
+            return
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.slot is not None:
+            self.slot.close()
+
+    def take(self, timeout=None) -> tuple[np.ndarray | None, float]:
+        if self.slot is None:
+            return None, 0.0
+        return self.slot.take(timeout)
+
+    def run(self):
+        slot = self.slot
+        next_frame = time.perf_counter()
+        while self.running:
+            if self.frame_interval:
+                next_frame += self.frame_interval
+                delay = next_frame - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            start = self.timers.start() if self.timers is not None else 0.0
+            rval, frame = self.vc.read(slot.back)
+            if start:
+                self.timers.stop("capture", start)
+            if not rval:
+                break
+            if frame is not slot.back:
+                slot.back = frame
+            slot.publish(time.perf_counter() * 1000)
+        slot.close()
+        self.vc.release()
@@ -0,0 +1,116 @@
+import signal
+import sys
+import threading
+import mediapipe as mp
+from args import arg_value, arg_values, has_flag
+from calibration import load_program
+from capture import Camera
+from dispatch import ActionDispatcher, parse_rate_limits
+from filters import create_filter
+from gaze import load_gaze
+from gestures import default_gestures
+from instrumentation import StageTimers
+from ipc import ParameterServer
+from landmarks import Detail, LandmarkProcessor
+from pipeline import FacePipeline, create_landmarker_options
+from profiles import ProfileManager
+from replay import create_replay_mapper, create_transformers
+from roi import AdaptiveInput
+from scheduling import InferenceScheduler
+from tracking import LandmarkTracker
+
+
+# Runs capture, inference and mapping without the UI. The face parameters and
+# action values of every frame go out through a ParameterServer, actions are
+# also sent as input unless --no-input is given.
+def main():
+    source = arg_value("--source", default="0")
+    source = int(source) if source.isdecimal() else source
+
+    gestures = default_gestures()
+    mapper = create_replay_mapper(arg_values("--map"),
+                                  arg_value("--transformers"), gestures)
+    parameter_filter = None
+    filter_name = arg_value("--filter")
+    if filter_name is not None:
+        parameter_filter = create_filter(filter_name)
+    gaze = None
+    if has_flag("--gaze"):
+        gaze = load_gaze(arg_value("--gaze-profile"))
+    landmark_processor = LandmarkProcessor(mapper,
+                                           program=load_program(
+                                               arg_value("--profile")),
+                                           parameter_filter=parameter_filter,
+                                           gestures=gestures, gaze=gaze)
+
+    camera_width = None
+    camera_height = None
+    resolution = arg_value("--resolution", "-r")
+    if resolution is not None and "x" in resolution:
+        w, h = resolution.split("x", 1)
+        if w.isdecimal() and h.isdecimal():
+            camera_width = int(w)
+            camera_height = int(h)
+    camera_fps = None
+    fps = arg_value("--fps")
+    if fps is not None and fps.isdecimal():
+        camera_fps = int(fps)
+    camera = Camera(source, camera_width, camera_height, camera_fps,
+                    pace=isinstance(source, str))
+    if not camera.open():
+        print(f"could not open {source}")
+        return 1
+    if gaze is not None:
+        height, width = camera.slot.latest.shape[:2]
+        gaze.aspect = width / height
+
+    adaptive_input = None
+    budget = arg_value("--budget")
+    budget_ms = int(budget) if budget is not None and budget.isdecimal() \
+        else None
+    if has_flag("--crop") or budget_ms is not None:
+        adaptive_input = AdaptiveInput(has_flag("--crop"), budget_ms=budget_ms)
+
+    dispatcher = None
+    if not has_flag("--no-input"):
+        dispatcher = ActionDispatcher(
+            rate_limits=parse_rate_limits(arg_values("--rate-limit")),
+            screen=gaze.calibration.screen if gaze is not None else None)
+    server = ParameterServer(arg_value("--socket"))
+    pipeline = FacePipeline(
+        create_landmarker_options(mp.tasks.vision.RunningMode.LIVE_STREAM),
+        mapper, landmark_processor, camera, dispatcher, Detail.NONE,
+        timers=StageTimers(), adaptive_input=adaptive_input, server=server,
+        tracker=LandmarkTracker() if has_flag("--track") else None,
+        scheduler=InferenceScheduler() if has_flag("--power-save") else None)
+
+    # With a mappings profile the file decides the mappings and is reloaded
+    # whenever it changes.
+    profiles = None
+    mappings_path = arg_value("--mappings")
+    if mappings_path is not None:
+        profiles = ProfileManager(
+            mappings_path, mapper,
+            create_transformers(arg_value("--transformers"), gestures),
+            dispatcher)
+        profiles.start()
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    pipeline.start()
+    print(f"serving on {server.path}")
+    try:
+        while not stopped.is_set() and pipeline.threads[0].is_alive():
+            stopped.wait(0.5)
+    except KeyboardInterrupt:
+        pass
+    if profiles is not None:
+        profiles.stop()
+    pipeline.stop()
+    # The landmarker has to be closed before the interpreter shuts down.
+    pipeline.threads[0].join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
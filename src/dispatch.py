@@ -0,0 +1,198 @@
+import threading
+import time
+import actions
+from actions import Action, MOUSE_DIRECTIONS, MOUSE_POSITIONS, mouse
+from motion import MotionEngine
+
+
+def parse_rate_limits(specs: list[str]) -> dict[Action, float]:
+    # ACTION=N, at most N presses of the action per second.
+    rate_limits = {}
+    for spec in specs:
+        action_name, _, rate = spec.partition("=")
+        if action_name.upper() not in Action.__members__:
+            raise ValueError(f"unknown action {action_name}")
+        try:
+            events_per_second = float(rate)
+        except ValueError:
+            raise ValueError(f"invalid rate limit {spec}") from None
+        if events_per_second <= 0:
+            raise ValueError(f"invalid rate limit {spec}")
+        rate_limits[Action[action_name.upper()]] = events_per_second
+    return rate_limits
+
+
+class KeyState:
+    pressed: bool
+    last_press: float
+    next_repeat: float
+
+    def __init__(self):
+        self.pressed = False
+        self.last_press = -float("inf")
+        self.next_repeat = float("inf")
+
+
+# Sits between the mapper and pynput. Action values are submitted at camera
+# rate, the output thread turns them into input events at its own fixed rate:
+# mouse actions steer the motion engine, which sends one small move per tick,
+# and keys or buttons are held down for as long as their action stays active.
+# Absolute positions jump the pointer within `screen`, an area of x, y,
+# width and height in pixels, and only move it when they change, so the
+# physical mouse still works in between.
+class ActionDispatcher:
+    rate_hz: float
+    repeat_delay: float | None
+    repeat_interval: float | None
+    rate_limits: dict[Action, float]
+    screen: tuple[int, int, int, int] | None
+
+    def __init__(self, rate_hz=250.0, repeat_delay=None, repeat_interval=None,
+                 rate_limits={}, motion=None, screen=None):
+        self.rate_hz = rate_hz
+        self.repeat_delay = repeat_delay
+        self.repeat_interval = repeat_interval
+        self.rate_limits = dict(rate_limits)
+        self.screen = screen
+        self.position = None
+        self.last_position = None
+        self.values = {}
+        self.states = {action: KeyState() for action in Action}
+        # The old per-frame step of `mouse_sensitivity` pixels was tuned at
+        # about 30 fps, keep the same speed as the default.
+        self.motion = motion if motion is not None else MotionEngine(
+            speed=actions.mouse_sensitivity * 30)
+        self.running = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(name="dispatcher", target=self.run,
+                                       daemon=True)
+
+    def set_rate_limit(self, action: Action, events_per_second: float | None):
+        # A new dict, the output thread may be reading the current one.
+        rate_limits = dict(self.rate_limits)
+        if events_per_second is None:
+            rate_limits.pop(action, None)
+        else:
+            rate_limits[action] = events_per_second
+        self.rate_limits = rate_limits
+
+    def set_repeat(self, repeat_delay: float | None,
+                   repeat_interval: float | None):
+        with self.lock:
+            self.repeat_delay = repeat_delay
+            self.repeat_interval = repeat_interval
+
+    def set_motion(self, curve=None, speed=None):
+        with self.lock:
+            if curve is not None:
+                self.motion.curve = curve
+            if speed is not None:
+                self.motion.speed = speed
+
+    def set_screen(self, x: int, y: int, width: int, height: int):
+        with self.lock:
+            self.screen = (x, y, width, height)
+
+    def submit(self, values: dict[Action, float]):
+        move_x = 0.0
+        move_y = 0.0
+        for action, (x, y) in MOUSE_DIRECTIONS.items():
+            if action in values:
+                move_x += x * abs(values[action])
+                move_y += y * abs(values[action])
+        position = None
+        if any(action in values for action in MOUSE_POSITIONS):
+            position = [values.get(action) for action in MOUSE_POSITIONS]
+        with self.lock:
+            self.values = values
+            self.position = position
+            self.motion.set_target(move_x, move_y, time.perf_counter())
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        # The output thread releases all held keys once it has left its
+        # loop, waiting for it makes sure no tick presses a key after that.
+        self.running = False
+        if self.thread.is_alive() \
+                and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def run(self):
+        interval = 1.0 / self.rate_hz
+        deadline = time.perf_counter()
+        while self.running:
+            self.tick(time.perf_counter())
+            deadline += interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.perf_counter()
+        self.release_all()
+
+    def tick(self, now: float):
+        with self.lock:
+            values = self.values
+            dx, dy = self.motion.step(now)
+            repeat_delay = self.repeat_delay
+            repeat_interval = self.repeat_interval
+            position = self.position
+            screen = self.screen
+        if dx or dy:
+            mouse().move(dx, dy)
+        if position is not None and screen is not None:
+            self.move_to(position, screen)
+
+        for action, state in self.states.items():
+            if action in MOUSE_DIRECTIONS or action in MOUSE_POSITIONS:
+                continue
+            active = abs(values.get(action, 0.0)) > 0
+            limit = self.rate_limits.get(action)
+            limited = limit and now - state.last_press < 1.0 / limit
+            if active and not state.pressed:
+                if limited:
+                    continue
+                action.press()
+                state.pressed = True
+                state.last_press = now
+                if repeat_delay is not None and repeat_interval:
+                    state.next_repeat = now + repeat_delay
+            elif active and now >= state.next_repeat:
+                # Repeating may have been turned off while the key was held.
+                if not repeat_interval:
+                    state.next_repeat = float("inf")
+                    continue
+                state.next_repeat += repeat_interval
+                if limited:
+                    continue
+                action.press()
+                state.last_press = now
+            elif not active and state.pressed:
+                action.release()
+                state.pressed = False
+                state.next_repeat = float("inf")
+
+    def move_to(self, position, screen):
+        left, top, width, height = screen
+        target = tuple(None if value is None
+                       else round(origin + min(max(value, 0.0), 1.0) * size)
+                       for value, origin, size in zip(
+                           position, (left, top), (width - 1, height - 1)))
+        if target == self.last_position:
+            return
+        self.last_position = target
+        # An axis without a mapping stays where the pointer is.
+        if None in target:
+            current = mouse().position
+            target = tuple(current[i] if value is None else value
+                           for i, value in enumerate(target))
+        mouse().position = target
+
+    def release_all(self):
+        for action, state in self.states.items():
+            if state.pressed:
+                action.release()
+                state.pressed = False
@@ -0,0 +1,287 @@
+import ast
+import configparser
+import numpy as np
+from mapper import ParamName, Parameter, ParameterTransformer
+
+NUM_PARAMS = len(ParamName)
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+BINARY_OPS = {
+    "add": np.add,
+    "sub": np.subtract,
+    "mul": np.multiply,
+    "div": np.divide,
+    "min": np.minimum,
+    "max": np.maximum,
+    "gt": np.greater,
+    "ge": np.greater_equal,
+    "lt": np.less,
+    "le": np.less_equal,
+    "eq": np.equal,
+    "ne": np.not_equal,
+    "and": lambda a, b: (a != 0) & (b != 0),
+    "or": lambda a, b: (a != 0) | (b != 0),
+}
+UNARY_OPS = {
+    "neg": np.negative,
+    "abs": np.abs,
+    "not": lambda a: a == 0,
+}
+AST_OPS = {
+    ast.Add: "add", ast.Sub: "sub", ast.Mult: "mul", ast.Div: "div",
+    ast.Gt: "gt", ast.GtE: "ge", ast.Lt: "lt", ast.LtE: "le",
+    ast.Eq: "eq", ast.NotEq: "ne", ast.And: "and", ast.Or: "or",
+    ast.USub: "neg", ast.Not: "not",
+}
+
+
+class Node:
+    op: str
+    operands: tuple[int, ...]
+    depth: int
+
+    def __init__(self, op, operands, depth):
+        self.op = op
+        self.operands = operands
+        self.depth = depth
+
+
+# Every expression is lowered into one shared graph of register nodes.
+# Registers 0..16 hold the ParamName values, constants and node results
+# follow. Identical subexpressions share a node, and all nodes of the same
+# depth and op run as one NumPy call, so the cost per frame grows with the
+# depth of the expressions rather than with their number.
+class ExpressionKernel:
+    names: list[str]
+    outputs: np.ndarray
+
+    def __init__(self):
+        self.names = []
+        self.output_registers = []
+        self.constants = {}
+        self.nodes = []
+        self.node_index = {}
+        self.registers = None
+        self.groups = []
+        self.outputs = np.zeros(0)
+
+    def add(self, name: str, source: str) -> int:
+        try:
+            tree = ast.parse(source, mode="eval")
+        except SyntaxError as e:
+            raise ExpressionError(f"{name}: {e.msg}") from e
+        register = self.lower(tree.body, name)
+        self.names.append(name)
+        self.output_registers.append(register)
+        self.registers = None
+        return len(self.names) - 1
+
+    def constant(self, value: float) -> int:
+        if value not in self.constants:
+            # Constants are renumbered when the kernel is built, nodes refer
+            # to them through negative placeholders until then.
+            self.constants[value] = -1 - len(self.constants)
+        return self.constants[value]
+
+    def node(self, op, *operands) -> int:
+        key = (op,) + operands
+        if key not in self.node_index:
+            depth = 1 + max(self.depth_of(x) for x in operands)
+            self.nodes.append(Node(op, operands, depth))
+            self.node_index[key] = len(self.nodes) - 1
+        return NUM_PARAMS + self.node_index[key]
+
+    def depth_of(self, ref):
+        if ref < NUM_PARAMS:
+            return 0
+        return self.nodes[ref - NUM_PARAMS].depth
+
+    def fold(self, op, refs):
+        result = refs[0]
+        for ref in refs[1:]:
+            result = self.node(op, result, ref)
+        return result
+
+    def lower(self, tree, name) -> int:
+        match tree:
+            case ast.Constant(value=value) if isinstance(value, (int, float)):
+                return self.constant(float(value))
+            case ast.Name(id=id):
+                if id in ParamName.__members__:
+                    return ParamName[id].value - 1
+                if id in ("true", "True"):
+                    return self.constant(1.0)
+                if id in ("false", "False"):
+                    return self.constant(0.0)
+                raise ExpressionError(f"{name}: unknown parameter {id}")
+            case ast.UnaryOp(op=ast.UAdd(), operand=operand):
+                return self.lower(operand, name)
+            case ast.UnaryOp(op=op, operand=operand) if type(op) in AST_OPS:
+                return self.node(AST_OPS[type(op)], self.lower(operand, name))
+            case ast.BinOp(left=left, op=op, right=right) if type(op) in AST_OPS:
+                return self.node(AST_OPS[type(op)], self.lower(left, name),
+                                 self.lower(right, name))
+            case ast.BoolOp(op=op, values=values):
+                return self.fold(AST_OPS[type(op)],
+                                 [self.lower(x, name) for x in values])
+            case ast.Compare(left=left, ops=ops, comparators=comparators):
+                refs = [self.lower(left, name)] + \
+                    [self.lower(x, name) for x in comparators]
+                if any(type(op) not in AST_OPS for op in ops):
+                    raise ExpressionError(f"{name}: unsupported comparison")
+                checks = [self.node(AST_OPS[type(op)], refs[i], refs[i + 1])
+                          for i, op in enumerate(ops)]
+                return self.fold("and", checks)
+            case ast.IfExp(test=test, body=body, orelse=orelse):
+                return self.node("where", self.lower(test, name),
+                                 self.lower(body, name),
+                                 self.lower(orelse, name))
+            case ast.Call(func=ast.Name(id=function), args=args,
+                          keywords=[]):
+                return self.call(function, [self.lower(x, name) for x in args],
+                                 name)
+        raise ExpressionError(f"{name}: unsupported syntax "
+                              f"{ast.unparse(tree)!r}")
+
+    def call(self, function, args, name) -> int:
+        def arity(low, high):
+            if not low <= len(args) <= high:
+                raise ExpressionError(
+                    f"{name}: {function}() takes {low} to {high} arguments")
+
+        match function:
+            case "avg":
+                arity(1, NUM_PARAMS)
+                return self.node("div", self.fold("add", args),
+                                 self.constant(float(len(args))))
+            case "min" | "max":
+                arity(1, NUM_PARAMS)
+                return self.fold(function, args)
+            case "abs":
+                arity(1, 1)
+                return self.node("abs", args[0])
+            case "clamp":
+                arity(1, 3)
+                low = args[1] if len(args) > 1 else self.constant(0.0)
+                high = args[2] if len(args) > 2 else self.constant(1.0)
+                return self.node("min", self.node("max", args[0], low), high)
+            case "threshold":
+                arity(2, 4)
+                above = args[2] if len(args) > 2 else self.constant(1.0)
+                below = args[3] if len(args) > 3 else self.constant(0.0)
+                return self.node("where", self.node("ge", args[0], args[1]),
+                                 above, below)
+            case "hysteresis":
+                arity(3, 5)
+                above = args[3] if len(args) > 3 else self.constant(1.0)
+                below = args[4] if len(args) > 4 else self.constant(0.0)
+                return self.node("where",
+                                 self.node("hyst", args[0], args[1], args[2]),
+                                 above, below)
+            case "piecewise":
+                arity(5, 6)
+                x, high, low, above, below = args[:5]
+                inside = args[5] if len(args) > 5 else self.constant(0.0)
+                return self.node("where", self.node("ge", x, high), above,
+                                 self.node("where", self.node("le", x, low),
+                                           below, inside))
+        raise ExpressionError(f"{name}: unknown function {function}()")
+
+    def build(self):
+        # Constants take the registers after the parameters, node results
+        # come after the constants.
+        constant_values = sorted(self.constants, key=lambda v: -self.constants[v])
+        node_offset = NUM_PARAMS + len(constant_values)
+
+        def resolve(ref):
+            if ref < 0:
+                return NUM_PARAMS - 1 - ref
+            if ref >= NUM_PARAMS:
+                return ref - NUM_PARAMS + node_offset
+            return ref
+
+        self.registers = np.zeros(node_offset + len(self.nodes))
+        self.registers[NUM_PARAMS:node_offset] = constant_values
+        self.output_index = np.array(
+            [resolve(ref) for ref in self.output_registers], dtype=np.intp)
+        self.outputs = np.zeros(len(self.names))
+
+        groups = {}
+        for i, node in enumerate(self.nodes):
+            groups.setdefault((node.depth, node.op), []).append(i)
+        self.groups = []
+        for (depth, op), indices in sorted(groups.items()):
+            out = np.array([node_offset + i for i in indices], dtype=np.intp)
+            operands = np.array(
+                [[resolve(ref) for ref in self.nodes[i].operands]
+                 for i in indices], dtype=np.intp).T
+            state = np.zeros(len(indices), dtype=bool) if op == "hyst" else None
+            self.groups.append((op, out, operands, state))
+
+    def run(self, values: np.ndarray) -> np.ndarray:
+        if self.registers is None:
+            self.build()
+        registers = self.registers
+        registers[:NUM_PARAMS] = values
+        with np.errstate(all="ignore"):
+            for op, out, operands, state in self.groups:
+                args = [registers[x] for x in operands]
+                if op == "where":
+                    registers[out] = np.where(args[0] != 0, args[1], args[2])
+                elif op == "hyst":
+                    x, threshold, width = args
+                    np.copyto(state, np.where(state, x >= threshold - width / 2,
+                                              x >= threshold + width / 2))
+                    registers[out] = state
+                elif op in UNARY_OPS:
+                    registers[out] = UNARY_OPS[op](args[0])
+                else:
+                    registers[out] = BINARY_OPS[op](args[0], args[1])
+        np.take(registers, self.output_index, out=self.outputs)
+        return self.outputs
+
+    def parameters(self, index: int) -> list[ParamName]:
+        seen = set()
+        stack = [self.output_registers[index]]
+        while stack:
+            ref = stack.pop()
+            if 0 <= ref < NUM_PARAMS:
+                seen.add(ParamName(ref + 1))
+            elif ref >= NUM_PARAMS:
+                stack.extend(self.nodes[ref - NUM_PARAMS].operands)
+        return sorted(seen, key=lambda name: name.value)
+
+
+class ExpressionTransformer(ParameterTransformer):
+    kernel: ExpressionKernel
+    index: int
+
+    def __init__(self, kernel: ExpressionKernel, index: int):
+        super().__init__(lambda _: float(kernel.outputs[index]),
+                         [Parameter(name, 0.0)
+                          for name in kernel.parameters(index)])
+        self.kernel = kernel
+        self.index = index
+
+
+def load_transformers(path: str) -> dict[str, ParameterTransformer]:
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    with open(path) as file:
+        config.read_file(file)
+    if not config.has_section("transformers"):
+        return {}
+    return compile_transformers(dict(config["transformers"]))
+
+
+def compile_transformers(sources: dict[str, str]) -> dict[str, ParameterTransformer]:
+    kernel = ExpressionKernel()
+    indices = {name: kernel.add(name, source)
+               for name, source in sources.items()}
+    kernel.build()
+    return {name: ExpressionTransformer(kernel, index)
+            for name, index in indices.items()}
@@ -0,0 +1,171 @@
+import math
+import numpy as np
+from mapper import ParamName
+
+NUM_PARAMS = len(ParamName)
+
+
+def param_mask(params: list[ParamName] | None) -> np.ndarray:
+    mask = np.zeros(NUM_PARAMS, dtype=bool)
+    if params is None:
+        mask[:] = True
+    else:
+        for name in params:
+            mask[name.value - 1] = True
+    return mask
+
+
+def param_array(value) -> np.ndarray:
+    if isinstance(value, dict):
+        array = np.zeros(NUM_PARAMS)
+        for name, v in value.items():
+            array[name.value - 1] = v
+        return array
+    return np.broadcast_to(np.asarray(value, dtype=np.float64),
+                           (NUM_PARAMS,)).copy()
+
+
+# Filters keep their state for all parameters in flat arrays and smooth the
+# whole ParamName vector at once. Parameters outside of `params` pass
+# through untouched. State is reset after a gap in the tracking.
+class ParameterFilter:
+    mask: np.ndarray
+    reset_after: float
+
+    def __init__(self, params=None, reset_after=0.5):
+        self.mask = param_mask(params)
+        self.reset_after = reset_after
+        self.last_time = None
+        self.output = np.zeros(NUM_PARAMS)
+
+    def reset(self):
+        self.last_time = None
+
+    def apply(self, values: np.ndarray, t: float) -> np.ndarray:
+        dt = None if self.last_time is None else t - self.last_time
+        if dt is not None and dt <= 0:
+            return values
+        self.last_time = t
+        if dt is None or dt > self.reset_after:
+            self.start(values)
+            return values
+        filtered = self.step(values, dt)
+        np.copyto(self.output, values)
+        np.copyto(self.output, filtered, where=self.mask)
+        return self.output
+
+    def start(self, values: np.ndarray):
+        raise NotImplementedError
+
+    def step(self, values: np.ndarray, dt: float) -> np.ndarray:
+        raise NotImplementedError
+
+
+class EmaFilter(ParameterFilter):
+    def __init__(self, time_constant=0.05, params=None, reset_after=0.5):
+        super().__init__(params, reset_after)
+        self.time_constant = param_array(time_constant)
+        self.value = np.zeros(NUM_PARAMS)
+
+    def start(self, values):
+        np.copyto(self.value, values)
+
+    def step(self, values, dt):
+        alpha = -np.expm1(-dt / self.time_constant)
+        self.value += alpha * (values - self.value)
+        return self.value
+
+
+class OneEuroFilter(ParameterFilter):
+    def __init__(self, min_cutoff=1.0, beta=2.0, d_cutoff=1.0, params=None,
+                 reset_after=0.5):
+        super().__init__(params, reset_after)
+        self.min_cutoff = param_array(min_cutoff)
+        self.beta = param_array(beta)
+        self.d_cutoff = param_array(d_cutoff)
+        self.value = np.zeros(NUM_PARAMS)
+        self.derivative = np.zeros(NUM_PARAMS)
+
+    @staticmethod
+    def alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def start(self, values):
+        np.copyto(self.value, values)
+        self.derivative[:] = 0.0
+
+    def step(self, values, dt):
+        derivative = (values - self.value) / dt
+        self.derivative += self.alpha(self.d_cutoff, dt) * \
+            (derivative - self.derivative)
+        cutoff = self.min_cutoff + self.beta * np.abs(self.derivative)
+        self.value += self.alpha(cutoff, dt) * (values - self.value)
+        return self.value
+
+
+# Independent constant-velocity Kalman filter per parameter, with the 2x2
+# covariance kept as three arrays.
+class KalmanFilter(ParameterFilter):
+    def __init__(self, process_noise=50.0, measurement_noise=0.01,
+                 params=None, reset_after=0.5):
+        super().__init__(params, reset_after)
+        self.process_noise = param_array(process_noise)
+        self.measurement_noise = param_array(measurement_noise)
+        self.value = np.zeros(NUM_PARAMS)
+        self.velocity = np.zeros(NUM_PARAMS)
+        self.p00 = np.zeros(NUM_PARAMS)
+        self.p01 = np.zeros(NUM_PARAMS)
+        self.p11 = np.zeros(NUM_PARAMS)
+
+    def start(self, values):
+        np.copyto(self.value, values)
+        self.velocity[:] = 0.0
+        self.p00[:] = self.measurement_noise
+        self.p01[:] = 0.0
+        self.p11[:] = self.process_noise
+
+    def step(self, values, dt):
+        q = self.process_noise
+        self.value += self.velocity * dt
+        self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt ** 3 / 3
+        self.p01 += dt * self.p11 + q * dt ** 2 / 2
+        self.p11 += q * dt
+
+        gain0 = self.p00 / (self.p00 + self.measurement_noise)
+        gain1 = self.p01 / (self.p00 + self.measurement_noise)
+        residual = values - self.value
+        self.value += gain0 * residual
+        self.velocity += gain1 * residual
+        self.p11 -= gain1 * self.p01
+        self.p01 *= 1 - gain0
+        self.p00 *= 1 - gain0
+        return self.value
+
+
+class FilterChain:
+    filters: list[ParameterFilter]
+
+    def __init__(self, filters):
+        self.filters = filters
+
+    def reset(self):
+        for parameter_filter in self.filters:
+            parameter_filter.reset()
+
+    def apply(self, values: np.ndarray, t: float) -> np.ndarray:
+        for parameter_filter in self.filters:
+            values = parameter_filter.apply(values, t)
+        return values
+
+
+def create_filter(name: str) -> ParameterFilter | None:
+    match name.lower().replace("-", "_"):
+        case "ema":
+            return EmaFilter()
+        case "one_euro":
+            return OneEuroFilter()
+        case "kalman":
+            return KalmanFilter()
+        case _:
+            return None
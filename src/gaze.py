@@ -0,0 +1,321 @@
+import configparser
+import os
+import sys
+import threading
+import numpy as np
+from args import arg_value
+from landmarks import NUM_BLENDSHAPES, ParameterProgram
+from mapper import ParamName
+
+
+def default_gaze_path() -> str:
+    directory = os.environ.get("XDG_CONFIG_HOME",
+                               os.path.join(os.path.expanduser("~"),
+                                            ".config"))
+    return os.path.join(directory, "face_controller", "gaze.ini")
+
+
+# Per eye, left to right in the image: the iris centre, the eye corner on
+# the left and the one on the right, the upper and the lower lid. The
+# person's right eye comes first.
+EYE_LANDMARKS = np.array([[468, 33, 133, 159, 145],
+                          [473, 362, 263, 386, 374]])
+
+# What the gaze is estimated from: where the iris sits between the eye
+# corners, and how the head is turned and where it is, since the same iris
+# offset looks somewhere else once the head moves.
+FEATURE_NAMES = ["irisX", "irisY", "yaw", "pitch", "offsetX", "offsetY"]
+# The head features among ParameterProgram.features.
+HEAD_FEATURES = [0, 1, 3, 4]
+
+
+def eye_points(face_landmarks) -> np.ndarray:
+    # Only the eye landmarks, converting all 478 would take far longer than
+    # the features themselves.
+    return np.array([(face_landmarks[i].x, face_landmarks[i].y)
+                     for i in EYE_LANDMARKS.flat]).reshape(2, 5, 2)
+
+
+def eye_features(points: np.ndarray, aspect=1.0) -> np.ndarray:
+    # Takes the eye landmarks in any leading shape, (2, 5, 2) for one face
+    # or landmarks[:, EYE_LANDMARKS, :2] for a whole recording, and returns
+    # per eye the iris offset from the middle between the corners along and
+    # across the line through them, and the distance of the lids, all in
+    # eye widths. The aspect ratio of the frame makes the normalized
+    # coordinates square.
+    points = points * (aspect, 1.0)
+    iris, left, right, upper, lower = np.moveaxis(points, -2, 0)
+    along = right - left
+    across = np.stack([-along[..., 1], along[..., 0]], axis=-1)
+    width_squared = (along * along).sum(axis=-1)
+    offset = iris - (left + right) / 2
+    return np.stack([(offset * along).sum(axis=-1),
+                     (offset * across).sum(axis=-1),
+                     ((lower - upper) * across).sum(axis=-1)],
+                    axis=-1) / width_squared[..., None]
+
+
+# A linear map from the gaze features to a position on the screen, 0 to 1
+# across the area that was calibrated. The screen area in pixels and the
+# aspect ratio of the camera frames are kept with it.
+class GazeCalibration:
+    weights: np.ndarray
+    bias: np.ndarray
+    screen: tuple[int, int, int, int]
+    aspect: float
+
+    def __init__(self, weights, bias, screen, aspect):
+        self.weights = np.asarray(weights, dtype=float)
+        self.bias = np.asarray(bias, dtype=float)
+        self.screen = tuple(int(value) for value in screen)
+        self.aspect = float(aspect)
+
+    @classmethod
+    def fit(cls, features: np.ndarray, targets: np.ndarray, screen, aspect,
+            ridge=0.01) -> "GazeCalibration":
+        # Ridge regression on standardized features. The head hardly moves
+        # during a calibration, the penalty keeps its features from fitting
+        # noise.
+        mean = features.mean(axis=0)
+        std = features.std(axis=0)
+        std[std < 1e-9] = 1.0
+        standard = np.hstack([(features - mean) / std,
+                              np.ones((len(features), 1))])
+        penalty = ridge * len(features) * np.eye(standard.shape[1])
+        penalty[-1, -1] = 0.0
+        coefficients = np.linalg.solve(standard.T @ standard + penalty,
+                                       standard.T @ targets)
+        weights = coefficients[:-1] / std[:, None]
+        bias = coefficients[-1] - mean @ weights
+        return cls(weights, bias, screen, aspect)
+
+    def apply(self, features: np.ndarray) -> np.ndarray:
+        return features @ self.weights + self.bias
+
+    def save(self, path: str):
+        config = configparser.ConfigParser(interpolation=None)
+        config.optionxform = str
+        x, y, width, height = self.screen
+        config["screen"] = {"x": str(x), "y": str(y), "width": str(width),
+                            "height": str(height)}
+        config["camera"] = {"aspect": f"{self.aspect:.6g}"}
+        for axis, name in enumerate(("gazeX", "gazeY")):
+            config[name] = {feature: f"{self.weights[i, axis]:.6g}"
+                            for i, feature in enumerate(FEATURE_NAMES)}
+            config[name]["bias"] = f"{self.bias[axis]:.6g}"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as file:
+            config.write(file)
+
+    @classmethod
+    def load(cls, path: str) -> "GazeCalibration":
+        config = configparser.ConfigParser(interpolation=None)
+        config.optionxform = str
+        with open(path) as file:
+            config.read_file(file)
+        weights = [[config.getfloat(name, feature) for name in
+                    ("gazeX", "gazeY")] for feature in FEATURE_NAMES]
+        bias = [config.getfloat(name, "bias") for name in ("gazeX", "gazeY")]
+        screen = [config.getint("screen", key)
+                  for key in ("x", "y", "width", "height")]
+        return cls(weights, bias, screen, config.getfloat("camera", "aspect"))
+
+
+# Turns face landmarks into GAZE_X and GAZE_Y. The iris features come from
+# results with landmarks, the head features from the same frame's parameter
+# program. While an eye is closed the other one stands in for both, shifted
+# by how far the two were apart when both were last open, so a wink does not
+# move the pointer. With both closed the last position is kept.
+class GazeEstimator:
+    calibration: GazeCalibration | None
+    aspect: float
+    min_openness: float
+    features: np.ndarray
+    position: np.ndarray
+
+    def __init__(self, calibration=None, aspect=None, min_openness=0.12):
+        self.calibration = calibration
+        if aspect is None:
+            aspect = calibration.aspect if calibration is not None else 4 / 3
+        self.aspect = aspect
+        self.min_openness = min_openness
+        self.features = np.zeros(len(FEATURE_NAMES))
+        self.eye_offsets = np.zeros((2, 2))
+        self.position = np.full(2, 0.5)
+        self.indices = np.array([ParamName.GAZE_X.value - 1,
+                                 ParamName.GAZE_Y.value - 1], dtype=np.intp)
+
+    def update(self, face_landmarks) -> bool:
+        eyes = eye_features(eye_points(face_landmarks), self.aspect)
+        is_open = eyes[:, 2] > self.min_openness
+        if is_open.all():
+            iris = eyes[:, :2].mean(axis=0)
+            self.eye_offsets = iris - eyes[:, :2]
+        elif is_open.any():
+            iris = (eyes[:, :2] + self.eye_offsets)[is_open][0]
+        else:
+            return False
+        self.features[:2] = iris
+        return True
+
+    def estimate(self, head_features: np.ndarray,
+                 values: np.ndarray | None = None) -> np.ndarray:
+        self.features[2:] = head_features[HEAD_FEATURES]
+        if self.calibration is not None:
+            np.clip(self.calibration.apply(self.features), 0.0, 1.0,
+                    out=self.position)
+        if values is not None:
+            values[self.indices] = self.position
+        return self.position
+
+
+def load_gaze(path=None) -> GazeEstimator | None:
+    if path is None:
+        path = default_gaze_path()
+    if not os.path.exists(path):
+        print(f"No gaze calibration at {path}, run src/gaze.py first")
+        return None
+    return GazeEstimator(GazeCalibration.load(path))
+
+
+# Grid of calibration targets, 0 to 1 across the screen. The centre comes
+# first, while the user still finds their way around.
+CALIBRATION_TARGETS = np.array([
+    (0.5, 0.5), (0.1, 0.1), (0.9, 0.1), (0.9, 0.9), (0.1, 0.9),
+    (0.5, 0.1), (0.9, 0.5), (0.5, 0.9), (0.1, 0.5),
+])
+# Seconds the eyes get to settle on a new target, and to collect it.
+SETTLE_SECONDS = 0.8
+COLLECT_SECONDS = 1.0
+
+
+# Runs the landmarker on its own thread during a calibration and keeps the
+# gaze features of every frame, labelled with the target shown at the time.
+class GazeSampler:
+    target: int | None
+    aspect: float
+
+    def __init__(self, camera, landmarker_options):
+        self.camera = camera
+        self.landmarker_options = landmarker_options
+        height, width = camera.slot.latest.shape[:2]
+        self.aspect = width / height
+        self.target = None
+        self.targets = []
+        self.samples = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = threading.Thread(name="gaze", target=self.run,
+                                       daemon=True)
+
+    def start(self):
+        self.running = True
+        self.camera.start()
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.camera.stop()
+        self.thread.join()
+
+    def run(self):
+        import mediapipe as mp
+        from mediapipe.tasks.python import vision
+        estimator = GazeEstimator(aspect=self.aspect)
+        program = ParameterProgram()
+        scores = np.zeros(NUM_BLENDSHAPES)
+        last_timestamp_ms = 0
+        with vision.FaceLandmarker.create_from_options(
+                self.landmarker_options) as landmarker:
+            while self.running:
+                frame, captured_ms = self.camera.take(0.5)
+                if frame is None:
+                    if self.camera.slot.closed:
+                        break
+                    continue
+                timestamp_ms = max(int(captured_ms), last_timestamp_ms + 1)
+                last_timestamp_ms = timestamp_ms
+                result = landmarker.detect_for_video(
+                    mp.Image(image_format=mp.ImageFormat.SRGB, data=frame),
+                    timestamp_ms)
+                target = self.target
+                if target is None or not result.face_landmarks \
+                        or not estimator.update(result.face_landmarks[0]):
+                    continue
+                program.load_sources(scores,
+                                     result.facial_transformation_matrixes[0])
+                estimator.estimate(program.features)
+                with self.lock:
+                    self.targets.append(target)
+                    self.samples.append(estimator.features.copy())
+
+    def calibrate(self, screen) -> GazeCalibration | None:
+        with self.lock:
+            targets = np.array(self.targets, dtype=np.intp)
+            samples = np.array(self.samples)
+        if len(np.unique(targets)) < len(CALIBRATION_TARGETS):
+            return None
+        # Frames far from the others of their target, a glance away or a
+        # late saccade, are left out.
+        keep = np.ones(len(samples), dtype=bool)
+        for target in range(len(CALIBRATION_TARGETS)):
+            rows = targets == target
+            iris = samples[rows, :2]
+            distance = np.linalg.norm(iris - np.median(iris, axis=0), axis=1)
+            keep[rows] = distance <= 3 * np.median(distance) + 1e-6
+        return GazeCalibration.fit(samples[keep],
+                                   CALIBRATION_TARGETS[targets[keep]],
+                                   screen, self.aspect)
+
+    def error(self, calibration: GazeCalibration) -> float:
+        # Mean distance in pixels between each target and the median of
+        # where its frames land.
+        with self.lock:
+            targets = np.array(self.targets, dtype=np.intp)
+            positions = calibration.apply(np.array(self.samples))
+        _, _, width, height = calibration.screen
+        errors = [np.linalg.norm(
+            (np.median(positions[targets == target], axis=0) - point)
+            * (width, height))
+            for target, point in enumerate(CALIBRATION_TARGETS)]
+        return float(np.mean(errors))
+
+
+def main():
+    from PyQt6.QtWidgets import QApplication
+    from mediapipe.tasks.python import vision
+    from capture import Camera
+    from pipeline import create_landmarker_options
+    from ui import GazeCalibrationWindow
+
+    source = arg_value("--source", default="0")
+    path = arg_value("--out", default=default_gaze_path())
+    camera = Camera(int(source) if source.isdecimal() else source)
+    if not camera.open():
+        print(f"Could not open {source}")
+        return 1
+    sampler = GazeSampler(camera, create_landmarker_options(
+        vision.RunningMode.VIDEO))
+    app = QApplication(sys.argv)
+    window = GazeCalibrationWindow(sampler, CALIBRATION_TARGETS,
+                                   SETTLE_SECONDS, COLLECT_SECONDS)
+    sampler.start()
+    window.showFullScreen()
+    app.exec()
+    sampler.stop()
+    calibration = None
+    if window.finished:
+        calibration = sampler.calibrate(window.screen_area())
+    if calibration is None:
+        print("The calibration ended early, nothing was written")
+        return 1
+    calibration.save(path)
+    print(f"Saved the gaze calibration to {path}, targets are "
+          f"{sampler.error(calibration):.0f} pixels off on average")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+import math
+import numpy as np
+from mapper import ParamName, Parameter, ParameterTransformer
+
+NUM_PARAMS = len(ParamName)
+
+
+# Gestures are small state machines fed once per tracked frame. They keep
+# only the state of their current phase, so an update costs the same no
+# matter how long the gesture takes. Events are reported as a pulse of
+# `pulse` seconds, so a blink clicks once instead of on every frame the eyes
+# stay closed, and `refractory` debounces events that follow too closely.
+class Gesture:
+    params: list[ParamName]
+    pulse: float
+    refractory: float
+
+    def __init__(self, params, pulse=0.15, refractory=0.3):
+        self.params = params
+        self.indices = np.array([name.value - 1 for name in params],
+                                dtype=np.intp)
+        self.pulse = pulse
+        self.refractory = refractory
+        self.reset()
+
+    def reset(self):
+        self.last_event = -math.inf
+        self.until = -math.inf
+
+    def read(self, values: np.ndarray) -> float:
+        if len(self.indices) == 1:
+            return float(values[self.indices[0]])
+        return float(values[self.indices].mean())
+
+    def emit(self, t: float):
+        if t - self.last_event >= self.refractory:
+            self.last_event = t
+            self.until = t + self.pulse
+
+    def update(self, values: np.ndarray, t: float) -> float:
+        self.step(self.read(values), t)
+        return 1.0 if t < self.until else 0.0
+
+    def step(self, value: float, t: float):
+        raise NotImplementedError
+
+
+# The eyes count as closed below `closed` and as open again above `opened`,
+# the gap between both keeps noise from splitting one blink into several.
+class Blink(Gesture):
+    def __init__(self, params=None, closed=0.6, opened=1.2, min_duration=0.05,
+                 max_duration=0.4, **kwargs):
+        if params is None:
+            params = [ParamName.EYE_L_OPEN, ParamName.EYE_R_OPEN]
+        self.closed = closed
+        self.opened = opened
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        super().__init__(params, **kwargs)
+
+    def reset(self):
+        super().reset()
+        self.is_closed = False
+        self.closed_since = 0.0
+
+    def step(self, value, t):
+        if not self.is_closed:
+            if value < self.closed:
+                self.is_closed = True
+                self.closed_since = t
+        elif value > self.opened:
+            self.is_closed = False
+            duration = t - self.closed_since
+            if self.min_duration <= duration <= self.max_duration:
+                self.blinked(t)
+
+    def blinked(self, t):
+        self.emit(t)
+
+
+class DoubleBlink(Blink):
+    def __init__(self, params=None, interval=0.6, **kwargs):
+        self.interval = interval
+        super().__init__(params, **kwargs)
+
+    def reset(self):
+        super().reset()
+        self.first_blink = -math.inf
+
+    def blinked(self, t):
+        if t - self.first_blink <= self.interval:
+            self.emit(t)
+            self.first_blink = -math.inf
+        else:
+            self.first_blink = t
+
+
+class LongBlink(Blink):
+    def __init__(self, params=None, duration=0.8, **kwargs):
+        self.duration = duration
+        super().__init__(params, **kwargs)
+
+    def reset(self):
+        super().reset()
+        self.fired = False
+
+    def step(self, value, t):
+        super().step(value, t)
+        if not self.is_closed:
+            self.fired = False
+        elif not self.fired and t - self.closed_since >= self.duration:
+            self.fired = True
+            self.emit(t)
+
+    def blinked(self, t):
+        pass
+
+
+# Active for as long as the value stays above `threshold`, once it has been
+# there for `duration` seconds.
+class Hold(Gesture):
+    def __init__(self, params, threshold=0.6, duration=0.5, release=None,
+                 **kwargs):
+        self.threshold = threshold
+        self.duration = duration
+        self.release = threshold - 0.1 if release is None else release
+        super().__init__(params, **kwargs)
+
+    def reset(self):
+        super().reset()
+        self.above_since = None
+
+    def update(self, values, t):
+        value = self.read(values)
+        if self.above_since is None:
+            if value >= self.threshold:
+                self.above_since = t
+        elif value < self.release:
+            self.above_since = None
+        if self.above_since is not None \
+                and t - self.above_since >= self.duration:
+            return 1.0
+        return 0.0
+
+
+# Counts the swings of a value away from its resting position. A swing is
+# an excursion past `amplitude` on the other side of the previous one, the
+# gesture fires when the value comes back to rest after at least `swings` of
+# them within `max_duration`. The resting position follows the value slowly
+# while it is at rest, so a tilted head does not count as a swing.
+class Oscillation(Gesture):
+    def __init__(self, params, amplitude=8.0, swings=1, max_duration=1.0,
+                 rest_time_constant=2.0, refractory=1.0, **kwargs):
+        self.amplitude = amplitude
+        self.swings = swings
+        self.max_duration = max_duration
+        self.rest_time_constant = rest_time_constant
+        super().__init__(params, refractory=refractory, **kwargs)
+
+    def reset(self):
+        super().reset()
+        self.rest = None
+        self.last_time = 0.0
+        self.count = 0
+        self.side = 0
+        self.started = 0.0
+        self.armed = True
+
+    def step(self, value, t):
+        if self.rest is None:
+            self.rest = value
+            self.last_time = t
+        dt = t - self.last_time
+        self.last_time = t
+        deviation = value - self.rest
+
+        if abs(deviation) <= self.amplitude / 2:
+            if self.count >= self.swings:
+                self.emit(t)
+                self.count = 0
+                self.side = 0
+            if self.count == 0:
+                self.armed = True
+                self.rest += -math.expm1(-dt / self.rest_time_constant) * \
+                    deviation
+        elif abs(deviation) >= self.amplitude and self.armed:
+            side = 1 if deviation > 0 else -1
+            if side != self.side:
+                if self.count == 0:
+                    self.started = t
+                self.count += 1
+                self.side = side
+        if self.count and t - self.started > self.max_duration:
+            # Too slow, wait until the value is back at rest.
+            self.count = 0
+            self.side = 0
+            self.armed = False
+
+
+class Nod(Oscillation):
+    def __init__(self, params=None, amplitude=8.0, swings=1, **kwargs):
+        super().__init__(params or [ParamName.ANGLE_Y], amplitude, swings,
+                         **kwargs)
+
+
+class HeadShake(Oscillation):
+    def __init__(self, params=None, amplitude=8.0, swings=2, **kwargs):
+        super().__init__(params or [ParamName.ANGLE_X], amplitude, swings,
+                         **kwargs)
+
+
+class GestureTransformer(ParameterTransformer):
+    # Pulses have to end even if the parameters stay the same.
+    volatile = True
+
+    def __init__(self, recognizer, index: int):
+        super().__init__(lambda _: float(recognizer.outputs[index]),
+                         [Parameter(name, 0.0)
+                          for name in recognizer.gestures[index].params])
+
+
+class GestureRecognizer:
+    names: list[str]
+    gestures: list[Gesture]
+    outputs: np.ndarray
+
+    def __init__(self, gestures: dict[str, Gesture], reset_after=0.5):
+        self.names = list(gestures)
+        self.gestures = list(gestures.values())
+        self.outputs = np.zeros(len(self.gestures))
+        self.reset_after = reset_after
+        self.last_time = None
+
+    def reset(self):
+        for gesture in self.gestures:
+            gesture.reset()
+        self.outputs[:] = 0.0
+
+    def update(self, values: np.ndarray, t: float) -> np.ndarray:
+        if self.last_time is not None and t - self.last_time > self.reset_after:
+            self.reset()
+        self.last_time = t
+        for i, gesture in enumerate(self.gestures):
+            self.outputs[i] = gesture.update(values, t)
+        return self.outputs
+
+    def transformers(self) -> dict[str, ParameterTransformer]:
+        return {name: GestureTransformer(self, i)
+                for i, name in enumerate(self.names)}
+
+
+def default_gestures() -> GestureRecognizer:
+    return GestureRecognizer({
+        "Blink": Blink(),
+        "Double Blink": DoubleBlink(),
+        "Long Blink": LongBlink(),
+        "Nod": Nod(),
+        "Head Shake": HeadShake(),
+        "Mouth Hold": Hold([ParamName.MOUTH_OPEN_Y], 0.6, 0.5),
+    })
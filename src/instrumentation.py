@@ -0,0 +1,68 @@
+import time
+import numpy as np
+
+STAGES = ["capture", "scheduling", "inference", "tracking", "extraction",
+          "dispatch", "preview", "total"]
+
+
+# Keeps the last `capacity` durations of every stage in one preallocated
+# array. While disabled, start() returns 0.0 and stop() returns right away,
+# so the timers can stay in the hot path and be switched on at runtime.
+class StageTimers:
+    enabled: bool
+    names: list[str]
+    samples: np.ndarray
+    counts: np.ndarray
+
+    def __init__(self, names=STAGES, capacity=1024, enabled=False):
+        self.enabled = enabled
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.capacity = capacity
+        self.samples = np.zeros((len(self.names), capacity))
+        self.counts = np.zeros(len(self.names), dtype=np.int64)
+
+    def start(self) -> float:
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, stage: str, start: float):
+        if start:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        i = self.index[stage]
+        self.samples[i, self.counts[i] % self.capacity] = seconds
+        self.counts[i] += 1
+
+    def reset(self):
+        self.counts[:] = 0
+
+    def recent(self, stage: str) -> np.ndarray:
+        i = self.index[stage]
+        return self.samples[i, :min(self.counts[i], self.capacity)]
+
+    def latest(self, out: np.ndarray) -> np.ndarray:
+        # The last duration of every stage, NaN for stages not measured yet.
+        rows = np.flatnonzero(self.counts)
+        out[:] = np.nan
+        out[rows] = self.samples[rows, (self.counts[rows] - 1) % self.capacity]
+        return out
+
+    def percentiles(self, stage: str, q=(50, 95, 99)) -> list[float]:
+        samples = self.recent(stage)
+        if len(samples) == 0:
+            return [0.0 for _ in q]
+        return [float(x) * 1000 for x in np.percentile(samples, q)]
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        summary = {}
+        for stage in self.names:
+            count = int(self.counts[self.index[stage]])
+            if count == 0:
+                continue
+            p50, p95, p99 = self.percentiles(stage)
+            summary[stage] = {"count": count, "p50_ms": p50,
+                              "p95_ms": p95, "p99_ms": p99}
+        return summary
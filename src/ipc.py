@@ -0,0 +1,193 @@
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import numpy as np
+from actions import Action
+from mapper import ParamName
+
+# Every frame starts with the same 16 byte header, all little-endian:
+#   magic b"FACE", version u8, kind u8, count u16, timestamp_ms i64
+# PARAMETERS is followed by `count` float32 values in ParamName order,
+# ACTIONS by `count` events of an Action value (u16) and its value (float32).
+# ACTIONS only carries the actions that changed, except for the first frame
+# a client gets, which carries all of them. FACE_LOST has no payload.
+MAGIC = b"FACE"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHq")
+ACTION_EVENT = struct.Struct("<Hf")
+
+PARAMETERS = 1
+ACTIONS = 2
+FACE_LOST = 3
+
+
+def default_socket_path() -> str:
+    directory = os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir())
+    return os.path.join(directory, "face_controller.sock")
+
+
+def parameters_frame(timestamp_ms: int, values: np.ndarray) -> bytes:
+    return HEADER.pack(MAGIC, VERSION, PARAMETERS, len(values),
+                       timestamp_ms) + values.astype("<f4").tobytes()
+
+
+def actions_frame(timestamp_ms: int, values: dict[Action, float]) -> bytes:
+    return HEADER.pack(MAGIC, VERSION, ACTIONS, len(values), timestamp_ms) \
+        + b"".join(ACTION_EVENT.pack(action.value, value)
+                   for action, value in values.items())
+
+
+class Client:
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        self.pending = bytearray()
+
+
+# Publishes every processed frame to all connected local clients. Sends never
+# block the pipeline: what a client's socket does not take right away is
+# kept, and a client that falls `max_pending` bytes behind is disconnected.
+class ParameterServer:
+    path: str
+
+    def __init__(self, path=None, max_pending=65536):
+        self.path = path if path is not None else default_socket_path()
+        self.max_pending = max_pending
+        self.clients = []
+        self.lock = threading.Lock()
+        self.action_values = {}
+        self.present = False
+        self.listener = None
+        self.thread = threading.Thread(name="ipc", target=self.accept,
+                                       daemon=True)
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen()
+        self.thread.start()
+
+    def stop(self):
+        if self.listener is None:
+            return
+        self.listener.close()
+        with self.lock:
+            for client in self.clients:
+                client.connection.close()
+            self.clients = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                break
+            connection.setblocking(False)
+            client = Client(connection)
+            with self.lock:
+                self.send(client, actions_frame(0, self.action_values))
+                self.clients.append(client)
+
+    def publish(self, timestamp_ms: int, present: bool, values: np.ndarray,
+                action_values: dict[Action, float]):
+        frame = b""
+        if present:
+            frame += parameters_frame(timestamp_ms, values)
+        elif self.present:
+            frame += HEADER.pack(MAGIC, VERSION, FACE_LOST, 0, timestamp_ms)
+        self.present = present
+        if action_values is not self.action_values:
+            changed = {action: value for action, value in action_values.items()
+                       if self.action_values.get(action) != value}
+            self.action_values = action_values
+            if changed:
+                frame += actions_frame(timestamp_ms, changed)
+        if not frame:
+            return
+        with self.lock:
+            self.clients = [client for client in self.clients
+                            if self.send(client, frame)]
+
+    def send(self, client: Client, frame: bytes) -> bool:
+        try:
+            if client.pending:
+                sent = client.connection.send(client.pending)
+                del client.pending[:sent]
+            if not client.pending:
+                sent = client.connection.send(frame)
+                frame = frame[sent:]
+        except BlockingIOError:
+            pass
+        except OSError:
+            client.connection.close()
+            return False
+        client.pending += frame
+        if len(client.pending) > self.max_pending:
+            client.connection.close()
+            return False
+        return True
+
+
+class ParameterClient:
+    def __init__(self, path=None):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(path if path is not None
+                                else default_socket_path())
+
+    def close(self):
+        self.connection.close()
+
+    def receive(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.connection.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return bytes(data)
+
+    def read(self) -> tuple[int, int, np.ndarray | dict[Action, float] | None]:
+        magic, version, kind, count, timestamp_ms = HEADER.unpack(
+            self.receive(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a face controller stream")
+        if kind == PARAMETERS:
+            return kind, timestamp_ms, np.frombuffer(
+                self.receive(count * 4), "<f4")
+        if kind == ACTIONS:
+            data = self.receive(count * ACTION_EVENT.size)
+            return kind, timestamp_ms, {
+                Action(action): value
+                for action, value in ACTION_EVENT.iter_unpack(data)}
+        return kind, timestamp_ms, None
+
+
+def main():
+    client = ParameterClient(sys.argv[1] if len(sys.argv) > 1 else None)
+    try:
+        while True:
+            kind, timestamp_ms, payload = client.read()
+            if kind == PARAMETERS:
+                print(timestamp_ms, " ".join(
+                    f"{name.name}={value:.3f}"
+                    for name, value in zip(ParamName, payload)))
+            elif kind == ACTIONS:
+                for action, value in payload.items():
+                    print(timestamp_ms, f"{action.name} = {value}")
+            else:
+                print(timestamp_ms, "face lost")
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,365 @@
 import math
+from enum import Enum
 import numpy as np
+import cv2
 from mapper import ParamName
-import mediapipe as mp
-from mediapipe import solutions
-from mediapipe.framework.formats import landmark_pb2
+
+
+BLENDSHAPE_NAMES = [
+    "_neutral",
+    "browDownLeft", "browDownRight", "browInnerUp",
+    "browOuterUpLeft", "browOuterUpRight",
+    "cheekPuff", "cheekSquintLeft", "cheekSquintRight",
+    "eyeBlinkLeft", "eyeBlinkRight",
+    "eyeLookDownLeft", "eyeLookDownRight",
+    "eyeLookInLeft", "eyeLookInRight",
+    "eyeLookOutLeft", "eyeLookOutRight",
+    "eyeLookUpLeft", "eyeLookUpRight",
+    "eyeSquintLeft", "eyeSquintRight",
+    "eyeWideLeft", "eyeWideRight",
+    "jawForward", "jawLeft", "jawOpen", "jawRight",
+    "mouthClose", "mouthDimpleLeft", "mouthDimpleRight",
+    "mouthFrownLeft", "mouthFrownRight", "mouthFunnel", "mouthLeft",
+    "mouthLowerDownLeft", "mouthLowerDownRight",
+    "mouthPressLeft", "mouthPressRight", "mouthPucker", "mouthRight",
+    "mouthRollLower", "mouthRollUpper",
+    "mouthShrugLower", "mouthShrugUpper",
+    "mouthSmileLeft", "mouthSmileRight",
+    "mouthStretchLeft", "mouthStretchRight",
+    "mouthUpperUpLeft", "mouthUpperUpRight",
+    "noseSneerLeft", "noseSneerRight",
+]
+BLENDSHAPE_INDEX = {name: i for i, name in enumerate(BLENDSHAPE_NAMES)}
+NUM_BLENDSHAPES = len(BLENDSHAPE_NAMES)
+NUM_LANDMARKS = 478
+
+
+def blendshapes_to_array(blendshapes, out: np.ndarray) -> np.ndarray:
+    for blendshape in blendshapes:
+        out[BLENDSHAPE_INDEX[blendshape.category_name]] = blendshape.score
+    return out
+
+
+class LandmarkHistory:
+    # Every frame is written twice, at `head` and `head + capacity`, so the
+    # last k frames are always one contiguous slice and windows are views.
+    capacity: int
+    count: int
+    head: int
+    scores: np.ndarray
+    matrices: np.ndarray
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.count = 0
+        self.head = -1
+        self.scores = np.zeros((2 * capacity, NUM_BLENDSHAPES),
+                               dtype=np.float32)
+        self.matrices = np.zeros((2 * capacity, 4, 4), dtype=np.float32)
+        self.matrices[:] = np.eye(4, dtype=np.float32)
+
+    def __len__(self):
+        return self.count
+
+    def push(self, blendshapes, trans_mat):
+        head = (self.head + 1) % self.capacity
+        blendshapes_to_array(blendshapes, self.scores[head])
+        self.scores[head + self.capacity] = self.scores[head]
+        self.matrices[head] = trans_mat
+        self.matrices[head + self.capacity] = trans_mat
+        self.head = head
+        self.count = min(self.count + 1, self.capacity)
+
+    def push_scores(self, scores: np.ndarray, trans_mat):
+        head = (self.head + 1) % self.capacity
+        self.scores[head] = scores
+        self.scores[head + self.capacity] = scores
+        self.matrices[head] = trans_mat
+        self.matrices[head + self.capacity] = trans_mat
+        self.head = head
+        self.count = min(self.count + 1, self.capacity)
+
+    def clear(self):
+        self.count = 0
+        self.head = -1
+
+    def latest_scores(self) -> np.ndarray:
+        return self.scores[self.head + self.capacity]
+
+    def latest_matrix(self) -> np.ndarray:
+        return self.matrices[self.head + self.capacity]
+
+    def latest(self, name) -> float:
+        return float(self.scores[self.head + self.capacity,
+                                 BLENDSHAPE_INDEX[name]])
+
+    def window(self, k) -> tuple[np.ndarray, np.ndarray]:
+        k = min(k, self.count)
+        end = self.head + self.capacity + 1
+        return self.scores[end - k:end], self.matrices[end - k:end]
+
+    def score_window(self, name, k) -> np.ndarray:
+        k = min(k, self.count)
+        end = self.head + self.capacity + 1
+        return self.scores[end - k:end, BLENDSHAPE_INDEX[name]]
+
+
+MATRIX_FEATURES = ["yaw", "pitch", "roll", "offsetX", "offsetY"]
+# The matrix rows of the translation features.
+MATRIX_OFFSETS = {"offsetX": 0, "offsetY": 1}
+SOURCE_INDEX = BLENDSHAPE_INDEX | {
+    name: NUM_BLENDSHAPES + i for i, name in enumerate(MATRIX_FEATURES)}
+
+
+class Reduce(Enum):
+    MEAN = 1
+    MAX = 2
+
+
+class Channel:
+    source: str
+    scale_min: float
+    scale_max: float
+    clip_min: float
+    clip_max: float
+    invert: float | None
+    gain: float
+    offset: float
+    out_min: float
+    out_max: float
+
+    def __init__(self, source, scale_min, scale_max,
+                 clip_min=-math.inf, clip_max=math.inf, invert=None,
+                 gain=1.0, offset=0.0, out_min=-math.inf, out_max=math.inf):
+        self.source = source
+        self.scale_min = scale_min
+        self.scale_max = scale_max
+        self.clip_min = clip_min
+        self.clip_max = clip_max
+        self.invert = invert
+        self.gain = gain
+        self.offset = offset
+        self.out_min = out_min
+        self.out_max = out_max
+
+
+class ParamRule:
+    name: ParamName
+    positive: list[str]
+    negative: list[str]
+    reduce: Reduce
+    ties_positive: bool
+
+    def __init__(self, name, positive, negative=[], reduce=Reduce.MEAN,
+                 ties_positive=False):
+        self.name = name
+        self.positive = positive
+        self.negative = negative
+        self.reduce = reduce
+        self.ties_positive = ties_positive
+
+
+# Each rule reduces its positive and negative channels and outputs the
+# positive value if it wins, otherwise the negated negative value.
+DEFAULT_CHANNELS = {
+    "eyeBlinkLeft": Channel("eyeBlinkLeft", 0.04, 0.4, 0.0, 1.8, 1.8),
+    "eyeBlinkRight": Channel("eyeBlinkRight", 0.04, 0.4, 0.0, 1.8, 1.8),
+    "eyeLookInLeft": Channel("eyeLookInLeft", 0.08, 0.7, 0.0, 1.0),
+    "eyeLookInRight": Channel("eyeLookInRight", 0.08, 0.7, 0.0, 1.0),
+    "eyeLookOutLeft": Channel("eyeLookOutLeft", 0.08, 0.7, 0.0, 1.0),
+    "eyeLookOutRight": Channel("eyeLookOutRight", 0.08, 0.7, 0.0, 1.0),
+    "eyeLookUpLeft": Channel("eyeLookUpLeft", 0.06, 0.55, 0.0, 1.0),
+    "eyeLookUpRight": Channel("eyeLookUpRight", 0.06, 0.55, 0.0, 1.0),
+    "eyeLookDownLeft": Channel("eyeLookDownLeft", 0.1, 0.6, 0.0, 1.0),
+    "eyeLookDownRight": Channel("eyeLookDownRight", 0.1, 0.6, 0.0, 1.0),
+    "browInnerUp": Channel("browInnerUp", 0.5, 1.0),
+    "jawOpen": Channel("jawOpen", 0.03, 0.5, 0.0, 1.0),
+    # TODO: The smile is very jittery. Probably use the frown blendshape...
+    #       it's very inconsistent too though on my machine, might be better
+    #       with other faces?
+    "mouthSmileLeft": Channel("mouthSmileLeft", 0.05, 0.85, 0.0, 1.0),
+    "mouthSmileRight": Channel("mouthSmileRight", 0.05, 0.85, 0.0, 1.0),
+    "mouthShrugLower": Channel("mouthShrugLower", 0.1, 0.6, 0.0, 1.0),
+    "mouthLeft": Channel("mouthLeft", 0.02, 0.5, 0.0, 1.0),
+    "mouthRight": Channel("mouthRight", 0.02, 0.5, 0.0, 1.0),
+    "yaw": Channel("yaw", -0.5, 0.5, -1.0, 1.0, 0.5, -60.0, 0.0, -30.0, 30.0),
+    "pitch": Channel("pitch", -0.4, 0.4, -1.0, 1.0, 0.5,
+                     -60.0, 0.0, -30.0, 30.0),
+    "roll": Channel("roll", -0.6, 0.6, -1.0, 1.0, 0.5,
+                    -60.0, 0.0, -30.0, 30.0),
+    "offsetX": Channel("offsetX", -10.0, 10.0, 0.0, 1.0, None, 20.0, -10.0),
+    "offsetY": Channel("offsetY", -10.0, 10.0, 0.0, 1.0, None, 20.0, -10.0),
+}
+
+DEFAULT_RULES = [
+    ParamRule(ParamName.EYE_L_OPEN, ["eyeBlinkLeft"]),
+    ParamRule(ParamName.EYE_R_OPEN, ["eyeBlinkRight"]),
+    ParamRule(ParamName.EYE_BALL_X,
+              ["eyeLookInLeft", "eyeLookOutRight"],
+              ["eyeLookOutLeft", "eyeLookInRight"]),
+    ParamRule(ParamName.EYE_BALL_Y,
+              ["eyeLookUpLeft", "eyeLookUpRight"],
+              ["eyeLookDownLeft", "eyeLookDownRight"]),
+    ParamRule(ParamName.BROW_L_Y, ["browInnerUp"]),
+    ParamRule(ParamName.BROW_R_Y, ["browInnerUp"]),
+    ParamRule(ParamName.ANGLE_X, ["yaw"]),
+    ParamRule(ParamName.ANGLE_Y, ["pitch"]),
+    ParamRule(ParamName.ANGLE_Z, ["roll"]),
+    ParamRule(ParamName.MOUTH_OPEN_Y, ["jawOpen"]),
+    ParamRule(ParamName.MOUTH_FORM,
+              ["mouthSmileLeft", "mouthSmileRight"], ["mouthShrugLower"],
+              Reduce.MAX),
+    ParamRule(ParamName.MOUTH_X, ["mouthRight"], ["mouthLeft"],
+              ties_positive=True),
+    ParamRule(ParamName.BODY_ANGLE_X, ["offsetX"]),
+    ParamRule(ParamName.BODY_ANGLE_Y, ["offsetY"]),
+    ParamRule(ParamName.BODY_ANGLE_Z, ["offsetX"]),
+]
+
+
+class ParameterProgram:
+    channel_names: list[str]
+    values: np.ndarray
+
+    def __init__(self, channels=DEFAULT_CHANNELS, rules=DEFAULT_RULES):
+        self.channel_names = list(channels)
+        channel_index = {name: i for i, name in enumerate(self.channel_names)}
+        table = list(channels.values())
+
+        self.columns = np.array(
+            [SOURCE_INDEX[c.source] for c in table], dtype=np.intp)
+        self.scale_min = np.array([c.scale_min for c in table])
+        self.scale_range = np.array(
+            [c.scale_max - c.scale_min for c in table])
+        self.invert_sign = np.array(
+            [1.0 if c.invert is None else -1.0 for c in table])
+        self.invert_offset = np.array(
+            [0.0 if c.invert is None else c.invert for c in table])
+        self.clip_min = np.array([c.clip_min for c in table])
+        self.clip_max = np.array([c.clip_max for c in table])
+        self.gain = np.array([c.gain for c in table])
+        self.offset = np.array([c.offset for c in table])
+        self.out_min = np.array([c.out_min for c in table])
+        self.out_max = np.array([c.out_max for c in table])
+
+        # Single channel terms are padded to pairs, mean(a, a) and
+        # max(a, a) are both exactly a.
+        def pair(names):
+            return [channel_index[names[0]], channel_index[names[-1]]]
+
+        self.targets = np.array(
+            [rule.name.value - 1 for rule in rules], dtype=np.intp)
+        self.positive = np.array(
+            [pair(rule.positive) for rule in rules], dtype=np.intp).T
+        self.negative = np.array(
+            [pair(rule.negative or rule.positive) for rule in rules],
+            dtype=np.intp).T
+        self.use_max = np.array([rule.reduce == Reduce.MAX for rule in rules])
+        self.single = np.array([not rule.negative for rule in rules])
+        self.ties_positive = np.array(
+            [rule.ties_positive for rule in rules])
+
+        # Channels of the translation, scaled in the dtype of the matrix
+        # (float32 from MediaPipe) like the scale methods below do.
+        self.offset_channels = np.array(
+            [i for i, c in enumerate(table) if c.source in MATRIX_OFFSETS],
+            dtype=np.intp)
+        self.offset_rows = np.array(
+            [MATRIX_OFFSETS[table[i].source] for i in self.offset_channels],
+            dtype=np.intp)
+        self.offset_constants = {}
+
+        self.sources = np.zeros(len(SOURCE_INDEX))
+        self.channels = np.zeros(len(table))
+        self.features = self.sources[NUM_BLENDSHAPES:]
+        self.values = np.zeros(len(ParamName))
+
+    def load_sources(self, scores, trans_mat):
+        self.sources[:NUM_BLENDSHAPES] = scores
+        # math.atan2 rather than np.arctan2, NumPy's SIMD version is not
+        # bit-identical and the angles are only three scalars anyway. The
+        # squares are taken in the dtype of the matrix, as the scalar code
+        # did.
+        m = trans_mat
+        features = self.features
+        features[0] = -math.atan2(
+            -m[2, 0], math.sqrt((m[2, 1] ** 2) + (m[2, 2] ** 2)))
+        features[1] = -math.atan2(m[2, 1], m[2, 2])
+        features[2] = math.atan2(m[1, 0], m[0, 0])
+        features[3] = m[0, 3]
+        features[4] = m[1, 3]
+
+    def scale_offsets(self, trans_mat) -> np.ndarray:
+        # The same steps as run(), on the translation channels only and in
+        # the dtype of the matrix.
+        dtype = trans_mat.dtype
+        constants = self.offset_constants.get(dtype)
+        if constants is None:
+            i = self.offset_channels
+            constants = self.offset_constants[dtype] = [
+                np.empty(len(i), dtype)] + [
+                values[i].astype(dtype) for values in (
+                    self.scale_min, self.scale_range, self.invert_sign,
+                    self.invert_offset, self.clip_min, self.clip_max,
+                    self.gain, self.offset, self.out_min, self.out_max)]
+        (ch, scale_min, scale_range, invert_sign, invert_offset, clip_min,
+         clip_max, gain, offset, out_min, out_max) = constants
+        ch[:] = trans_mat[self.offset_rows, 3]
+        ch -= scale_min
+        ch /= scale_range
+        ch *= invert_sign
+        ch += invert_offset
+        np.clip(ch, clip_min, clip_max, out=ch)
+        ch *= gain
+        ch += offset
+        np.clip(ch, out_min, out_max, out=ch)
+        return ch
+
+    def run(self, scores, trans_mat) -> np.ndarray:
+        trans_mat = np.asarray(trans_mat)
+        self.load_sources(scores, trans_mat)
+
+        ch = self.channels
+        np.take(self.sources, self.columns, out=ch)
+        # Subtract and divide as the scale methods below do, a folded
+        # multiply-add would round differently.
+        ch -= self.scale_min
+        ch /= self.scale_range
+        ch *= self.invert_sign
+        ch += self.invert_offset
+        np.clip(ch, self.clip_min, self.clip_max, out=ch)
+        ch *= self.gain
+        ch += self.offset
+        np.clip(ch, self.out_min, self.out_max, out=ch)
+        if trans_mat.dtype != ch.dtype:
+            ch[self.offset_channels] = self.scale_offsets(trans_mat)
+
+        pos_a, pos_b = ch[self.positive]
+        neg_a, neg_b = ch[self.negative]
+        pos = np.where(self.use_max, np.maximum(pos_a, pos_b),
+                       (pos_a + pos_b) / 2)
+        neg = np.where(self.use_max, np.maximum(neg_a, neg_b),
+                       (neg_a + neg_b) / 2)
+        choose_pos = self.single | np.where(
+            self.ties_positive, pos >= neg, pos > neg)
+        self.values[self.targets] = np.where(choose_pos, pos, -neg)
+        return self.values
 
 
 class LandmarkProcessor:
 
-    # TODO: Make the history a ringbuffer of set size
-    history = {}
+    history: LandmarkHistory
+    program: ParameterProgram
     mapper = None
 
-    def __init__(self, mapper):
+    def __init__(self, mapper, history_size=64, program=None,
+                 parameter_filter=None, gestures=None, gaze=None):
         self.mapper = mapper
+        self.history = LandmarkHistory(history_size)
+        self.program = program if program is not None else ParameterProgram()
+        self.parameter_filter = parameter_filter
+        self.gestures = gestures
+        self.gaze = gaze
 
     def scale(self, value, scale_min, scale_max):
         return (value - scale_min) / (scale_max - scale_min)
@@ -25,163 +371,120 @@ class LandmarkProcessor:
         return np.clip(invert - self.scale(value, scale_min, scale_max), clip_min, clip_max)
 
     def param_scale(self, name, scale_min, scale_max):
-        return self.scale(self.history[name][-1], scale_min, scale_max)
+        return self.scale(self.history.latest(name), scale_min, scale_max)
 
     def param_scale_clip(self, name, scale_min, scale_max, clip_min, clip_max):
-        return self.scale_clip(self.history[name][-1], scale_min, scale_max, clip_min, clip_max)
+        return self.scale_clip(self.history.latest(name), scale_min, scale_max, clip_min, clip_max)
 
     def param_scale_clip_invert(self, name, scale_min, scale_max, clip_min, clip_max, invert):
-        return self.scale_clip_invert(self.history[name][-1], scale_min, scale_max, clip_min, clip_max, invert)
-
-    def process_brow_y(self):
-        y = (self.history["browInnerUp"][-1] - 0.5) * 2
-        self.mapper.set_parameter_value(ParamName.BROW_L_Y, y)
-        self.mapper.set_parameter_value(ParamName.BROW_R_Y, y)
-
-    def process_eye_blink(self):
-        self.mapper.set_parameter_value(
-            ParamName.EYE_L_OPEN,
-            self.param_scale_clip_invert(
-                "eyeBlinkLeft", 0.04, 0.4, 0.0, 1.8, 1.8)
-        )
-        self.mapper.set_parameter_value(
-            ParamName.EYE_R_OPEN,
-            self.param_scale_clip_invert(
-                "eyeBlinkRight", 0.04, 0.4, 0.0, 1.8, 1.8)
-        )
-
-    def process_face_xyz_angles(self, trans_mat):
-        self.mapper.set_parameter_value(
-            ParamName.ANGLE_X,
-            np.clip(self.scale_clip_invert(
-                -math.atan2(
-                    -trans_mat[2][0],
-                    math.sqrt((trans_mat[2][1] ** 2) + (trans_mat[2][2] ** 2))
-                ), -0.5, 0.5, -1.0, 1.0, 0.5
-            ) * -60.0, -30.0, 30.0)
-        )
-        self.mapper.set_parameter_value(
-            ParamName.ANGLE_Y,
-            np.clip(self.scale_clip_invert(
-                -math.atan2(trans_mat[2][1], trans_mat[2][2]),
-                -0.4, 0.4, -1.0, 1.0, 0.5) * -60.0, -30.0, 30.0
-            )
-        )
-        self.mapper.set_parameter_value(
-            ParamName.ANGLE_Z,
-            np.clip(self.scale_clip_invert(
-                math.atan2(trans_mat[1][0], trans_mat[0][0]),
-                -0.6, 0.6, -1.0, 1.0, 0.5) * -60.0, -30.0, 30.0
-            )
-        )
-
-    def process_mouth_xy(self):
-        self.mapper.set_parameter_value(
-            ParamName.MOUTH_OPEN_Y,
-            self.param_scale_clip("jawOpen", 0.03, 0.5, 0.0, 1.0)
-        )
-
-        # TODO: self solution for smiling is very jittery, improve this.
-        #       Probably use the frown blendshape... it's very inconsistent too
-        #       though on my machine, might be better with other faces?
-        mouthSmileLeft = self.param_scale("mouthSmileLeft", 0.05, 0.85)
-        mouthSmileRight = self.param_scale("mouthSmileRight", 0.05, 0.85)
-        mouthSmile = np.clip(max(mouthSmileLeft, mouthSmileRight), 0.0, 1.0)
-        mouthShrugLower = self.param_scale_clip(
-            "mouthShrugLower", 0.1, 0.6, 0.0, 1.0)
-        if mouthSmile > mouthShrugLower:
-            self.mapper.set_parameter_value(
-                ParamName.MOUTH_FORM, mouthSmile)
-        else:
-            self.mapper.set_parameter_value(
-                ParamName.MOUTH_FORM, -mouthShrugLower)
-
-        mouthLeft = self.param_scale_clip("mouthLeft", 0.02, 0.5, 0.0, 1.0)
-        mouthRight = self.param_scale_clip("mouthRight", 0.02, 0.5, 0.0, 1.0)
-        if mouthLeft > mouthRight:
-            self.mapper.set_parameter_value(
-                ParamName.MOUTH_X, -mouthLeft)
-        else:
-            self.mapper.set_parameter_value(
-                ParamName.MOUTH_X, mouthRight)
-
-    def process_body_xyz_angles(self, trans_mat):
-        self.mapper.set_parameter_value(ParamName.BODY_ANGLE_X,
-                                        self.scale_clip(trans_mat[0][3], -10.0, 10.0, 0.0, 1.0) * 20 - 10)
-        self.mapper.set_parameter_value(ParamName.BODY_ANGLE_Y,
-                                        self.scale_clip(trans_mat[1][3], -10.0, 10.0, 0.0, 1.0) * 20 - 10)
-        self.mapper.set_parameter_value(ParamName.BODY_ANGLE_Z,
-                                        self.scale_clip(trans_mat[0][3], -10.0, 10.0, 0.0, 1.0) * 20 - 10)
-
-    def process_eye_x(self):
-        eyeLookInLeft = self.param_scale_clip(
-            "eyeLookInLeft", 0.08, 0.7, 0.0, 1.0)
-        eyeLookInRight = self.param_scale_clip(
-            "eyeLookInRight", 0.08, 0.7, 0.0, 1.0)
-        eyeLookOutLeft = self.param_scale_clip(
-            "eyeLookOutLeft", 0.08, 0.7, 0.0, 1.0)
-        eyeLookOutRight = self.param_scale_clip(
-            "eyeLookOutRight", 0.08, 0.7, 0.0, 1.0)
-        eyeLookRight = (eyeLookInLeft + eyeLookOutRight) / 2
-        eyeLookLeft = (eyeLookOutLeft + eyeLookInRight) / 2
-        if eyeLookRight > eyeLookLeft:
-            self.mapper.set_parameter_value(
-                ParamName.EYE_BALL_X, eyeLookRight)
-        else:
-            self.mapper.set_parameter_value(
-                ParamName.EYE_BALL_X, -eyeLookLeft)
-
-    def process_eye_y(self):
-        eyeLookUpLeft = self.param_scale_clip(
-            "eyeLookUpLeft", 0.06, 0.55, 0.0, 1.0)
-        eyeLookUpRight = self.param_scale_clip(
-            "eyeLookUpRight", 0.06, 0.55, 0.0, 1.0)
-        eyeLookDownLeft = self.param_scale_clip(
-            "eyeLookDownLeft", 0.1, 0.6, 0.0, 1.0)
-        eyeLookDownRight = self.param_scale_clip(
-            "eyeLookDownRight", 0.1, 0.6, 0.0, 1.0)
-        eyeLookUp = (eyeLookUpLeft + eyeLookUpRight) / 2
-        eyeLookDown = (eyeLookDownLeft + eyeLookDownRight) / 2
-        if eyeLookUp > eyeLookDown:
-            self.mapper.set_parameter_value(
-                ParamName.EYE_BALL_Y, eyeLookUp)
-        else:
-            self.mapper.set_parameter_value(
-                ParamName.EYE_BALL_Y, -eyeLookDown)
-
-
-def draw_landmarks_on_image(rgb_image, detection_result):
-    face_landmarks_list = detection_result.face_landmarks
-    annotated_image = np.copy(rgb_image)
-
-    for idx in range(len(face_landmarks_list)):
-        face_landmarks = face_landmarks_list[idx]
-
-        face_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
-        face_landmarks_proto.landmark.extend([
-            landmark_pb2.NormalizedLandmark(x=landmark.x, y=landmark.y, z=landmark.z) for landmark in face_landmarks
-        ])
-
-        solutions.drawing_utils.draw_landmarks(
-            image=annotated_image,
-            landmark_list=face_landmarks_proto,
-            connections=mp.solutions.face_mesh.FACEMESH_TESSELATION,
-            landmark_drawing_spec=None,
-            connection_drawing_spec=mp.solutions.drawing_styles
-            .get_default_face_mesh_tesselation_style())
-        solutions.drawing_utils.draw_landmarks(
-            image=annotated_image,
-            landmark_list=face_landmarks_proto,
-            connections=mp.solutions.face_mesh.FACEMESH_CONTOURS,
-            landmark_drawing_spec=None,
-            connection_drawing_spec=mp.solutions.drawing_styles
-            .get_default_face_mesh_contours_style())
-        solutions.drawing_utils.draw_landmarks(
-            image=annotated_image,
-            landmark_list=face_landmarks_proto,
-            connections=mp.solutions.face_mesh.FACEMESH_IRISES,
-            landmark_drawing_spec=None,
-            connection_drawing_spec=mp.solutions.drawing_styles
-            .get_default_face_mesh_iris_connections_style())
-
-    return annotated_image
+        return self.scale_clip_invert(self.history.latest(name), scale_min, scale_max, clip_min, clip_max, invert)
+
+    def process_result(self, result, timestamp_ms) -> np.ndarray | None:
+        if not result.face_blendshapes:
+            self.lose_face()
+            return None
+        self.history.push(result.face_blendshapes[0],
+                          result.facial_transformation_matrixes[0])
+        # Tracked frames carry no landmarks, the gaze keeps its last iris
+        # position and follows the head only.
+        if self.gaze is not None and result.face_landmarks:
+            self.gaze.update(result.face_landmarks[0])
+        return self.process(timestamp_ms)
+
+    def lose_face(self):
+        # Without a face no new parameters arrive, a pulse or hold that was
+        # under way would keep its key pressed. The gestures start over and
+        # the mapper evaluates them again on the next dispatch.
+        if self.gestures is not None:
+            self.gestures.reset()
+            self.mapper.invalidate_volatile()
+
+    def process(self, timestamp_ms=None) -> np.ndarray:
+        values = self.program.run(self.history.latest_scores(),
+                                  self.history.latest_matrix())
+        if self.gaze is not None:
+            self.gaze.estimate(self.program.features, values)
+        if self.parameter_filter is not None and timestamp_ms is not None:
+            values = self.parameter_filter.apply(values, timestamp_ms / 1000)
+        if self.gestures is not None and timestamp_ms is not None:
+            self.gestures.update(values, timestamp_ms / 1000)
+        self.mapper.set_parameter_values(values)
+        return values
+
+
+class Detail(Enum):
+    NONE = 0
+    CONTOURS = 1
+    FULL = 2
+
+
+# BGR colors and thicknesses of mediapipe's default face mesh drawing styles.
+GRAY = (192, 192, 192)
+WHITE = (224, 224, 224)
+GREEN = (48, 255, 48)
+RED = (48, 48, 255)
+
+
+class LandmarkRenderer:
+    detail: Detail
+    layers: dict[Detail, list[tuple[np.ndarray, tuple, int]]] = {}
+
+    def __init__(self, detail=Detail.FULL):
+        self.detail = detail
+
+    @classmethod
+    def get_layers(cls, detail: Detail) -> list[tuple[np.ndarray, tuple, int]]:
+        # Connection sets are turned into (n, 2) index arrays once, drawing
+        # utilities are only imported when a preview is first drawn.
+        if detail not in cls.layers:
+            from mediapipe.solutions import face_mesh
+
+            def edges(connections):
+                return np.array(sorted(connections), dtype=np.intp)
+
+            layers = []
+            if detail == Detail.FULL:
+                layers.append(
+                    (edges(face_mesh.FACEMESH_TESSELATION), GRAY, 1))
+            if detail != Detail.NONE:
+                layers += [
+                    (edges(face_mesh.FACEMESH_FACE_OVAL
+                           | face_mesh.FACEMESH_LIPS), WHITE, 2),
+                    (edges(face_mesh.FACEMESH_LEFT_EYE
+                           | face_mesh.FACEMESH_LEFT_EYEBROW
+                           | face_mesh.FACEMESH_LEFT_IRIS), GREEN, 2),
+                    (edges(face_mesh.FACEMESH_RIGHT_EYE
+                           | face_mesh.FACEMESH_RIGHT_EYEBROW
+                           | face_mesh.FACEMESH_RIGHT_IRIS), RED, 2),
+                ]
+            cls.layers[detail] = layers
+        return cls.layers[detail]
+
+    def render(self, rgb_image, detection_result, out=None) -> np.ndarray:
+        if out is None or out.shape != rgb_image.shape:
+            out = np.empty_like(rgb_image)
+        annotated_image = out
+        np.copyto(annotated_image, rgb_image)
+        if self.detail == Detail.NONE:
+            return annotated_image
+        height, width = annotated_image.shape[:2]
+        size = np.array([width, height], dtype=np.float32)
+        layers = self.get_layers(self.detail)
+        for face_landmarks in detection_result.face_landmarks:
+            pixels = landmarks_to_array(face_landmarks)
+            pixels *= size
+            pixels = pixels.astype(np.int32)
+            for edges, color, thickness in layers:
+                cv2.polylines(annotated_image, pixels[edges], False, color,
+                              thickness, cv2.LINE_AA)
+        return annotated_image
+
+
+def landmarks_to_array(face_landmarks, dims=2) -> np.ndarray:
+    if dims == 3:
+        points = ((landmark.x, landmark.y, landmark.z)
+                  for landmark in face_landmarks)
+    else:
+        points = ((landmark.x, landmark.y) for landmark in face_landmarks)
+    return np.fromiter(points, dtype=np.dtype((np.float32, dims)),
+                       count=len(face_landmarks))
@@ -1,153 +1,163 @@
-import cv2
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-from PyQt6.QtWidgets import QApplication
-from PyQt6.QtCore import QThread
+from startup import StartupReport
+report = StartupReport()
+import threading
 import time
+from PyQt6.QtWidgets import QApplication
 import sys
-from queue import Queue
-from mapper import (ParamName, ActionParameterMapper,
-                    single, wrap_threshold,
-                    ParameterTransformer, Parameter)
-from landmarks import LandmarkProcessor, draw_landmarks_on_image
+from args import arg_value, arg_values, has_flag
+from mapper import ActionParameterMapper
+from landmarks import LandmarkProcessor, Detail
+from filters import create_filter
+from capture import Camera
+from dispatch import ActionDispatcher, parse_rate_limits
+from motion import MotionEngine, parse_curve
+import actions
+from pipeline import FacePipeline
+from presets import default_transformers
+from expressions import load_transformers
+from calibration import load_program
+from gaze import load_gaze
+from profiles import ProfileManager, default_mappings_path
+from gestures import default_gestures
+from roi import AdaptiveInput
+from scheduling import InferenceScheduler
+from tracking import LandmarkTracker
+from instrumentation import StageTimers
 from ui import FaceControllerUI
+report.mark("imports")
 
 mapper = ActionParameterMapper()
 
-frame_done = True
-annotated_image = None
-
-landmark_processor = LandmarkProcessor(mapper)
-
-
-def process_frame(result: vision.FaceLandmarkerResult, output_image: mp.Image, timestamp_ms: int):
-    global annotated_image
-    annotated_image = draw_landmarks_on_image(
-        output_image.numpy_view(), result)
-    global frame_done
-    frame_done = True
-    if result.face_blendshapes:
-        for blendshape in result.face_blendshapes[0]:
-            if blendshape.category_name not in landmark_processor.history:
-                landmark_processor.history[blendshape.category_name] = []
-            landmark_processor.history[blendshape.category_name].append(
-                blendshape.score)
-        landmark_processor.process_eye_blink()
-        landmark_processor.process_eye_x()
-        landmark_processor.process_eye_y()
-        landmark_processor.process_brow_y()
-        landmark_processor.process_face_xyz_angles(
-            result.facial_transformation_matrixes[0])
-        landmark_processor.process_mouth_xy()
-        landmark_processor.process_body_xyz_angles(
-            result.facial_transformation_matrixes[0])
-    mapper.trigger_actions()
-    landmark_processor.history.clear()
-
-
-base_options = python.BaseOptions(
-    model_asset_path='assets/face_landmarker_v2_with_blendshapes.task')
-landmarker_options = vision.FaceLandmarkerOptions(base_options=base_options,
-                                                  output_face_blendshapes=True,
-                                                  running_mode=mp.tasks.vision.RunningMode.LIVE_STREAM,
-                                                  output_facial_transformation_matrixes=True,
-                                                  result_callback=process_frame,
-                                                  num_faces=1)
-
-
-def print_action_state(image: mp.Image):
-    x = 50
-    y = 50
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    fontScale = 1
-    color = (255, 255, 255)
-    thickness = 2
-    for action in dict(mapper.map).keys():
-        y += 50
-        action_value = mapper.get_action_value(action)
-        cv2.putText(image, f"{action.name}: {action_value}", (x, y), font,
-                    fontScale, color, thickness, cv2.LINE_AA)
-
-
-class Worker(QThread):
-    def __init__(self, landmarker_options, image_queue):
-        super(Worker, self).__init__()
-        self.landmarker_options = landmarker_options
-        self.image_queue = image_queue
-        self.last_reset = time.perf_counter()
-        self.frames_this_second = 0
-        self.vc = cv2.VideoCapture(0)
-        if self.vc.isOpened():
-            rval, frame = self.vc.read()
-            self.rval = rval
-            self.frame = frame
-        else:
-            self.rval = False
-            self.frame = None
-
-    def run(self):
-        global annotated_image
-        global frame_done
-        with vision.FaceLandmarker.create_from_options(self.landmarker_options) as landmarker:
-            while self.rval:
-                if frame_done:
-                    frame_done = False
-                    mp_image = mp.Image(
-                        image_format=mp.ImageFormat.SRGB, data=self.frame)
-                    landmarker.detect_async(
-                        mp_image, int(time.perf_counter() * 1000))
-                    rval, frame = self.vc.read()
-                    self.rval = rval
-                    self.frame = frame
-                if annotated_image is not None:
-                    current_timestamp = time.perf_counter()
-                    if "--debug" in sys.argv or "-d" in sys.argv:
-                        print_action_state(annotated_image)
-                    self.image_queue.put(annotated_image)
-                    annotated_image = None
-                    if "--debug" in sys.argv or "-d" in sys.argv:
-                        if (current_timestamp - self.last_reset) > 1:
-                            print(self.frames_this_second)
-                            self.frames_this_second = 0
-                            self.last_reset = current_timestamp
-                        self.frames_this_second += 1
-
-
-image_queue = Queue()
+debug = has_flag("--debug", "-d")
+
+parameter_filter = None
+filter_name = arg_value("--filter")
+if filter_name is not None:
+    parameter_filter = create_filter(filter_name)
+gestures = default_gestures()
+gaze = None
+if has_flag("--gaze"):
+    gaze = load_gaze(arg_value("--gaze-profile"))
+landmark_processor = LandmarkProcessor(mapper,
+                                       program=load_program(
+                                           arg_value("--profile")),
+                                       parameter_filter=parameter_filter,
+                                       gestures=gestures, gaze=gaze)
+
+camera_width = None
+camera_height = None
+resolution = arg_value("--resolution", "-r")
+if resolution is not None and "x" in resolution:
+    w, h = resolution.split("x", 1)
+    if w.isdecimal() and h.isdecimal():
+        camera_width = int(w)
+        camera_height = int(h)
+camera_fps = None
+fps = arg_value("--fps")
+if fps is not None and fps.isdecimal():
+    camera_fps = int(fps)
+
+detail = Detail.FULL
+detail_name = arg_value("--detail")
+if detail_name is not None and detail_name.upper() in Detail.__members__:
+    detail = Detail[detail_name.upper()]
+
+camera = Camera(0, camera_width, camera_height, camera_fps)
+
+adaptive_input = None
+budget_ms = None
+budget = arg_value("--budget")
+if budget is not None and budget.isdecimal():
+    budget_ms = int(budget)
+if has_flag("--crop") or budget_ms is not None:
+    adaptive_input = AdaptiveInput(has_flag("--crop"), budget_ms=budget_ms)
+
+repeat_delay = None
+repeat_interval = None
+delay = arg_value("--repeat-delay")
+rate = arg_value("--repeat-rate")
+if delay is not None and delay.isdecimal():
+    repeat_delay = int(delay) / 1000
+if rate is not None and rate.isdecimal() and int(rate) > 0:
+    repeat_interval = 1 / int(rate)
+curve = None
+curve_name = arg_value("--curve")
+if curve_name is not None:
+    curve = parse_curve(curve_name)
+motion = MotionEngine(curve, speed=actions.mouse_sensitivity * 30)
+dispatcher = ActionDispatcher(repeat_delay=repeat_delay,
+                              repeat_interval=repeat_interval,
+                              rate_limits=parse_rate_limits(
+                                  arg_values("--rate-limit")),
+                              motion=motion,
+                              screen=gaze.calibration.screen
+                              if gaze is not None else None)
+
+recorder = None
+record_path = arg_value("--record")
+if record_path is not None:
+    from replay import SessionRecorder
+    recorder = SessionRecorder(record_path, has_flag("--record-video"))
+
+timers = StageTimers(enabled=has_flag("--timings"))
+
+transformers = default_transformers()
+transformers.update(gestures.transformers())
+transformers_path = arg_value("--transformers")
+if transformers_path is not None:
+    transformers.update(load_transformers(transformers_path))
+profiles = ProfileManager(
+    arg_value("--mappings", default=default_mappings_path()), mapper,
+    transformers, dispatcher)
+profiles.start()
+
+report.mark("setup")
 
 app = QApplication(sys.argv)
-worker = Worker(landmarker_options, image_queue)
-window = FaceControllerUI(worker, image_queue, mapper, {
-    "Head Up": ParameterTransformer(
-        wrap_threshold(single, 15.0, 1.0, 0.0),
-        [Parameter(ParamName.ANGLE_Y, 0.0)]),
-    "Head Down": ParameterTransformer(
-        wrap_threshold(single, -15.0, 0.0, -1.0),
-        [Parameter(ParamName.ANGLE_Y, 0.0)]),
-    "Head Right": ParameterTransformer(
-        wrap_threshold(single, 15.0, 1.0, 0.0),
-        [Parameter(ParamName.ANGLE_X, 0.0)]),
-    "Head Left": ParameterTransformer(
-        wrap_threshold(single, -15.0, 0.0, -1.0),
-        [Parameter(ParamName.ANGLE_X, 0.0)]),
-    "Body Up": ParameterTransformer(
-        wrap_threshold(single, 5.0, 1.0, 0.0),
-        [Parameter(ParamName.BODY_ANGLE_Y, 0.0)]),
-    "Body Down": ParameterTransformer(
-        wrap_threshold(single, -5.0, 0.0, -1.0),
-        [Parameter(ParamName.BODY_ANGLE_Y, 0.0)]),
-    "Body Right": ParameterTransformer(
-        wrap_threshold(single, -5.0, 0.0, -1.0),
-        [Parameter(ParamName.BODY_ANGLE_X, 0.0)]),
-    "Body Left": ParameterTransformer(
-        wrap_threshold(single, 5.0, 1.0, 0.0),
-        [Parameter(ParamName.BODY_ANGLE_X, 0.0)]),
-    "Mouth Open": ParameterTransformer(
-        wrap_threshold(single, 0.6, 1.0, 0.0),
-        [Parameter(ParamName.MOUTH_OPEN_Y, 0.0)]),
-    "Mouth Closed": ParameterTransformer(
-        wrap_threshold(single, 0.3, 0.0, 1.0),
-        [Parameter(ParamName.MOUTH_OPEN_Y, 0.0)]),
-})
+tracker = LandmarkTracker() if has_flag("--track") else None
+scheduler = InferenceScheduler() if has_flag("--power-save") else None
+pipeline = FacePipeline(None, mapper, landmark_processor, camera, dispatcher,
+                        detail, debug, recorder, timers, adaptive_input,
+                        tracker=tracker, scheduler=scheduler)
+quitting = threading.Event()
+
+
+def stop():
+    quitting.set()
+    profiles.stop()
+    pipeline.stop()
+
+
+app.aboutToQuit.connect(stop)
+window = FaceControllerUI(pipeline, mapper, transformers, profiles)
+report.mark("window")
+
+
+# The window is up before the camera or the model are ready, both are slow
+# and independent of each other, so they load side by side.
+def load():
+    camera_thread = report.run("camera", camera.open)
+    model_thread = report.run(
+        "model", pipeline.load,
+        (camera_width or 640, camera_height or 480))
+    camera_thread.join()
+    model_thread.join()
+    if quitting.is_set():
+        return
+    if camera.slot is None:
+        print("Could not open the camera")
+        return
+    if gaze is not None:
+        height, width = camera.slot.latest.shape[:2]
+        gaze.aspect = width / height
+    begin = time.perf_counter()
+    pipeline.start()
+    if pipeline.first_result.wait(10.0):
+        report.add("first result", begin, time.perf_counter())
+    if debug or timers.enabled:
+        print("Startup:")
+        print(report.summary())
+
+
+threading.Thread(name="startup", target=load, daemon=True).start()
 sys.exit(app.exec())
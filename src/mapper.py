@@ -1,5 +1,7 @@
+import threading
 from enum import Enum
 from collections.abc import Callable
+import numpy as np
 from actions import Action
 
 
@@ -19,6 +21,8 @@ class ParamName(Enum):
     EYE_BALL_Y = 13
     EYE_R_OPEN = 14
     EYE_L_OPEN = 15
+    GAZE_X = 16
+    GAZE_Y = 17
 
 
 class Parameter:
@@ -33,6 +37,11 @@ class Parameter:
 class ParameterTransformer:
     transformer: Callable[[list[Parameter]], float]
     parameter_references: list[Parameter]
+    # Set by transformers whose values come out of a shared batch kernel,
+    # the plan runs each kernel once before reading them.
+    kernel = None
+    # Re-evaluated on every frame, even if none of its parameters changed.
+    volatile = False
 
     def __init__(self, transformer, parameters=[]):
         self.parameter_references = parameters
@@ -57,6 +66,22 @@ def wrap_threshold(transformer, threshold: float, above: float, below: float) ->
     return lambda x: above if transformer(x) >= threshold else below
 
 
+def wrap_hysteresis(transformer, threshold: float, above: float, below: float, width: float) -> Callable[[list[Parameter]], float]:
+    # Like wrap_threshold, but the value has to leave a band of `width`
+    # around the threshold before the output flips back.
+    is_above = False
+
+    def hysteresis(x):
+        nonlocal is_above
+        x = transformer(x)
+        if is_above:
+            is_above = x >= threshold - width / 2
+        else:
+            is_above = x >= threshold + width / 2
+        return above if is_above else below
+    return hysteresis
+
+
 def wrap_piecewise(transformer, max: float, min: float, above: float, below: float, inside=0.0) -> Callable[[list[Parameter]], float]:
     def piecewise(x):
         x = transformer(x)
@@ -69,51 +94,182 @@ def wrap_piecewise(transformer, max: float, min: float, above: float, below: flo
     return piecewise
 
 
+def wrap_proportional(transformer, full_scale: float) -> Callable[[list[Parameter]], float]:
+    # The value as a fraction of `full_scale`, 0 to 1 on the side of zero
+    # that `full_scale` is on and 0 on the other. The result keeps the sign
+    # of `full_scale`, like the ±1 of the threshold presets, so the velocity
+    # curve sees how far the head is turned instead of only whether it is.
+    def proportional(x):
+        fraction = min(max(transformer(x) / full_scale, 0.0), 1.0)
+        return fraction if full_scale > 0 else -fraction
+    return proportional
+
+
+# Flat, immutable snapshot of the mappings. Each action row in
+# `dependencies` marks the parameters its transformer reads, so a frame only
+# re-evaluates the actions whose inputs changed. Mapping edits build a new
+# plan and swap it in as a whole.
+class EvaluationPlan:
+    actions: list[Action]
+    transformers: list[ParameterTransformer]
+    dependencies: np.ndarray
+    parameters: list[Parameter]
+    indices: np.ndarray
+    action_values: dict[Action, float]
+
+    def __init__(self, mapping: dict[Action, ParameterTransformer],
+                 parameters: dict[ParamName, Parameter]):
+        self.actions = list(mapping)
+        self.transformers = [mapping[action] for action in self.actions]
+        self.dependencies = np.zeros((len(self.actions), len(ParamName)),
+                                     dtype=bool)
+        for i, transformer in enumerate(self.transformers):
+            for param in transformer.parameter_references:
+                self.dependencies[i, param.name.value - 1] = True
+        self.parameters = list(parameters.values())
+        self.indices = np.array([param.name.value - 1
+                                 for param in self.parameters], dtype=np.intp)
+        self.kernels = list({id(t.kernel): t.kernel
+                             for t in self.transformers
+                             if t.kernel is not None}.values())
+        self.volatile = np.array([t.volatile for t in self.transformers],
+                                 dtype=bool)
+        self.changed = np.zeros(len(ParamName), dtype=bool)
+        self.dirty = np.ones(len(self.actions), dtype=bool)
+        self.action_values = {}
+
+    def evaluate(self, values: np.ndarray) -> dict[Action, float]:
+        dirty = self.dirty | (self.dependencies & self.changed).any(axis=1)
+        self.changed[:] = False
+        self.dirty[:] = False
+        if dirty.any():
+            # A new dict per change, callers may keep the previous one.
+            action_values = dict(self.action_values)
+            for kernel in self.kernels:
+                kernel.run(values)
+            for i in np.flatnonzero(dirty):
+                action_values[self.actions[i]] = \
+                    self.transformers[i].get_action_value()
+            self.action_values = action_values
+        return self.action_values
+
+
 class ActionParameterMapper:
     map: dict[Action, ParameterTransformer]
     parameters: dict[ParamName, Parameter]
+    values: np.ndarray
+    plan: EvaluationPlan
 
     def __init__(self):
         self.map = {}
         self.parameters = {}
+        self.values = np.zeros(len(ParamName))
+        self.plan = EvaluationPlan(self.map, self.parameters)
+        self.lock = threading.Lock()
 
     def get_action_value(self, action: Action) -> float:
-        return self.map[action].get_action_value()
+        return self.action_values()[action]
+
+    def update_plan(self, mapping: dict[Action, ParameterTransformer],
+                    parameters: dict[ParamName, Parameter]):
+        plan = EvaluationPlan(mapping, parameters)
+        with self.lock:
+            # Under the lock, so the parameters start from the same frame
+            # the plan is first evaluated on.
+            for param, value in zip(plan.parameters,
+                                    self.values[plan.indices].tolist()):
+                param.value = value
+            self.map = mapping
+            self.parameters = parameters
+            self.plan = plan
 
     def create_mapping(self, action: Action, parameter_transformer: ParameterTransformer):
-        self.map[action] = parameter_transformer
+        mapping = dict(self.map)
+        mapping[action] = parameter_transformer
+        parameters = dict(self.parameters)
         for param in parameter_transformer.parameter_references:
-            self.set_parameter(param, action)
+            self.set_parameter(param, action, mapping, parameters)
+        self.update_plan(mapping, parameters)
+
+    def remove_mapping(self, action: Action):
+        if action in self.map:
+            mapping = dict(self.map)
+            del mapping[action]
+            self.replace_mappings(mapping)
+
+    def replace_mappings(self, mapping: dict[Action, ParameterTransformer]):
+        # Builds the parameters of a whole new set of mappings. Parameters the
+        # current plan already has are reused, so transformers that stay
+        # mapped keep reading live values until the new plan is swapped in.
+        parameters = {}
+        for transformer in mapping.values():
+            references = transformer.parameter_references
+            for i, param in enumerate(references):
+                shared = parameters.get(param.name,
+                                        self.parameters.get(param.name, param))
+                parameters[param.name] = shared
+                references[i] = shared
+        self.update_plan(dict(mapping), parameters)
 
     def create_empty_mapping(self, action: Action, transformer: Callable[[list[Parameter]], float]):
-        self.map[action] = ParameterTransformer(transformer, [])
+        mapping = dict(self.map)
+        mapping[action] = ParameterTransformer(transformer, [])
+        self.update_plan(mapping, dict(self.parameters))
 
-    def set_parameter(self, parameter: Parameter, action: Action):
-        if action in self.map:
-            if parameter.name in self.parameters:
-                parameter = self.parameters[parameter.name]
-                param_references = self.map[action].parameter_references
+    def set_parameter(self, parameter: Parameter, action: Action,
+                      mapping=None, parameters=None):
+        update = mapping is None
+        mapping = mapping if mapping is not None else dict(self.map)
+        parameters = parameters if parameters is not None else dict(self.parameters)
+        if action in mapping:
+            if parameter.name in parameters:
+                parameter = parameters[parameter.name]
+                param_references = mapping[action].parameter_references
                 for i, param in enumerate(param_references):
                     if param.name == parameter.name:
                         param_references[i] = parameter
                         break
             else:
-                self.parameters[parameter.name] = parameter
+                parameters[parameter.name] = parameter
+        if update:
+            self.update_plan(mapping, parameters)
 
     def add_parameter(self, name: ParamName, action: Action):
         if action in self.map:
-            if name in self.parameters:
-                parameter = self.parameters[name]
-                self.map[action].parameter_references.append(parameter)
+            parameters = dict(self.parameters)
+            if name in parameters:
+                parameter = parameters[name]
             else:
                 parameter = Parameter(name, 0.0)
-                self.map[action].parameter_references.append(parameter)
-                self.parameters[name] = parameter
+                parameters[name] = parameter
+            self.map[action].parameter_references.append(parameter)
+            self.update_plan(dict(self.map), parameters)
 
     def set_parameter_value(self, name: ParamName, value: float):
-        if name in self.parameters:
-            self.parameters[name].value = value
+        values = self.values.copy()
+        values[name.value - 1] = value
+        self.set_parameter_values(values)
+
+    def set_parameter_values(self, values):
+        with self.lock:
+            plan = self.plan
+            plan.changed |= values != self.values
+            plan.dirty |= plan.volatile
+            np.copyto(self.values, values)
+            for param, value in zip(plan.parameters,
+                                    self.values[plan.indices].tolist()):
+                param.value = value
+
+    def invalidate_volatile(self):
+        # Volatile transformers are evaluated again on the next call of
+        # action_values(), even without new parameter values.
+        with self.lock:
+            self.plan.dirty |= self.plan.volatile
+
+    def action_values(self) -> dict[Action, float]:
+        with self.lock:
+            return self.plan.evaluate(self.values)
 
     def trigger_actions(self):
-        for action, transformer in dict(self.map).items():
-            action.trigger(transformer.get_action_value())
+        for action, value in self.action_values().items():
+            action.trigger(value)
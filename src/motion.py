@@ -0,0 +1,116 @@
+import math
+from enum import Enum
+import numpy as np
+
+
+class Curve(Enum):
+    LINEAR = 1
+    QUADRATIC = 2
+    LUT = 3
+
+
+class VelocityCurve:
+    kind: Curve
+    dead_zone: float
+    full_scale: float
+    lut: np.ndarray | None
+
+    def __init__(self, kind=Curve.LINEAR, dead_zone=0.05, full_scale=1.0,
+                 lut=None):
+        self.kind = kind
+        self.dead_zone = dead_zone
+        self.full_scale = full_scale
+        self.lut = None
+        self.lut_x = None
+        if lut is not None:
+            self.lut = np.asarray(lut, dtype=np.float64)
+            self.lut_x = np.linspace(0.0, 1.0, len(self.lut))
+
+    def apply(self, magnitude: float) -> float:
+        # Input past the dead zone is rescaled to 0..1 so the curve starts
+        # from zero speed at its edge instead of jumping.
+        m = magnitude / self.full_scale
+        if m <= self.dead_zone:
+            return 0.0
+        m = min((m - self.dead_zone) / (1.0 - self.dead_zone), 1.0)
+        match self.kind:
+            case Curve.QUADRATIC:
+                return m * m
+            case Curve.LUT:
+                return float(np.interp(m, self.lut_x, self.lut))
+            case _:
+                return m
+
+
+def parse_curve(text: str) -> VelocityCurve | None:
+    if text.upper() in Curve.__members__ and text.upper() != "LUT":
+        return VelocityCurve(Curve[text.upper()])
+    try:
+        lut = [float(x) for x in text.split(",")]
+    except ValueError:
+        return None
+    if len(lut) < 2:
+        return None
+    return VelocityCurve(Curve.LUT, lut=lut)
+
+
+# Turns the mouse action values into a cursor velocity. Targets arrive at
+# inference rate, the dispatcher steps the engine at its own much higher rate
+# and the velocity is interpolated from the previous target to the new one
+# over one measured inference interval, so pointer speed does not depend on
+# how fast the tracker runs.
+class MotionEngine:
+    curve: VelocityCurve
+    speed: float
+    timeout: float
+
+    def __init__(self, curve=None, speed=300.0, timeout=0.25):
+        self.curve = curve if curve is not None else VelocityCurve()
+        self.speed = speed
+        self.timeout = timeout
+        self.start_velocity = (0.0, 0.0)
+        self.target_velocity = (0.0, 0.0)
+        self.velocity = (0.0, 0.0)
+        self.target_time = None
+        self.interval = 1 / 30
+        self.last_step = None
+        self.remainder_x = 0.0
+        self.remainder_y = 0.0
+
+    def set_target(self, x: float, y: float, now: float):
+        magnitude = math.hypot(x, y)
+        if magnitude > 0:
+            gain = self.curve.apply(magnitude) * self.speed / magnitude
+            x *= gain
+            y *= gain
+        if self.target_time is not None:
+            self.interval += 0.2 * (now - self.target_time - self.interval)
+        self.start_velocity = self.velocity
+        self.target_velocity = (x, y)
+        self.target_time = now
+
+    def step(self, now: float) -> tuple[int, int]:
+        if self.last_step is None or self.target_time is None:
+            self.last_step = now
+            return 0, 0
+        dt = now - self.last_step
+        self.last_step = now
+
+        elapsed = now - self.target_time
+        if elapsed > self.timeout:
+            # No new tracking results, stop instead of drifting forever.
+            self.velocity = (0.0, 0.0)
+            return 0, 0
+        alpha = min(elapsed / self.interval, 1.0) if self.interval > 0 else 1.0
+        start_x, start_y = self.start_velocity
+        target_x, target_y = self.target_velocity
+        self.velocity = (start_x + (target_x - start_x) * alpha,
+                         start_y + (target_y - start_y) * alpha)
+
+        self.remainder_x += self.velocity[0] * dt
+        self.remainder_y += self.velocity[1] * dt
+        dx = int(self.remainder_x)
+        dy = int(self.remainder_y)
+        self.remainder_x -= dx
+        self.remainder_y -= dy
+        return dx, dy
@@ -0,0 +1,489 @@
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import TYPE_CHECKING
+import cv2
+import numpy as np
+from capture import Camera, LatestFrame
+from dispatch import ActionDispatcher
+from instrumentation import StageTimers
+from mapper import ActionParameterMapper
+from landmarks import LandmarkProcessor, LandmarkRenderer, Detail
+from roi import AdaptiveInput
+from scheduling import InferenceScheduler
+from telemetry import Telemetry
+from tracking import LandmarkTracker, TrackedResult
+
+if TYPE_CHECKING:
+    import mediapipe as mp
+    from mediapipe.tasks.python import vision
+
+
+MODEL_PATH = 'assets/face_landmarker_v2_with_blendshapes.task'
+
+
+# MediaPipe takes longer to import than everything else together, so it is
+# only imported once a landmarker is actually needed.
+def create_landmarker_options(running_mode, num_faces=1, result_callback=None):
+    from mediapipe.tasks import python
+    from mediapipe.tasks.python import vision
+    base_options = python.BaseOptions(model_asset_path=MODEL_PATH)
+    return vision.FaceLandmarkerOptions(base_options=base_options,
+                                        output_face_blendshapes=True,
+                                        running_mode=running_mode,
+                                        output_facial_transformation_matrixes=True,
+                                        result_callback=result_callback,
+                                        num_faces=num_faces)
+
+
+class Overflow(Enum):
+    BLOCK = 1
+    DROP_OLDEST = 2
+    DROP_NEWEST = 3
+
+
+class StageQueue:
+    maxsize: int
+    overflow: Overflow
+    dropped: int
+
+    def __init__(self, maxsize=1, overflow=Overflow.DROP_OLDEST):
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = False
+        self.items = deque()
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item) -> bool:
+        with self.condition:
+            while len(self.items) >= self.maxsize and not self.closed:
+                if self.overflow == Overflow.DROP_OLDEST:
+                    self.items.popleft()
+                    self.dropped += 1
+                elif self.overflow == Overflow.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                else:
+                    self.condition.wait()
+            if self.closed:
+                return False
+            self.items.append(item)
+            self.condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.items or self.closed, timeout):
+                return None
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class Stage(threading.Thread):
+    def __init__(self, name, handler, inbox: StageQueue,
+                 outboxes: list[StageQueue] = [],
+                 timers: StageTimers | None = None):
+        super().__init__(name=name, daemon=True)
+        self.handler = handler
+        self.inbox = inbox
+        self.outboxes = outboxes
+        self.timers = timers
+
+    def run(self):
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                break
+            start = self.timers.start() if self.timers is not None else 0.0
+            result = self.handler(item)
+            if start:
+                self.timers.stop(self.name, start)
+            if result is not None:
+                for outbox in self.outboxes:
+                    outbox.put(result)
+
+
+class Detection:
+    result: "vision.FaceLandmarkerResult"
+    image: "mp.Image"
+    timestamp_ms: int
+
+    def __init__(self, result, image, timestamp_ms):
+        self.result = result
+        self.image = image
+        self.timestamp_ms = timestamp_ms
+
+
+# camera thread -> inference -> parameter extraction -> action dispatch
+#                     \-> preview rendering
+# Every stage owns a thread. Queues between stages are bounded and keep the
+# newest item, so a slow preview can never hold back the action path.
+class FacePipeline:
+    def __init__(self,
+                 landmarker_options: "vision.FaceLandmarkerOptions | None",
+                 mapper: ActionParameterMapper,
+                 landmark_processor: LandmarkProcessor,
+                 camera: Camera,
+                 dispatcher: ActionDispatcher | None,
+                 detail=Detail.FULL,
+                 debug=False,
+                 recorder=None,
+                 timers=None,
+                 adaptive_input: AdaptiveInput | None = None,
+                 server=None,
+                 tracker: LandmarkTracker | None = None,
+                 scheduler: InferenceScheduler | None = None,
+                 telemetry: Telemetry | None = None):
+        # Without options the landmarker is created for the live stream by
+        # load(), which may run in the background while the UI comes up.
+        self.landmarker_options = landmarker_options
+        self.landmarker = None
+        self.warming_up = False
+        self.first_result = threading.Event()
+        self.mapper = mapper
+        self.landmark_processor = landmark_processor
+        self.camera = camera
+        self.dispatcher = dispatcher
+        self.renderer = LandmarkRenderer(detail)
+        self.preview = LatestFrame(np.zeros((1, 1, 3), np.uint8))
+        self.preview_visible = threading.Event()
+        self.preview_size = (0, 0)
+        self.annotated_image = None
+        self.debug = debug
+        self.recorder = recorder
+        self.timers = timers if timers is not None else StageTimers()
+        self.camera.timers = self.timers
+        self.adaptive_input = adaptive_input
+        self.server = server
+        self.tracker = tracker
+        self.scheduler = scheduler
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.extracted_ms = 0
+        self.inference_ms = 0.0
+        self.frame_interval_ms = 0.0
+        self.submit_time = 0.0
+        self.submit_clock = 0.0
+        self.submit_region = None
+        self.submit_frame = None
+        self.running = False
+        self.started = False
+        self.stopped = False
+        self.state_lock = threading.Lock()
+        self.result_ready = threading.Event()
+        self.result_ready.set()
+        self.last_timestamp_ms = 0
+        self.last_reset = time.perf_counter()
+        self.frames_this_second = 0
+
+        self.detections = StageQueue(2, Overflow.DROP_OLDEST)
+        self.dispatches = StageQueue(1, Overflow.DROP_OLDEST)
+        self.previews = StageQueue(1, Overflow.DROP_OLDEST)
+        # Recording must never stall tracking, results that do not fit are
+        # dropped and counted instead.
+        self.recordings = StageQueue(16, Overflow.DROP_NEWEST)
+
+        self.threads = [
+            threading.Thread(name="inference", target=self.run_inference,
+                             daemon=True),
+            Stage("extraction", self.extract, self.detections,
+                  [self.dispatches], self.timers),
+            Stage("dispatch", self.dispatch, self.dispatches, [],
+                  self.timers),
+            Stage("preview", self.render_preview, self.previews, [],
+                  self.timers),
+        ]
+        self.recording_stage = None
+        if recorder is not None:
+            self.recording_stage = Stage("recording", self.record,
+                                         self.recordings)
+            self.threads.append(self.recording_stage)
+
+    def start(self):
+        # Threads only start once, a second call would build a second
+        # landmarker before failing.
+        with self.state_lock:
+            if self.started or self.stopped:
+                return
+            self.started = True
+        self.running = True
+        self.camera.start()
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+        if self.server is not None:
+            self.server.start()
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.state_lock:
+            self.stopped = True
+        self.close_unused_landmarker()
+        self.running = False
+        self.camera.stop()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        if self.server is not None:
+            self.server.stop()
+        for queue in (self.detections, self.dispatches,
+                      self.previews, self.recordings):
+            queue.close()
+        self.preview.close()
+        if self.recording_stage is not None:
+            # The window may close before the model finished loading and
+            # the stages were ever started.
+            if self.recording_stage.is_alive():
+                self.recording_stage.join()
+            self.recorder.close()
+        self.result_ready.set()
+
+    def load(self, warm_up_size=(640, 480)):
+        import mediapipe as mp
+        from mediapipe.tasks.python import vision
+        if self.landmarker_options is None:
+            self.landmarker_options = create_landmarker_options(
+                vision.RunningMode.LIVE_STREAM)
+        self.landmarker_options.result_callback = self.on_result
+        self.landmarker = vision.FaceLandmarker.create_from_options(
+            self.landmarker_options)
+        # The first inference allocates the runtime's buffers and is slower
+        # than the ones after it, pay for it on an empty frame before the
+        # camera delivers.
+        width, height = warm_up_size
+        self.warming_up = True
+        self.result_ready.clear()
+        self.landmarker.detect_async(
+            mp.Image(image_format=mp.ImageFormat.SRGB,
+                     data=np.zeros((height, width, 3), np.uint8)), 0)
+        self.result_ready.wait(5.0)
+        self.warming_up = False
+        self.result_ready.set()
+        # The window may have closed while the model was loading.
+        self.close_unused_landmarker()
+
+    def close_unused_landmarker(self):
+        # Once started, run_inference() closes the landmarker on its way
+        # out. A pipeline stopped before that has to close it here, or the
+        # graph and its threads stay behind.
+        with self.state_lock:
+            if self.stopped and not self.started \
+                    and self.landmarker is not None:
+                self.landmarker.close()
+                self.landmarker = None
+
+    def run_inference(self):
+        import mediapipe as mp
+        if self.landmarker is None:
+            self.load()
+        with self.landmarker as landmarker:
+            while self.running:
+                # Only one frame is in flight, the result callback frees the
+                # slot while the camera thread keeps capturing. The timeout
+                # covers frames MediaPipe drops without a result.
+                if self.tracker is None:
+                    self.result_ready.wait(1.0)
+                frame, captured_ms = self.camera.take()
+                if frame is None:
+                    break
+                timestamp_ms = max(int(captured_ms),
+                                   self.last_timestamp_ms + 1)
+                self.frame_interval_ms += 0.1 * (
+                    timestamp_ms - self.last_timestamp_ms
+                    - self.frame_interval_ms)
+                self.last_timestamp_ms = timestamp_ms
+                if self.tracker is not None:
+                    self.tracker.apply_anchor(*frame.shape[:2])
+                    if not self.track_while_busy(frame, timestamp_ms):
+                        continue
+                    self.tracker.apply_anchor(*frame.shape[:2])
+                if self.scheduler is not None \
+                        and not self.schedule(frame, timestamp_ms):
+                    continue
+                if self.tracker is not None:
+                    self.tracker.keyframe(frame, timestamp_ms)
+                self.result_ready.clear()
+                image = frame
+                self.submit_region = None
+                self.submit_frame = None
+                if self.adaptive_input is not None:
+                    image, self.submit_region = \
+                        self.adaptive_input.prepare(frame)
+                    # The preview and recordings still get the whole frame.
+                    if image is not frame and (self.preview_visible.is_set()
+                                               or self.recorder is not None):
+                        self.submit_frame = mp.Image(
+                            image_format=mp.ImageFormat.SRGB, data=frame)
+                mp_image = mp.Image(image_format=mp.ImageFormat.SRGB,
+                                    data=image)
+                self.submit_clock = time.perf_counter()
+                self.submit_time = self.timers.start()
+                landmarker.detect_async(mp_image, timestamp_ms)
+
+    def track_while_busy(self, frame: np.ndarray, timestamp_ms: int) -> bool:
+        # Frames that arrive while the landmarker is busy are tracked instead
+        # of dropped. Returns whether the frame should go to the landmarker
+        # too, which it does if the landmarker frees up before the next
+        # frame is due, instead of sitting idle until then.
+        elapsed_ms = (time.perf_counter() - self.submit_clock) * 1000
+        if self.result_ready.is_set() or elapsed_ms > 1000:
+            return True
+        self.track(frame, timestamp_ms)
+        elapsed_ms = (time.perf_counter() - self.submit_clock) * 1000
+        remaining_ms = self.inference_ms - elapsed_ms
+        if remaining_ms >= self.frame_interval_ms:
+            return False
+        return self.result_ready.wait(max(remaining_ms, 0.0) / 1000 + 0.002)
+
+    def schedule(self, frame: np.ndarray, timestamp_ms: int) -> bool:
+        # Results are wanted while anything acts on them: a mapping, the
+        # preview, a recording or a client of the parameter server. While an
+        # action is held every frame is needed, the values last dispatched
+        # tell without evaluating the mappings again.
+        start = self.timers.start()
+        wanted = (bool(self.mapper.map) or self.preview_visible.is_set()
+                  or self.recorder is not None
+                  or (self.server is not None and bool(self.server.clients)))
+        held = any(self.mapper.plan.action_values.values())
+        infer = self.scheduler.should_infer(frame, timestamp_ms, wanted,
+                                            held)
+        self.timers.stop("scheduling", start)
+        return infer
+
+    def track(self, frame: np.ndarray, timestamp_ms: int):
+        start = self.timers.start()
+        result = self.tracker.track(frame, timestamp_ms)
+        self.timers.stop("tracking", start)
+        if result is not None:
+            self.detections.put(Detection(result, None, timestamp_ms))
+
+    def on_result(self, result: "vision.FaceLandmarkerResult",
+                  output_image: "mp.Image", timestamp_ms: int):
+        if self.warming_up:
+            self.result_ready.set()
+            return
+        self.timers.stop("inference", self.submit_time)
+        latency_ms = (time.perf_counter() - self.submit_clock) * 1000
+        self.inference_ms += 0.1 * (latency_ms - self.inference_ms)
+        if self.submit_region is not None:
+            self.adaptive_input.update(result, self.submit_region,
+                                       latency_ms)
+        if self.submit_frame is not None:
+            output_image = self.submit_frame
+        detection = Detection(result, output_image, timestamp_ms)
+        extracted = detection
+        if self.scheduler is not None:
+            self.scheduler.update(result, timestamp_ms)
+        if self.tracker is not None:
+            self.tracker.set_result(result, timestamp_ms)
+            # Frames after this one were already tracked, keep their newer
+            # pose and only take the blendshapes from the result.
+            latest_ms, matrix = self.tracker.latest_ms, self.tracker.matrix
+            if latest_ms > timestamp_ms and result.face_blendshapes:
+                extracted = Detection(
+                    TrackedResult(result.face_blendshapes, matrix),
+                    output_image, latest_ms)
+        self.result_ready.set()
+        self.first_result.set()
+        self.detections.put(extracted)
+        if self.preview_visible.is_set():
+            self.previews.put(detection)
+        if self.recorder is not None:
+            self.recordings.put(detection)
+
+    def extract(self, detection: Detection):
+        # Results and tracked frames come from different threads and can
+        # arrive out of order, the filters need time to move forward.
+        timestamp_ms = max(detection.timestamp_ms, self.extracted_ms + 1)
+        self.extracted_ms = timestamp_ms
+        self.landmark_processor.process_result(detection.result,
+                                               timestamp_ms)
+        return detection
+
+    def record(self, detection: Detection):
+        self.recorder.add(detection.timestamp_ms, detection.result,
+                          detection.image.numpy_view())
+
+    def dispatch(self, detection: Detection):
+        action_values = self.mapper.action_values()
+        if self.dispatcher is not None:
+            self.dispatcher.submit(action_values)
+        if self.server is not None:
+            self.server.publish(detection.timestamp_ms,
+                                bool(detection.result.face_blendshapes),
+                                self.mapper.values, action_values)
+        if self.timers.enabled:
+            self.timers.add("total", time.perf_counter()
+                            - detection.timestamp_ms / 1000)
+        if self.telemetry.enabled:
+            self.telemetry.add(detection.timestamp_ms, self.mapper.values,
+                               action_values, self.timers)
+        if self.debug:
+            self.print_stats()
+
+    def print_stats(self):
+        # Counts the frames that made it through the whole pipeline, the
+        # preview may skip some.
+        current_timestamp = time.perf_counter()
+        if (current_timestamp - self.last_reset) > 1:
+            stats = self.camera.stats
+            print(f"{self.frames_this_second} fps, "
+                  f"{stats.dropped} dropped, {stats.stale} stale")
+            for stage, timing in self.timers.summary().items():
+                print(f"  {stage}: {timing['p50_ms']:.1f} ms p50, "
+                      f"{timing['p95_ms']:.1f} ms p95")
+            if self.scheduler is not None:
+                stats = self.scheduler.stats(self.inference_ms)
+                print(f"  {self.scheduler.mode.name.lower()}, "
+                      f"{stats['skipped_fraction']:.0%} of frames "
+                      f"skipped, {stats['inference_s_saved']:.1f} s "
+                      "of inference saved")
+            self.frames_this_second = 0
+            self.last_reset = current_timestamp
+        self.frames_this_second += 1
+
+    def set_preview_visible(self, visible: bool):
+        if visible:
+            self.preview_visible.set()
+        else:
+            self.preview_visible.clear()
+
+    def set_preview_detail(self, detail: Detail):
+        self.renderer.detail = detail
+
+    def set_preview_size(self, width: int, height: int):
+        self.preview_size = (width, height)
+
+    def render_preview(self, detection: Detection):
+        # Nothing is drawn while the window is hidden or still showing the
+        # last frame, the next result will be fresher anyway.
+        label_width, label_height = self.preview_size
+        if (not self.preview_visible.is_set() or self.preview.pending
+                or label_width <= 0 or label_height <= 0):
+            return
+        image = detection.image.numpy_view()
+        if self.renderer.detail != Detail.NONE:
+            image = self.annotated_image = self.renderer.render(
+                image, detection.result, self.annotated_image)
+
+        # Scaling to the label happens here instead of on the GUI thread,
+        # straight into a reused buffer of the preview exchange.
+        height, width = image.shape[:2]
+        scale = min(label_width / width, label_height / height)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        back = self.preview.back_buffer(
+            (size[1], size[0]) + image.shape[2:], image.dtype)
+        cv2.resize(image, size, back, interpolation=cv2.INTER_LINEAR)
+        self.preview.publish(detection.timestamp_ms)
@@ -0,0 +1,72 @@
+from mapper import (ParamName, single, wrap_hysteresis, wrap_proportional,
+                    ParameterTransformer, Parameter)
+
+# Full deflection of the analog presets: the head angles reach ±30 degrees,
+# the body offsets ±10.
+HEAD_RANGE = 30.0
+BODY_RANGE = 10.0
+
+
+def default_transformers() -> dict[str, ParameterTransformer]:
+    return {
+        "Head Up": ParameterTransformer(
+            wrap_hysteresis(single, 15.0, 1.0, 0.0, 4.0),
+            [Parameter(ParamName.ANGLE_Y, 0.0)]),
+        "Head Down": ParameterTransformer(
+            wrap_hysteresis(single, -15.0, 0.0, -1.0, 4.0),
+            [Parameter(ParamName.ANGLE_Y, 0.0)]),
+        "Head Right": ParameterTransformer(
+            wrap_hysteresis(single, 15.0, 1.0, 0.0, 4.0),
+            [Parameter(ParamName.ANGLE_X, 0.0)]),
+        "Head Left": ParameterTransformer(
+            wrap_hysteresis(single, -15.0, 0.0, -1.0, 4.0),
+            [Parameter(ParamName.ANGLE_X, 0.0)]),
+        "Body Up": ParameterTransformer(
+            wrap_hysteresis(single, 5.0, 1.0, 0.0, 2.0),
+            [Parameter(ParamName.BODY_ANGLE_Y, 0.0)]),
+        "Body Down": ParameterTransformer(
+            wrap_hysteresis(single, -5.0, 0.0, -1.0, 2.0),
+            [Parameter(ParamName.BODY_ANGLE_Y, 0.0)]),
+        "Body Right": ParameterTransformer(
+            wrap_hysteresis(single, -5.0, 0.0, -1.0, 2.0),
+            [Parameter(ParamName.BODY_ANGLE_X, 0.0)]),
+        "Body Left": ParameterTransformer(
+            wrap_hysteresis(single, 5.0, 1.0, 0.0, 2.0),
+            [Parameter(ParamName.BODY_ANGLE_X, 0.0)]),
+        # Proportional to the angle, for steering the cursor through the
+        # velocity curve and its dead zone.
+        "Head Up Analog": ParameterTransformer(
+            wrap_proportional(single, HEAD_RANGE),
+            [Parameter(ParamName.ANGLE_Y, 0.0)]),
+        "Head Down Analog": ParameterTransformer(
+            wrap_proportional(single, -HEAD_RANGE),
+            [Parameter(ParamName.ANGLE_Y, 0.0)]),
+        "Head Right Analog": ParameterTransformer(
+            wrap_proportional(single, HEAD_RANGE),
+            [Parameter(ParamName.ANGLE_X, 0.0)]),
+        "Head Left Analog": ParameterTransformer(
+            wrap_proportional(single, -HEAD_RANGE),
+            [Parameter(ParamName.ANGLE_X, 0.0)]),
+        "Body Up Analog": ParameterTransformer(
+            wrap_proportional(single, BODY_RANGE),
+            [Parameter(ParamName.BODY_ANGLE_Y, 0.0)]),
+        "Body Down Analog": ParameterTransformer(
+            wrap_proportional(single, -BODY_RANGE),
+            [Parameter(ParamName.BODY_ANGLE_Y, 0.0)]),
+        "Body Right Analog": ParameterTransformer(
+            wrap_proportional(single, -BODY_RANGE),
+            [Parameter(ParamName.BODY_ANGLE_X, 0.0)]),
+        "Body Left Analog": ParameterTransformer(
+            wrap_proportional(single, BODY_RANGE),
+            [Parameter(ParamName.BODY_ANGLE_X, 0.0)]),
+        "Mouth Open": ParameterTransformer(
+            wrap_hysteresis(single, 0.6, 1.0, 0.0, 0.1),
+            [Parameter(ParamName.MOUTH_OPEN_Y, 0.0)]),
+        "Mouth Closed": ParameterTransformer(
+            wrap_hysteresis(single, 0.3, 0.0, 1.0, 0.1),
+            [Parameter(ParamName.MOUTH_OPEN_Y, 0.0)]),
+        "Gaze X": ParameterTransformer(
+            single, [Parameter(ParamName.GAZE_X, 0.0)]),
+        "Gaze Y": ParameterTransformer(
+            single, [Parameter(ParamName.GAZE_Y, 0.0)]),
+    }
@@ -0,0 +1,222 @@
+import configparser
+import os
+import threading
+from actions import Action
+from dispatch import ActionDispatcher
+from expressions import compile_transformers
+from mapper import ActionParameterMapper, ParameterTransformer
+from motion import parse_curve
+
+
+def default_mappings_path() -> str:
+    directory = os.environ.get("XDG_CONFIG_HOME",
+                               os.path.join(os.path.expanduser("~"),
+                                            ".config"))
+    return os.path.join(directory, "face_controller", "mappings.ini")
+
+
+# Which transformer drives which action, plus the input settings that go
+# with them. Custom transformers, and with them their thresholds, can be
+# defined in the same file:
+#
+#   [mappings]
+#   MOUSE_BUTTON_LEFT = Blink
+#   [input]
+#   sensitivity = 10
+#   curve = quadratic
+#   repeat_delay = 500
+#   repeat_rate = 20
+#   [transformers]
+#   Wide Smile = threshold(MOUTH_FORM, 0.8)
+class MappingProfile:
+    mappings: dict[Action, str]
+    sensitivity: float | None
+    curve: str | None
+    repeat_delay: int | None
+    repeat_rate: int | None
+    transformers: dict[str, str]
+
+    def __init__(self, mappings=None, sensitivity=None, curve=None,
+                 repeat_delay=None, repeat_rate=None, transformers=None):
+        self.mappings = dict(mappings) if mappings is not None else {}
+        self.sensitivity = sensitivity
+        self.curve = curve
+        self.repeat_delay = repeat_delay
+        self.repeat_rate = repeat_rate
+        self.transformers = dict(transformers) \
+            if transformers is not None else {}
+
+    @classmethod
+    def load(cls, path: str) -> "MappingProfile":
+        config = configparser.ConfigParser(interpolation=None)
+        config.optionxform = str
+        with open(path) as file:
+            config.read_file(file)
+        mappings = {}
+        if config.has_section("mappings"):
+            for action_name, transformer_name in config["mappings"].items():
+                if action_name.upper() not in Action.__members__:
+                    raise ValueError(f"unknown action {action_name}")
+                mappings[Action[action_name.upper()]] = transformer_name
+        settings = config["input"] if config.has_section("input") else {}
+        sensitivity = settings.get("sensitivity")
+        repeat_delay = settings.get("repeat_delay")
+        repeat_rate = settings.get("repeat_rate")
+        transformers = dict(config["transformers"]) \
+            if config.has_section("transformers") else {}
+        return cls(mappings,
+                   float(sensitivity) if sensitivity is not None else None,
+                   settings.get("curve"),
+                   int(repeat_delay) if repeat_delay is not None else None,
+                   int(repeat_rate) if repeat_rate is not None else None,
+                   transformers)
+
+    def save(self, path: str):
+        config = configparser.ConfigParser(interpolation=None)
+        config.optionxform = str
+        config["mappings"] = {action.name: name
+                              for action, name in self.mappings.items()}
+        settings = {"sensitivity": self.sensitivity, "curve": self.curve,
+                    "repeat_delay": self.repeat_delay,
+                    "repeat_rate": self.repeat_rate}
+        settings = {key: str(value) for key, value in settings.items()
+                    if value is not None}
+        if settings:
+            config["input"] = settings
+        if self.transformers:
+            config["transformers"] = self.transformers
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Written next to the profile and renamed over it, so the watcher
+        # never reads a half written file.
+        temporary = path + ".tmp"
+        with open(temporary, "w") as file:
+            config.write(file)
+        os.replace(temporary, path)
+
+
+# Keeps the mapper and the dispatcher in line with a profile file. The file
+# is polled for changes, a changed profile is parsed, compiled and planned
+# on the watcher thread and only the finished plan is swapped into the
+# mapper, so the pipeline never waits for a reload. A profile that fails to
+# load leaves the current mappings in place.
+class ProfileManager:
+    path: str
+    profile: MappingProfile
+    version: int
+
+    def __init__(self, path, mapper: ActionParameterMapper,
+                 transformers: dict[str, ParameterTransformer],
+                 dispatcher: ActionDispatcher | None = None, interval=0.5):
+        self.path = path
+        self.mapper = mapper
+        self.base_transformers = transformers
+        self.transformers = dict(transformers)
+        self.dispatcher = dispatcher
+        # What the command line set up, a profile that leaves a setting out
+        # goes back to it instead of keeping the previous profile's.
+        self.defaults = None
+        if dispatcher is not None:
+            self.defaults = (dispatcher.motion.curve, dispatcher.motion.speed,
+                             dispatcher.repeat_delay,
+                             dispatcher.repeat_interval)
+        self.interval = interval
+        self.profile = MappingProfile()
+        self.version = 0
+        self.stamp = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(name="profiles", target=self.run,
+                                       daemon=True)
+
+    def start(self):
+        self.reload()
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if self.file_stamp() != self.stamp:
+                self.reload()
+
+    def reload(self) -> bool:
+        with self.lock:
+            self.stamp = self.file_stamp()
+            if self.stamp is None:
+                return False
+            try:
+                profile = MappingProfile.load(self.path)
+                self.apply(profile)
+            except (OSError, ValueError, configparser.Error) as error:
+                print(f"Could not load {self.path}: {error}")
+                return False
+            return True
+
+    def input_settings(self, profile: MappingProfile):
+        # The dispatcher settings of a profile, on top of the defaults.
+        # Invalid values raise before anything is changed.
+        curve, speed, repeat_delay, repeat_interval = self.defaults
+        if profile.curve is not None:
+            curve = parse_curve(profile.curve)
+            if curve is None:
+                raise ValueError(f"unknown curve {profile.curve}")
+        if profile.sensitivity is not None:
+            if profile.sensitivity <= 0:
+                raise ValueError(
+                    f"invalid sensitivity {profile.sensitivity}")
+            speed = profile.sensitivity * 30
+        if profile.repeat_delay is not None or profile.repeat_rate is not None:
+            if profile.repeat_delay is None or profile.repeat_rate is None:
+                raise ValueError("repeat_delay and repeat_rate go together")
+            if profile.repeat_delay < 0 or profile.repeat_rate <= 0:
+                raise ValueError(
+                    f"invalid repeat {profile.repeat_delay} ms at "
+                    f"{profile.repeat_rate} per second")
+            repeat_delay = profile.repeat_delay / 1000
+            repeat_interval = 1 / profile.repeat_rate
+        return curve, speed, repeat_delay, repeat_interval
+
+    def apply(self, profile: MappingProfile):
+        transformers = dict(self.base_transformers)
+        if profile.transformers:
+            transformers.update(compile_transformers(profile.transformers))
+        unknown = [name for name in profile.mappings.values()
+                   if name not in transformers]
+        if unknown:
+            raise ValueError(f"unknown transformer {unknown[0]}")
+        settings = None
+        if self.dispatcher is not None:
+            settings = self.input_settings(profile)
+        self.mapper.replace_mappings(
+            {action: transformers[name]
+             for action, name in profile.mappings.items()})
+        if settings is not None:
+            curve, speed, repeat_delay, repeat_interval = settings
+            self.dispatcher.set_motion(curve, speed)
+            self.dispatcher.set_repeat(repeat_delay, repeat_interval)
+        self.transformers = transformers
+        self.profile = profile
+        self.version += 1
+
+    def set_mapping(self, action: Action, name: str | None):
+        # Changes made in the UI go straight to the mapper and are saved, the
+        # watcher then sees its own write and skips it.
+        with self.lock:
+            if name:
+                self.mapper.create_mapping(action, self.transformers[name])
+                self.profile.mappings[action] = name
+            else:
+                self.mapper.remove_mapping(action)
+                self.profile.mappings.pop(action, None)
+            self.profile.save(self.path)
+            self.stamp = self.file_stamp()
@@ -0,0 +1,227 @@
+import os
+import sys
+import cv2
+import numpy as np
+import mediapipe as mp
+from mediapipe.tasks.python import vision
+from actions import Action
+from args import arg_value, arg_values, has_flag
+from filters import create_filter
+from landmarks import (LandmarkProcessor, NUM_BLENDSHAPES, NUM_LANDMARKS,
+                       blendshapes_to_array, landmarks_to_array)
+from mapper import ActionParameterMapper, ParameterTransformer
+from pipeline import create_landmarker_options
+from presets import default_transformers
+from expressions import load_transformers
+from gestures import GestureRecognizer, default_gestures
+
+# A recording is a directory with one .npy file per array, all indexed by
+# frame, so replays can memory-map them instead of loading whole sessions.
+RECORDING_ARRAYS = {
+    "timestamps": (np.int64, ()),
+    "present": (np.bool_, ()),
+    "blendshapes": (np.float32, (NUM_BLENDSHAPES,)),
+    "landmarks": (np.float32, (NUM_LANDMARKS, 3)),
+    "matrices": (np.float32, (4, 4)),
+}
+VIDEO_FILE = "frames.mp4"
+
+
+class SessionRecorder:
+    path: str
+    count: int
+
+    def __init__(self, path, record_video=False, video_fps=30.0):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.count = 0
+        self.record_video = record_video
+        self.video_fps = video_fps
+        self.video = None
+        # Rows are streamed to raw files and only turned into .npy files on
+        # close, so memory use stays flat for long sessions.
+        self.files = {name: open(self.raw_path(name), "wb")
+                      for name in RECORDING_ARRAYS}
+        self.rows = {name: np.zeros(shape, dtype)
+                     for name, (dtype, shape) in RECORDING_ARRAYS.items()}
+
+    def raw_path(self, name):
+        return os.path.join(self.path, name + ".bin")
+
+    def add(self, timestamp_ms: int, result, frame=None):
+        rows = self.rows
+        rows["timestamps"][...] = timestamp_ms
+        present = bool(result.face_blendshapes)
+        rows["present"][...] = present
+        if present:
+            blendshapes_to_array(result.face_blendshapes[0],
+                                 rows["blendshapes"])
+            rows["matrices"][:] = result.facial_transformation_matrixes[0]
+            rows["landmarks"][:] = landmarks_to_array(
+                result.face_landmarks[0], 3)
+        for name, file in self.files.items():
+            file.write(rows[name].tobytes())
+        self.count += 1
+
+        if self.record_video and frame is not None:
+            if self.video is None:
+                height, width = frame.shape[:2]
+                self.video = cv2.VideoWriter(
+                    os.path.join(self.path, VIDEO_FILE),
+                    cv2.VideoWriter_fourcc(*"mp4v"), self.video_fps,
+                    (width, height))
+            self.video.write(frame)
+
+    def close(self):
+        for name, (dtype, shape) in RECORDING_ARRAYS.items():
+            self.files[name].close()
+            raw = np.fromfile(self.raw_path(name), dtype=dtype).reshape(
+                (self.count,) + shape)
+            np.save(os.path.join(self.path, name + ".npy"), raw)
+            del raw
+            os.remove(self.raw_path(name))
+        if self.video is not None:
+            self.video.release()
+
+
+class LandmarkRecording:
+    path: str
+
+    def __init__(self, path):
+        self.path = path
+        for name in RECORDING_ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + ".npy"),
+                                        mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def video_path(self) -> str | None:
+        path = os.path.join(self.path, VIDEO_FILE)
+        return path if os.path.exists(path) else None
+
+
+# Stands in for the ActionDispatcher during replays and only logs the frames
+# on which an action value changed.
+class ActionLog:
+    frame: int
+    events: list[tuple[int, Action, float]]
+
+    def __init__(self):
+        self.frame = 0
+        self.events = []
+        self.values = {}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def submit(self, values: dict[Action, float]):
+        for action, value in values.items():
+            if self.values.get(action, 0.0) != value:
+                self.events.append((self.frame, action, value))
+        self.values = values
+        self.frame += 1
+
+
+def replay_landmarks(recording: LandmarkRecording,
+                     landmark_processor: LandmarkProcessor, sink) -> int:
+    mapper = landmark_processor.mapper
+    history = landmark_processor.history
+    for i in range(len(recording)):
+        if recording.present[i]:
+            history.push_scores(recording.blendshapes[i],
+                                recording.matrices[i])
+            landmark_processor.process(int(recording.timestamps[i]))
+        sink.submit(mapper.action_values())
+    return len(recording)
+
+
+def replay_video(path: str, landmark_processor: LandmarkProcessor, sink,
+                 timestamps=None) -> int:
+    mapper = landmark_processor.mapper
+    options = create_landmarker_options(vision.RunningMode.VIDEO)
+    vc = cv2.VideoCapture(path)
+    fps = vc.get(cv2.CAP_PROP_FPS) or 30.0
+    frames = 0
+    with vision.FaceLandmarker.create_from_options(options) as landmarker:
+        while True:
+            rval, frame = vc.read()
+            if not rval:
+                break
+            if timestamps is not None and frames < len(timestamps):
+                timestamp_ms = int(timestamps[frames])
+            else:
+                timestamp_ms = int(frames * 1000 / fps)
+            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame)
+            result = landmarker.detect_for_video(mp_image, timestamp_ms)
+            landmark_processor.process_result(result, timestamp_ms)
+            sink.submit(mapper.action_values())
+            frames += 1
+    vc.release()
+    return frames
+
+
+def create_transformers(transformers_path=None,
+                        gestures: GestureRecognizer | None = None
+                        ) -> dict[str, ParameterTransformer]:
+    transformers = default_transformers()
+    if gestures is not None:
+        transformers.update(gestures.transformers())
+    if transformers_path is not None:
+        transformers.update(load_transformers(transformers_path))
+    return transformers
+
+
+def create_replay_mapper(mappings: list[str], transformers_path=None,
+                         gestures: GestureRecognizer | None = None
+                         ) -> ActionParameterMapper:
+    mapper = ActionParameterMapper()
+    transformers = create_transformers(transformers_path, gestures)
+    for mapping in mappings:
+        action_name, _, transformer_name = mapping.partition("=")
+        mapper.create_mapping(Action[action_name.upper()],
+                              transformers[transformer_name])
+    return mapper
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("usage: python src/replay.py RECORDING [--video] "
+              "[--filter NAME] [--transformers FILE] "
+              "[--map ACTION=TRANSFORMER ...]")
+        return 1
+    path = sys.argv[1]
+    gestures = default_gestures()
+    mapper = create_replay_mapper(arg_values("--map"),
+                                  arg_value("--transformers"), gestures)
+    parameter_filter = None
+    filter_name = arg_value("--filter")
+    if filter_name is not None:
+        parameter_filter = create_filter(filter_name)
+    landmark_processor = LandmarkProcessor(mapper,
+                                           parameter_filter=parameter_filter,
+                                           gestures=gestures)
+    sink = ActionLog()
+
+    if os.path.isdir(path):
+        recording = LandmarkRecording(path)
+        if has_flag("--video") and recording.video_path is not None:
+            frames = replay_video(recording.video_path, landmark_processor,
+                                  sink, recording.timestamps)
+        else:
+            frames = replay_landmarks(recording, landmark_processor, sink)
+    else:
+        frames = replay_video(path, landmark_processor, sink)
+
+    print(f"{frames} frames, {len(sink.events)} action events")
+    for frame, action, value in sink.events:
+        print(f"{frame}: {action.name} = {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import math
+import cv2
+import numpy as np
+from landmarks import landmarks_to_array
+
+# Vertical field of view of the perspective camera MediaPipe's face geometry
+# assumes for the transformation matrix, whatever image it is given.
+VERTICAL_FOV_DEGREES = 63.0
+
+
+class Region:
+    x: int
+    y: int
+    width: int
+    height: int
+    frame_width: int
+    frame_height: int
+
+    def __init__(self, x, y, width, height, frame_width, frame_height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+
+    @property
+    def full(self) -> bool:
+        return self.width == self.frame_width \
+            and self.height == self.frame_height
+
+
+# Front end of the inference stage. While a face is tracked only a box
+# around the face of the previous result is handed to the FaceLandmarker,
+# downscaled to `size` pixels, and the result is mapped back to the full
+# frame. Without a face the whole frame is used again. With a latency
+# budget, both sizes shrink while inference takes longer than the budget
+# and grow back once it is well below.
+class AdaptiveInput:
+    crop: bool
+    size: int
+    margin: float
+    budget_ms: float | None
+    scale: float
+
+    def __init__(self, crop=True, size=256, margin=0.5, budget_ms=None,
+                 min_scale=0.25, adjust_every=15, retries=2):
+        self.crop = crop
+        self.size = size
+        self.margin = margin
+        self.budget_ms = budget_ms
+        self.min_scale = min_scale
+        self.adjust_every = adjust_every
+        self.retries = retries
+        self.misses = 0
+        self.scale = 1.0
+        self.latency_ms = 0.0
+        self.frames = 0
+        self.box = None
+        self.current = None
+        self.buffer = None
+        self.k = 0.5 / math.tan(math.radians(VERTICAL_FOV_DEGREES) / 2)
+
+    def reset(self):
+        self.box = None
+        self.current = None
+
+    def region(self, frame_width, frame_height) -> Region:
+        if not self.crop or self.box is None:
+            self.current = None
+            return Region(0, 0, frame_width, frame_height, frame_width,
+                          frame_height)
+        # MediaPipe follows the face from frame to frame in image
+        # coordinates, so the crop only moves once the face gets close to
+        # its border or no longer fits its size.
+        if self.current is not None and self.contains_box(self.current):
+            return self.current
+        x0, y0, x1, y1 = self.box
+        side = max((x1 - x0) * frame_width, (y1 - y0) * frame_height) \
+            * (1 + 2 * self.margin)
+        width = min(frame_width, max(32, round(side)))
+        height = min(frame_height, max(32, round(side)))
+        center_x = (x0 + x1) / 2 * frame_width
+        center_y = (y0 + y1) / 2 * frame_height
+        x = min(max(0, round(center_x - width / 2)), frame_width - width)
+        y = min(max(0, round(center_y - height / 2)), frame_height - height)
+        self.current = Region(x, y, width, height, frame_width, frame_height)
+        return self.current
+
+    def contains_box(self, region: Region) -> bool:
+        x0, y0, x1, y1 = self.box
+        x0 = (x0 * region.frame_width - region.x) / region.width
+        x1 = (x1 * region.frame_width - region.x) / region.width
+        y0 = (y0 * region.frame_height - region.y) / region.height
+        y1 = (y1 * region.frame_height - region.y) / region.height
+        inner = self.margin / (1 + 2 * self.margin) / 3
+        size = max(x1 - x0, y1 - y0) * (1 + 2 * self.margin)
+        return min(x0, y0) >= inner and max(x1, y1) <= 1 - inner \
+            and 0.6 <= size <= 1.25
+
+    def prepare(self, frame: np.ndarray) -> tuple[np.ndarray, Region]:
+        frame_height, frame_width = frame.shape[:2]
+        region = self.region(frame_width, frame_height)
+        image = frame[region.y:region.y + region.height,
+                      region.x:region.x + region.width]
+        limit = self.size if not region.full else max(frame_width,
+                                                      frame_height)
+        limit = max(32, round(limit * self.scale))
+        factor = limit / max(region.width, region.height)
+        if factor >= 1:
+            if region.full:
+                return frame, region
+            return np.ascontiguousarray(image), region
+        size = (max(1, round(region.width * factor)),
+                max(1, round(region.height * factor)))
+        shape = (size[1], size[0]) + frame.shape[2:]
+        if self.buffer is None or self.buffer.shape != shape:
+            self.buffer = np.empty(shape, frame.dtype)
+        cv2.resize(image, size, self.buffer, interpolation=cv2.INTER_LINEAR)
+        return self.buffer, region
+
+    def update(self, result, region: Region, latency_ms: float | None = None):
+        if not region.full:
+            for landmarks, matrix in zip(result.face_landmarks,
+                                         result.facial_transformation_matrixes):
+                self.remap_landmarks(landmarks, region)
+                self.remap_matrix(matrix, region)
+        if result.face_landmarks:
+            points = landmarks_to_array(result.face_landmarks[0])
+            x0, y0 = points.min(axis=0)
+            x1, y1 = points.max(axis=0)
+            self.box = (float(x0), float(y0), float(x1), float(y1))
+            self.misses = 0
+        else:
+            # MediaPipe's own tracking expects the previous image geometry
+            # and misses the first frame after the crop changes, the face
+            # detector then finds it again within the same crop.
+            self.misses += 1
+            if self.misses > self.retries:
+                self.reset()
+        if self.budget_ms is not None and latency_ms is not None:
+            self.adapt(latency_ms)
+
+    def remap_landmarks(self, landmarks, region: Region):
+        x0 = region.x / region.frame_width
+        y0 = region.y / region.frame_height
+        sx = region.width / region.frame_width
+        sy = region.height / region.frame_height
+        for landmark in landmarks:
+            landmark.x = x0 + landmark.x * sx
+            landmark.y = y0 + landmark.y * sy
+            landmark.z *= sx
+
+    def remap_matrix(self, matrix: np.ndarray, region: Region):
+        # The pose was solved for a camera that only saw the crop. The face
+        # covers the same pixels in the full frame, so it is farther away by
+        # the ratio of the image heights, and its direction follows from
+        # where the crop sits in the frame.
+        k = self.k
+        tx, ty, tz = matrix[0, 3], matrix[1, 3], matrix[2, 3]
+        if tz == 0:
+            return
+        u = 0.5 + tx / -tz * k * region.height / region.width
+        v = 0.5 - ty / -tz * k
+        u = (region.x + u * region.width) / region.frame_width
+        v = (region.y + v * region.height) / region.frame_height
+        tz *= region.frame_height / region.height
+        matrix[0, 3] = (u - 0.5) * region.frame_width / region.frame_height \
+            / k * -tz
+        matrix[1, 3] = (0.5 - v) / k * -tz
+        matrix[2, 3] = tz
+
+    def adapt(self, latency_ms: float):
+        self.latency_ms += 0.1 * (latency_ms - self.latency_ms)
+        self.frames += 1
+        if self.frames % self.adjust_every:
+            return
+        if self.latency_ms > self.budget_ms:
+            self.scale = max(self.min_scale, self.scale * 0.8)
+        elif self.latency_ms < 0.6 * self.budget_ms:
+            self.scale = min(1.0, self.scale / 0.8)
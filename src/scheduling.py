@@ -0,0 +1,139 @@
+from enum import Enum
+import cv2
+import numpy as np
+
+# Landmarks on the outline of the face, enough to box it in.
+OUTLINE_LANDMARKS = [10, 152, 234, 454]
+
+
+class Mode(Enum):
+    # Every frame goes to the landmarker.
+    ACTIVE = 1
+    # A face is in view but nothing moves.
+    STILL = 2
+    # No face for a while, only motion or the occasional look.
+    SEARCHING = 3
+    # Nothing uses the results.
+    IDLE = 4
+
+
+# Decides per camera frame whether it is worth an inference. Each frame is
+# shrunk to a small grayscale image of the face, or of the whole frame
+# while no face is known, and compared block by block with the last frame
+# that went to the landmarker. The largest block difference is the motion
+# score, so a blink moves it as much as a turn of the head does. Frames that
+# show motion always go through, the same frame that shows it, and so does
+# every frame while an action is held, a head kept turned on purpose to
+# steer the cursor does not move either. Otherwise the rate drops depending
+# on whether a face was seen lately and whether anything uses the results
+# at all.
+class InferenceScheduler:
+    motion_threshold: float
+    mode: Mode
+    frames: int
+    inferred: int
+    skipped: dict[Mode, int]
+
+    def __init__(self, motion_threshold=2.5, still_fps=4.0, search_after=2.0,
+                 search_fps=1.0, idle_fps=1.0, size=32, blocks=8,
+                 margin=0.25):
+        self.motion_threshold = motion_threshold
+        self.still_interval_ms = 1000 / still_fps
+        self.search_after_ms = search_after * 1000
+        self.search_interval_ms = 1000 / search_fps
+        self.idle_interval_ms = 1000 / idle_fps
+        self.size = (size, size)
+        self.sample_size = (4 * size, 4 * size)
+        self.blocks = (blocks, blocks)
+        self.margin = margin
+        self.mode = Mode.SEARCHING
+        self.box = None
+        self.reference = None
+        self.reference_box = None
+        self.score = 0.0
+        self.last_face_ms = -np.inf
+        self.last_inference_ms = -np.inf
+        self.frames = 0
+        self.inferred = 0
+        self.skipped = {mode: 0 for mode in Mode}
+
+    def downsample(self, frame: np.ndarray, box) -> np.ndarray:
+        height, width = frame.shape[:2]
+        if box is None:
+            x0, y0, x1, y1 = 0, 0, width, height
+        else:
+            x0, y0 = int(box[0] * width), int(box[1] * height)
+            x1, y1 = int(box[2] * width) + 1, int(box[3] * height) + 1
+        # A few pixels per output pixel are enough for the area average, the
+        # linear pass keeps the cost independent of the camera resolution.
+        small = cv2.resize(frame[y0:y1, x0:x1], self.sample_size,
+                           interpolation=cv2.INTER_LINEAR)
+        small = cv2.resize(small, self.size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 2:
+            return small
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def motion(self, frame: np.ndarray) -> float:
+        if self.reference is None:
+            return np.inf
+        difference = cv2.absdiff(self.downsample(frame, self.reference_box),
+                                 self.reference)
+        return float(cv2.resize(difference, self.blocks,
+                                interpolation=cv2.INTER_AREA).max())
+
+    def should_infer(self, frame: np.ndarray, timestamp_ms: int,
+                     wanted=True, held=False) -> bool:
+        self.frames += 1
+        if not wanted:
+            mode, interval_ms = Mode.IDLE, self.idle_interval_ms
+        else:
+            self.score = self.motion(frame)
+            if held or self.score > self.motion_threshold:
+                mode, interval_ms = Mode.ACTIVE, 0.0
+            elif timestamp_ms - self.last_face_ms > self.search_after_ms:
+                mode, interval_ms = Mode.SEARCHING, self.search_interval_ms
+            else:
+                mode, interval_ms = Mode.STILL, self.still_interval_ms
+        self.mode = mode
+        if timestamp_ms - self.last_inference_ms < interval_ms:
+            self.skipped[mode] += 1
+            return False
+        self.inferred += 1
+        self.last_inference_ms = timestamp_ms
+        self.reference = self.downsample(frame, self.box)
+        self.reference_box = self.box
+        return True
+
+    def update(self, result, timestamp_ms: int):
+        # Called with every result. The new face box is only used from the
+        # next inferred frame on, compared with a reference of another box
+        # every frame would look like motion.
+        if not result.face_landmarks:
+            self.box = None
+            return
+        self.last_face_ms = timestamp_ms
+        landmarks = result.face_landmarks[0]
+        x = [landmarks[i].x for i in OUTLINE_LANDMARKS]
+        y = [landmarks[i].y for i in OUTLINE_LANDMARKS]
+        width = max(x) - min(x)
+        height = max(y) - min(y)
+        box = (max(0.0, min(x) - self.margin * width),
+               max(0.0, min(y) - self.margin * height),
+               min(1.0, max(x) + self.margin * width),
+               min(1.0, max(y) + self.margin * height))
+        self.box = box if box[2] - box[0] > 0.02 and box[3] - box[1] > 0.02 \
+            else None
+
+    def stats(self, inference_ms=0.0) -> dict:
+        skipped = sum(self.skipped.values())
+        return {
+            "frames": self.frames,
+            "inferred": self.inferred,
+            "skipped": skipped,
+            "skipped_fraction": skipped / self.frames if self.frames else 0.0,
+            "skipped_by_mode": {mode.name.lower(): count
+                                for mode, count in self.skipped.items()},
+            # Landmarker time that was not spent, from the measured
+            # inference latency.
+            "inference_s_saved": skipped * inference_ms / 1000,
+        }
@@ -0,0 +1,270 @@
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import mediapipe as mp
+from mediapipe.tasks.python import vision
+from args import arg_value, arg_values, has_flag
+from calibration import load_program
+from capture import Camera
+from dispatch import ActionDispatcher, parse_rate_limits
+from filters import create_filter
+from gestures import default_gestures
+from landmarks import LandmarkProcessor
+from pipeline import create_landmarker_options
+from replay import create_replay_mapper
+from shared import ACTIONS, SharedRing, action_array
+
+
+# Keeps every tracked face on the same slot from frame to frame. MediaPipe
+# does not report faces in a stable order, so each face goes to the slot
+# whose face was closest on the previous frame.
+class FaceRouter:
+    slots: int
+    max_distance: float
+
+    def __init__(self, slots, max_distance=0.2):
+        self.slots = slots
+        self.max_distance = max_distance
+        self.centers = np.full((slots, 2), np.nan)
+
+    def route(self, face_landmarks) -> list[int | None]:
+        # The nose tip stands in for the face position.
+        centers = np.array([(landmarks[1].x, landmarks[1].y)
+                            for landmarks in face_landmarks]).reshape(-1, 2)
+        distances = np.linalg.norm(centers[:, None] - self.centers[None],
+                                   axis=2)
+        distances[np.isnan(distances)] = np.inf
+        routes = [None] * len(centers)
+        free = np.ones(self.slots, dtype=bool)
+        for flat in np.argsort(distances, axis=None):
+            face, slot = divmod(int(flat), self.slots)
+            if distances[face, slot] > self.max_distance:
+                break
+            if routes[face] is None and free[slot]:
+                routes[face] = slot
+                free[slot] = False
+        for face in range(len(routes)):
+            if routes[face] is None and free.any():
+                slot = int(np.flatnonzero(free)[0])
+                routes[face] = slot
+                free[slot] = False
+        self.centers[free] = np.nan
+        for face, slot in enumerate(routes):
+            if slot is not None:
+                self.centers[slot] = centers[face]
+        return routes
+
+
+class SessionConfig:
+    source: int | str
+    faces: int
+    mappings: list[list[str]]
+
+    def __init__(self, source, faces=1, mappings=None, transformers_path=None,
+                 filter_name=None, profile_path=None):
+        self.source = source
+        self.faces = faces
+        self.mappings = mappings if mappings is not None \
+            else [[] for _ in range(faces)]
+        self.transformers_path = transformers_path
+        self.filter_name = filter_name
+        self.profile_path = profile_path
+
+
+# One camera, one FaceLandmarker and a processor and mapper per face slot,
+# run in its own process. Every frame writes one record per slot to the ring.
+def run_session(config: SessionConfig, ring_name: str, stop):
+    ring = SharedRing(name=ring_name)
+    processors = []
+    for mappings in config.mappings:
+        gestures = default_gestures()
+        parameter_filter = None
+        if config.filter_name is not None:
+            parameter_filter = create_filter(config.filter_name)
+        mapper = create_replay_mapper(mappings, config.transformers_path,
+                                      gestures)
+        processors.append(LandmarkProcessor(
+            mapper, program=load_program(config.profile_path),
+            parameter_filter=parameter_filter, gestures=gestures))
+    router = FaceRouter(config.faces)
+    camera = Camera(config.source, pace=isinstance(config.source, str))
+    if not camera.open():
+        ring.close()
+        return
+    options = create_landmarker_options(vision.RunningMode.VIDEO,
+                                        num_faces=config.faces)
+    row = ring.row
+    last_timestamp_ms = 0
+    with vision.FaceLandmarker.create_from_options(options) as landmarker:
+        camera.start()
+        while not stop.is_set():
+            frame, captured_ms = camera.take(0.5)
+            if frame is None:
+                if camera.slot.closed:
+                    break
+                continue
+            timestamp_ms = max(int(captured_ms), last_timestamp_ms + 1)
+            last_timestamp_ms = timestamp_ms
+            result = landmarker.detect_for_video(
+                mp.Image(image_format=mp.ImageFormat.SRGB, data=frame),
+                timestamp_ms)
+
+            present = [False] * config.faces
+            routes = router.route(result.face_landmarks)
+            for face, slot in enumerate(routes):
+                if slot is None or face >= len(result.face_blendshapes):
+                    continue
+                processor = processors[slot]
+                processor.history.push(
+                    result.face_blendshapes[face],
+                    result.facial_transformation_matrixes[face])
+                processor.process(timestamp_ms)
+                present[slot] = True
+
+            for slot, processor in enumerate(processors):
+                row["timestamp"] = timestamp_ms
+                row["face"] = slot
+                row["present"] = present[slot]
+                if present[slot]:
+                    row["blendshapes"] = processor.history.latest_scores()
+                    row["matrix"] = processor.history.latest_matrix()
+                    action_array(processor.mapper.action_values(),
+                                 row["actions"])
+                else:
+                    # A face that left lets go of its actions, its last
+                    # values would otherwise stay in the merge.
+                    processor.lose_face()
+                    row["actions"] = 0.0
+                ring.write()
+    camera.stop()
+    ring.close()
+
+
+# Runs every session in a process of its own, results come back through one
+# shared memory ring per session. Each face slot of each session is a
+# controller with its own mapper, numbered in order across the sessions.
+class SessionPool:
+    configs: list[SessionConfig]
+    rings: list[SharedRing]
+
+    def __init__(self, configs: list[SessionConfig], capacity=256):
+        self.configs = configs
+        self.capacity = capacity
+        self.context = multiprocessing.get_context("spawn")
+        self.stop_event = self.context.Event()
+        self.rings = []
+        self.processes = []
+        self.offsets = np.cumsum([0] + [c.faces for c in configs])[:-1]
+        self.controllers = int(sum(c.faces for c in configs))
+        self.values = np.zeros((self.controllers, len(ACTIONS)),
+                               dtype=np.float32)
+
+    def start(self):
+        for config in self.configs:
+            ring = SharedRing(self.capacity)
+            process = self.context.Process(
+                target=run_session, args=(config, ring.name, self.stop_event),
+                daemon=True)
+            process.start()
+            self.rings.append(ring)
+            self.processes.append(process)
+
+    @property
+    def running(self) -> bool:
+        return any(process.is_alive() for process in self.processes)
+
+    def poll(self) -> bool:
+        # Keeps the latest action values of every controller, returns
+        # whether anything new arrived.
+        updated = False
+        for offset, ring in zip(self.offsets, self.rings):
+            records = ring.read()
+            if len(records):
+                self.values[offset + records["face"]] = records["actions"]
+                updated = True
+        return updated
+
+    def merged_values(self) -> dict:
+        # Controllers share the keyboard and mouse, per action the strongest
+        # value wins.
+        strongest = np.abs(self.values).argmax(axis=0)
+        merged = self.values[strongest, np.arange(len(ACTIONS))]
+        return dict(zip(ACTIONS, merged.tolist()))
+
+    def stop(self):
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(2.0)
+            if process.is_alive():
+                process.terminate()
+        for ring in self.rings:
+            ring.close()
+
+
+def parse_mappings(configs: list[SessionConfig], mappings: list[str]):
+    # CONTROLLER:ACTION=TRANSFORMER, controller 0 without a prefix.
+    slots = [(config, face) for config in configs
+             for face in range(config.faces)]
+    for mapping in mappings:
+        controller, _, rest = mapping.partition(":")
+        if not rest or not controller.isdecimal():
+            controller, rest = "0", mapping
+        config, face = slots[int(controller)]
+        config.mappings[face].append(rest)
+
+
+def main():
+    sources = arg_values("--source")
+    if not sources:
+        print("usage: python src/sessions.py --source CAMERA|VIDEO ... "
+              "[--faces N] [--filter NAME] [--transformers FILE] "
+              "[--profile FILE] [--log] "
+              "[--map [CONTROLLER:]ACTION=TRANSFORMER ...]")
+        return 1
+    faces = arg_value("--faces", default="1")
+    faces = int(faces) if faces.isdecimal() and int(faces) > 0 else 1
+    if len(sources) > (os.cpu_count() or 1):
+        print(f"{len(sources)} sessions on {os.cpu_count()} cores, "
+              "tracking will slow down")
+    configs = [SessionConfig(int(source) if source.isdecimal() else source,
+                             faces, None, arg_value("--transformers"),
+                             arg_value("--filter"), arg_value("--profile"))
+               for source in sources]
+    parse_mappings(configs, arg_values("--map"))
+
+    dispatcher = None
+    if not has_flag("--log"):
+        dispatcher = ActionDispatcher(
+            rate_limits=parse_rate_limits(arg_values("--rate-limit")))
+        dispatcher.start()
+    pool = SessionPool(configs)
+    pool.start()
+    last = pool.values.copy()
+    try:
+        while pool.running:
+            # Shared memory has no wakeup, poll at a rate well above the
+            # camera rate instead.
+            time.sleep(0.005)
+            if not pool.poll():
+                continue
+            if dispatcher is not None:
+                dispatcher.submit(pool.merged_values())
+            else:
+                for controller, action in zip(
+                        *np.nonzero(pool.values != last)):
+                    print(f"{controller}: {ACTIONS[action].name} = "
+                          f"{pool.values[controller, action]}")
+                last[:] = pool.values
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+        if dispatcher is not None:
+            dispatcher.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
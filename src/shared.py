@@ -0,0 +1,106 @@
+from multiprocessing import shared_memory
+import numpy as np
+from actions import Action
+from landmarks import NUM_BLENDSHAPES
+
+ACTIONS = list(Action)
+ACTION_INDEX = {action: i for i, action in enumerate(ACTIONS)}
+
+# One tracked face on one frame. `sequence` is written last, a reader only
+# trusts a slot whose sequence matches the position it expects there.
+FACE_RECORD = np.dtype([
+    ("sequence", np.int64),
+    ("timestamp", np.int64),
+    ("face", np.int32),
+    ("present", np.bool_),
+    ("blendshapes", np.float32, (NUM_BLENDSHAPES,)),
+    ("matrix", np.float32, (4, 4)),
+    ("actions", np.float32, (len(ACTIONS),)),
+])
+
+
+def action_array(values: dict[Action, float], out: np.ndarray) -> np.ndarray:
+    out[:] = 0.0
+    for action, value in values.items():
+        out[ACTION_INDEX[action]] = value
+    return out
+
+
+# Single producer, single consumer ring of fixed size records in shared
+# memory. The producer never waits, a consumer that falls more than
+# `capacity` records behind skips ahead and counts the records it lost.
+class SharedRing:
+    name: str
+    capacity: int
+    dropped: int
+
+    HEADER_SIZE = 64
+
+    def __init__(self, capacity=256, dtype=FACE_RECORD, name=None):
+        self.dtype = np.dtype(dtype)
+        create = name is None
+        if create:
+            size = self.HEADER_SIZE + capacity * self.dtype.itemsize
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            capacity = (self.memory.size - self.HEADER_SIZE) \
+                // self.dtype.itemsize
+        self.owner = create
+        self.name = self.memory.name
+        self.capacity = capacity
+        self.head = np.ndarray((1,), np.int64, self.memory.buf)
+        self.records = np.ndarray((capacity,), self.dtype, self.memory.buf,
+                                  self.HEADER_SIZE)
+        if create:
+            self.head[0] = 0
+            self.records["sequence"] = -1
+        self.read_index = 0
+        self.dropped = 0
+        self.row = np.zeros((), self.dtype)
+        # Everything but the sequence, which only changes from -1 to the
+        # index once the rest of the record is written.
+        self.fields = [name for name in self.dtype.names
+                       if name != "sequence"]
+        self.payload = self.records[self.fields]
+
+    def write(self, row: np.ndarray | None = None):
+        row = self.row if row is None else row
+        index = int(self.head[0])
+        slot = index % self.capacity
+        self.records["sequence"][slot] = -1
+        self.payload[slot] = row[self.fields]
+        self.records["sequence"][slot] = index
+        self.head[0] = index + 1
+
+    def read(self) -> np.ndarray:
+        # A seqlock per record: the sequence is copied along with the record,
+        # before the rest of it, and read again once the copy is done. The
+        # producer marks a slot before writing it, so a record whose
+        # sequence changed in between was overwritten during the copy and
+        # may be torn. The read then starts over from the newest records,
+        # the overwritten ones are lost and counted.
+        while True:
+            head = int(self.head[0])
+            start = self.read_index
+            if head - start > self.capacity:
+                self.dropped += head - self.capacity - start
+                start = head - self.capacity
+                self.read_index = start
+            if start == head:
+                return self.records[:0]
+            expected = np.arange(start, head)
+            slots = expected % self.capacity
+            records = self.records[slots]
+            if np.array_equal(self.records["sequence"][slots], expected):
+                break
+        self.read_index = head
+        valid = records["sequence"] == expected
+        self.dropped += int(len(valid) - np.count_nonzero(valid))
+        return records[valid]
+
+    def close(self):
+        del self.head, self.records, self.payload
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
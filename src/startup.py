@@ -0,0 +1,43 @@
+import threading
+import time
+
+
+# Collects when each phase of the startup began and ended, relative to the
+# creation of the report. Phases on the main thread are closed with mark(),
+# background phases run in threads of their own through run().
+class StartupReport:
+    start: float
+    phases: list[tuple[str, float, float]]
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last_mark = self.start
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, begin: float, end: float):
+        with self.lock:
+            self.phases.append((name, begin - self.start, end - self.start))
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.add(name, self.last_mark, now)
+        self.last_mark = now
+
+    def run(self, name: str, target, *args) -> threading.Thread:
+        def timed():
+            begin = time.perf_counter()
+            try:
+                target(*args)
+            finally:
+                self.add(name, begin, time.perf_counter())
+        thread = threading.Thread(name=name, target=timed, daemon=True)
+        thread.start()
+        return thread
+
+    def summary(self) -> str:
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        return "\n".join(f"  {name}: {begin * 1000:.0f} - {end * 1000:.0f} ms "
+                         f"({(end - begin) * 1000:.0f} ms)"
+                         for name, begin, end in phases)
@@ -0,0 +1,200 @@
+import cv2
+import numpy as np
+from actions import Action
+from instrumentation import STAGES, StageTimers
+from mapper import ParamName
+
+# The parameters shown together in one chart, each group on a scale that
+# suits it.
+PARAMETER_GROUPS = {
+    "Head": [ParamName.ANGLE_X, ParamName.ANGLE_Y, ParamName.ANGLE_Z,
+             ParamName.BODY_ANGLE_X, ParamName.BODY_ANGLE_Y,
+             ParamName.BODY_ANGLE_Z],
+    "Mouth": [ParamName.MOUTH_X, ParamName.MOUTH_OPEN_Y,
+              ParamName.MOUTH_FORM],
+    "Eyes": [ParamName.EYE_L_OPEN, ParamName.EYE_R_OPEN,
+             ParamName.BROW_L_Y, ParamName.BROW_R_Y, ParamName.EYE_BALL_X,
+             ParamName.EYE_BALL_Y],
+    "Gaze": [ParamName.GAZE_X, ParamName.GAZE_Y],
+}
+
+BACKGROUND = (32, 32, 32)
+GRID = (72, 72, 72)
+
+
+def series_colors(count: int) -> list[tuple[int, int, int]]:
+    # Hues spread around the circle, in BGR like the preview.
+    hues = np.linspace(0, 180, count, endpoint=False).astype(np.uint8)
+    hsv = np.stack([hues, np.full(count, 170, np.uint8),
+                    np.full(count, 255, np.uint8)], axis=-1)
+    bgr = cv2.cvtColor(hsv[None], cv2.COLOR_HSV2BGR)[0]
+    return [tuple(int(c) for c in color) for color in bgr]
+
+
+# Per frame telemetry of the pipeline: the face parameters, the value of
+# every mapped action (NaN for the others) and the latest duration of every
+# stage, in one fixed-size ring buffer per field. The dispatch stage is the
+# only writer, the UI reads rows by frame number at its own pace. While
+# disabled, add() returns right away, so nothing is copied while no one
+# looks.
+class Telemetry:
+    enabled: bool
+    capacity: int
+    count: int
+    timestamps: np.ndarray
+    parameters: np.ndarray
+    actions: np.ndarray
+    timings: np.ndarray
+
+    def __init__(self, capacity=2048, enabled=False):
+        self.enabled = enabled
+        self.capacity = capacity
+        self.count = 0
+        self.action_index = {action: i for i, action in enumerate(Action)}
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.parameters = np.zeros((capacity, len(ParamName)),
+                                   dtype=np.float32)
+        self.actions = np.full((capacity, len(Action)), np.nan,
+                               dtype=np.float32)
+        self.timings = np.full((capacity, len(STAGES)), np.nan)
+
+    def add(self, timestamp_ms: int, parameters: np.ndarray,
+            action_values: dict[Action, float], timers: StageTimers):
+        if not self.enabled:
+            return
+        row = self.count % self.capacity
+        self.timestamps[row] = timestamp_ms
+        self.parameters[row] = parameters
+        actions = self.actions[row]
+        actions[:] = np.nan
+        for action, value in action_values.items():
+            actions[self.action_index[action]] = value
+        if timers.enabled:
+            timers.latest(self.timings[row])
+        else:
+            self.timings[row] = np.nan
+        # Only counted once the row is complete, readers never see it half
+        # written.
+        self.count += 1
+
+    def read(self, first: int) -> tuple[int, dict[str, np.ndarray]]:
+        # Copies of the rows from frame `first` up to the newest one. A reader
+        # that fell behind gets the newer half of the buffer, the rows before
+        # that could be overwritten while they are copied.
+        count = self.count
+        first = max(first, count - self.capacity // 2, 0)
+        rows = np.arange(first, count) % self.capacity
+        return count, {"timestamps": self.timestamps[rows],
+                       "parameters": self.parameters[rows],
+                       "actions": self.actions[rows],
+                       "timings": self.timings[rows]}
+
+
+def finite_runs(values: np.ndarray) -> list[tuple[int, int]]:
+    # Start and end of every stretch of finite values, lines break at NaN.
+    finite = np.concatenate([[False], np.isfinite(values), [False]])
+    edges = np.flatnonzero(finite[1:] != finite[:-1])
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+# A chart of several series that scrolls by one pixel per frame. New
+# frames shift the image left and only the new columns are drawn, the whole
+# chart is only drawn again when it is resized, when other series are shown
+# or when a value leaves the range, which then grows to fit it.
+class ScrollingChart:
+    image: np.ndarray
+    values: np.ndarray
+    visible: np.ndarray
+    low: float
+    high: float
+
+    def __init__(self, series: int, low=0.0, high=1.0, width=1, height=1):
+        self.colors = series_colors(series)
+        self.visible = np.ones(series, dtype=bool)
+        self.default_range = (low, high)
+        self.low, self.high = low, high
+        self.values = np.full((0, series), np.nan)
+        self.resize(width, height)
+
+    def resize(self, width: int, height: int):
+        width, height = max(width, 1), max(height, 1)
+        values = np.full((width, self.values.shape[1]), np.nan)
+        kept = min(width, len(self.values))
+        if kept:
+            values[-kept:] = self.values[-kept:]
+        self.values = values
+        self.image = np.empty((height, width, 3), dtype=np.uint8)
+        self.draw(0)
+
+    def show(self, visible: np.ndarray):
+        self.visible[:] = visible
+        self.low, self.high = self.default_range
+        self.expand(self.values)
+        self.draw(0)
+
+    def clear(self):
+        self.values[:] = np.nan
+        self.low, self.high = self.default_range
+        self.draw(0)
+
+    def append(self, values: np.ndarray):
+        # values: (frames, series)
+        frames = len(values)
+        width = len(self.values)
+        if frames == 0:
+            return
+        if frames >= width:
+            self.values[:] = values[-width:]
+            self.expand(self.values)
+            self.draw(0)
+            return
+        self.values[:-frames] = self.values[frames:]
+        self.values[-frames:] = values
+        if self.expand(values):
+            self.draw(0)
+            return
+        self.image[:, :-frames] = self.image[:, frames:]
+        self.draw(width - frames)
+
+    def latest(self) -> np.ndarray:
+        return self.values[-1]
+
+    def expand(self, values: np.ndarray) -> bool:
+        shown = values[:, self.visible]
+        shown = shown[np.isfinite(shown)]
+        if len(shown) == 0:
+            return False
+        low, high = float(shown.min()), float(shown.max())
+        if low >= self.low and high <= self.high:
+            return False
+        margin = 0.1 * (max(high, self.high) - min(low, self.low))
+        if low < self.low:
+            self.low = low - margin
+        if high > self.high:
+            self.high = high + margin
+        return True
+
+    def rows(self, values: np.ndarray) -> np.ndarray:
+        height = self.image.shape[0]
+        scale = (height - 1) / (self.high - self.low)
+        return np.rint((self.high - values) * scale).astype(np.int32)
+
+    def draw(self, first: int):
+        # Clears the columns from `first` on and draws the lines into them,
+        # starting at the column before, where the previous line ended.
+        image = self.image
+        image[:, first:] = BACKGROUND
+        if self.low < 0.0 < self.high:
+            image[self.rows(np.array(0.0)), first:] = GRID
+        start = max(first - 1, 0)
+        values = self.values[start:].T
+        finite = np.isfinite(values)
+        # One contiguous line of points per series, as cv2 takes them.
+        points = np.empty(values.shape + (2,), dtype=np.int32)
+        points[..., 0] = np.arange(start, len(self.values))
+        points[..., 1] = self.rows(np.where(finite, values, self.low))
+        for series in np.flatnonzero(self.visible & finite.any(axis=1)):
+            lines = [points[series, begin:end] for begin, end
+                     in finite_runs(values[series]) if end - begin > 1]
+            if lines:
+                cv2.polylines(image, lines, False, self.colors[series])
@@ -0,0 +1,196 @@
+import math
+from collections import deque
+import cv2
+import numpy as np
+from landmarks import landmarks_to_array
+from roi import VERTICAL_FOV_DEGREES
+
+# Landmarks on the rigid part of the face: forehead, brows, nose, the outer
+# and inner eye corners and the cheeks. Mouth, eyelids and jaw move on their
+# own and would pull the pose with them.
+TRACKED_LANDMARKS = [
+    10, 151, 9, 8, 168, 6, 197, 195, 5, 4, 1, 19,
+    33, 133, 362, 263, 70, 300, 105, 334, 107, 336,
+    234, 454, 93, 323, 50, 280, 205, 425, 98, 327,
+    129, 358, 116, 345, 123, 352,
+]
+
+# MediaPipe's camera looks down -z with y up, OpenCV's down +z with y down.
+FLIP_YZ = np.diag([1.0, -1.0, -1.0, 1.0])
+
+
+# Stands in for a FaceLandmarkerResult on the frames in between. Only the
+# pose is new, the blendshapes are those of the last real result.
+class TrackedResult:
+    def __init__(self, face_blendshapes, matrix):
+        self.face_landmarks = []
+        self.face_blendshapes = face_blendshapes
+        self.facial_transformation_matrixes = [matrix]
+
+
+class Keyframe:
+    timestamp_ms: int
+    box: tuple[int, int, int, int]
+    scale: float
+
+    def __init__(self, timestamp_ms, box, scale, gray):
+        self.timestamp_ms = timestamp_ms
+        self.box = box
+        self.scale = scale
+        self.gray = gray
+
+
+# Follows the head between FaceLandmarker results. Every frame handed to the
+# landmarker keeps a small grayscale copy of the area around the face, and
+# once its result arrives the rigid landmarks of that result become the
+# anchor. Camera frames that come in while the next inference is still
+# running are tracked from the anchor with pyramidal Lucas-Kanade, and the
+# pose is solved again from the tracked points. Tracking always starts from
+# the last anchor, so errors never build up over more than one inference.
+class LandmarkTracker:
+    tracked: int
+    lost: int
+
+    def __init__(self, roi_height=160, margin=0.3, window=15, levels=2,
+                 min_points=10, max_error=1.0, min_texture=1e-3):
+        self.roi_height = roi_height
+        self.margin = margin
+        self.window = (window, window)
+        self.levels = levels
+        self.min_points = min_points
+        self.max_error = max_error
+        self.min_texture = min_texture
+        self.k = 0.5 / math.tan(math.radians(VERTICAL_FOV_DEGREES) / 2)
+        self.keyframes = deque(maxlen=4)
+        self.box = None
+        self.pending = None
+        self.anchor = None
+        self.blendshapes = None
+        self.matrix = None
+        self.latest_ms = -1
+        self.tracked = 0
+        self.lost = 0
+
+    def crop(self, frame: np.ndarray, box, scale) -> np.ndarray:
+        x0, y0, x1, y1 = box
+        size = (max(1, round((x1 - x0) * scale)),
+                max(1, round((y1 - y0) * scale)))
+        small = cv2.resize(frame[y0:y1, x0:x1], size,
+                           interpolation=cv2.INTER_LINEAR)
+        if small.ndim == 2:
+            return small
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def keyframe(self, frame: np.ndarray, timestamp_ms: int):
+        # Called for every frame that goes to the landmarker.
+        if self.box is None:
+            return
+        x0, y0, x1, y1 = self.box
+        scale = min(1.0, self.roi_height / (y1 - y0))
+        self.keyframes.append(Keyframe(timestamp_ms, self.box, scale,
+                                       self.crop(frame, self.box, scale)))
+
+    def set_result(self, result, timestamp_ms: int):
+        # Called from the landmarker's callback, the anchor is built on the
+        # inference thread before the next frame is tracked.
+        if not result.face_landmarks:
+            self.pending = None
+            self.anchor = None
+            self.box = None
+            return
+        self.pending = (landmarks_to_array(result.face_landmarks[0], 3),
+                        np.array(result.facial_transformation_matrixes[0]),
+                        result.face_blendshapes, timestamp_ms)
+
+    def apply_anchor(self, frame_height: int, frame_width: int):
+        pending = self.pending
+        if pending is None:
+            return
+        self.pending = None
+        landmarks, matrix, blendshapes, timestamp_ms = pending
+        self.blendshapes = blendshapes
+        if timestamp_ms > self.latest_ms:
+            self.matrix = matrix
+            self.latest_ms = timestamp_ms
+
+        x = landmarks[:, 0] * frame_width
+        y = landmarks[:, 1] * frame_height
+        width = x.max() - x.min()
+        height = y.max() - y.min()
+        self.box = (max(0, int(x.min() - self.margin * width)),
+                    max(0, int(y.min() - self.margin * height)),
+                    min(frame_width, int(x.max() + self.margin * width) + 1),
+                    min(frame_height, int(y.max() + self.margin * height) + 1))
+        if self.box[2] - self.box[0] < 8 or self.box[3] - self.box[1] < 8:
+            self.box = None
+
+        keyframe = next((k for k in self.keyframes
+                         if k.timestamp_ms == timestamp_ms), None)
+        if keyframe is None:
+            self.anchor = None
+            return
+
+        # The tracked points, back projected into the face's own coordinates
+        # with the depth MediaPipe gives each landmark.
+        f = self.k * frame_height
+        cx = frame_width / 2
+        cy = frame_height / 2
+        points = landmarks[TRACKED_LANDMARKS]
+        u = points[:, 0] * frame_width
+        v = points[:, 1] * frame_height
+        camera = FLIP_YZ @ matrix
+        distance = camera[2, 3]
+        depth = distance * (1 + points[:, 2] * frame_width / f)
+        camera_points = np.stack([(u - cx) / f * depth, (v - cy) / f * depth,
+                                  depth, np.ones_like(depth)])
+        object_points = (np.linalg.inv(camera) @ camera_points)[:3].T
+
+        x0, y0, _, _ = keyframe.box
+        image_points = np.stack([(u - x0) * keyframe.scale,
+                                 (v - y0) * keyframe.scale], axis=1)
+        rvec, _ = cv2.Rodrigues(camera[:3, :3])
+        self.anchor = (keyframe,
+                       np.ascontiguousarray(object_points, dtype=np.float64),
+                       np.ascontiguousarray(image_points, dtype=np.float32),
+                       rvec, camera[:3, 3].reshape(3, 1).copy(),
+                       np.array([[f, 0, cx], [0, f, cy], [0, 0, 1]]))
+
+    def track(self, frame: np.ndarray, timestamp_ms: int) -> TrackedResult | None:
+        anchor = self.anchor
+        if anchor is None or timestamp_ms <= self.latest_ms:
+            return None
+        keyframe, object_points, anchor_points, rvec, tvec, intrinsics = anchor
+        gray = self.crop(frame, keyframe.box, keyframe.scale)
+        if gray.shape != keyframe.gray.shape:
+            return None
+        # Points on smooth skin have nothing to lock on to and would report
+        # no motion at all, only points with enough texture are followed.
+        # Points that do not track back to where they started are dropped.
+        points, status, _ = cv2.calcOpticalFlowPyrLK(
+            keyframe.gray, gray, anchor_points, None, winSize=self.window,
+            maxLevel=self.levels, minEigThreshold=self.min_texture)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(
+            gray, keyframe.gray, points, None, winSize=self.window,
+            maxLevel=self.levels, minEigThreshold=self.min_texture)
+        error = np.linalg.norm(back - anchor_points, axis=1)
+        good = (status[:, 0] == 1) & (back_status[:, 0] == 1) \
+            & (error < self.max_error)
+        if np.count_nonzero(good) < self.min_points:
+            self.lost += 1
+            return None
+        x0, y0, _, _ = keyframe.box
+        image_points = points[good] / keyframe.scale + (x0, y0)
+        ok, rvec, tvec = cv2.solvePnP(
+            object_points[good], image_points.astype(np.float64), intrinsics,
+            None, rvec.copy(), tvec.copy(), useExtrinsicGuess=True,
+            flags=cv2.SOLVEPNP_ITERATIVE)
+        if not ok:
+            self.lost += 1
+            return None
+        camera = np.eye(4)
+        camera[:3, :3], _ = cv2.Rodrigues(rvec)
+        camera[:3, 3] = tvec[:, 0]
+        self.matrix = FLIP_YZ @ camera
+        self.latest_ms = timestamp_ms
+        self.tracked += 1
+        return TrackedResult(self.blendshapes, self.matrix)
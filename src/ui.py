@@ -1,24 +1,178 @@
+import time
+import numpy as np
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QHBoxLayout,
-                             QVBoxLayout, QLabel, QComboBox, QScrollArea)
-from PyQt6.QtGui import QPixmap, QImage
-from PyQt6.QtCore import Qt, QTimer
+                             QVBoxLayout, QLabel, QComboBox, QScrollArea,
+                             QCheckBox, QDockWidget)
+from PyQt6.QtGui import QImage, QPainter, QColor
+from PyQt6.QtCore import Qt, QTimer, QEvent, QRect, QPointF
 
-from mapper import ActionParameterMapper, ParameterTransformer
+from mapper import ActionParameterMapper, ParameterTransformer, ParamName
+from landmarks import Detail
 from actions import Action
-from queue import Queue, Empty
+from instrumentation import STAGES
+from telemetry import PARAMETER_GROUPS, ScrollingChart, Telemetry
+
+
+class PreviewWidget(QWidget):
+    # Paints the worker's preview buffer directly. The QImage only wraps the
+    # NumPy array, which stays valid until the next frame is taken.
+    def __init__(self, resized):
+        super().__init__()
+        self.resized = resized
+        self.image = None
+        self.q_image = None
+
+    def set_image(self, image):
+        height, width, channels = image.shape
+        bytes_per_line = channels * width
+
+        if channels == 3:
+            q_image = QImage(image.data, width, height,
+                             bytes_per_line, QImage.Format.Format_BGR888)
+        elif channels == 4:
+            q_image = QImage(image.data, width, height,
+                             bytes_per_line, QImage.Format.Format_BGRA8888)
+        else:
+            q_image = QImage(image.data, width, height,
+                             width, QImage.Format.Format_Grayscale8)
+        self.image = image
+        self.q_image = q_image
+        self.update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.resized(self.width(), self.height())
+
+    def paintEvent(self, event):
+        if self.q_image is None:
+            return
+        # Frames arrive pre-scaled, only the few frames around a resize
+        # need scaling here and those use the fast transformation.
+        size = self.q_image.size().scaled(
+            self.size(), Qt.AspectRatioMode.KeepAspectRatio)
+        target = QRect(0, 0, size.width(), size.height())
+        target.moveCenter(self.rect().center())
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform,
+                              False)
+        painter.drawImage(target, self.q_image)
+        painter.end()
+
+
+# Shows a ScrollingChart, with the range and the latest value of every
+# shown series painted over it. Like the preview, the QImage only wraps the
+# chart's array.
+class ChartWidget(QWidget):
+    def __init__(self, title, names, chart: ScrollingChart, unit=""):
+        super().__init__()
+        self.title = title
+        self.names = names
+        self.chart = chart
+        self.unit = unit
+        self.setMinimumHeight(90)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.chart.resize(self.width(), self.height())
+
+    def paintEvent(self, event):
+        image = self.chart.image
+        height, width = image.shape[:2]
+        q_image = QImage(image.data, width, height, 3 * width,
+                         QImage.Format.Format_BGR888)
+        painter = QPainter(self)
+        painter.drawImage(0, 0, q_image)
+        painter.setPen(QColor(200, 200, 200))
+        painter.drawText(4, 14, f"{self.title}  {self.chart.high:.3g}"
+                                f"{self.unit}")
+        painter.drawText(4, height - 4, f"{self.chart.low:.3g}{self.unit}")
+        y = 14
+        for series, value in enumerate(self.chart.latest().tolist()):
+            if not self.chart.visible[series] or np.isnan(value):
+                continue
+            painter.setPen(QColor(*self.chart.colors[series][::-1]))
+            painter.drawText(width - 190, y,
+                             f"{self.names[series]}: {value:.3g}{self.unit}")
+            y += 14
+        painter.end()
+
+
+# Scrolling charts of the face parameters, the mapped actions and the stage
+# timings, refreshed from the telemetry at most `refresh_fps` times per
+# second. Between refreshes the charts only take the frames that came in
+# since the last one, and nothing runs while the panel is stopped.
+class TelemetryPanel(QWidget):
+    def __init__(self, telemetry: Telemetry, refresh_fps=15):
+        super().__init__()
+        self.telemetry = telemetry
+        self.read_count = 0
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        self.group = QComboBox()
+        self.group.addItems(list(PARAMETER_GROUPS))
+        self.group.currentTextChanged.connect(self.show_group)
+        layout.addWidget(self.group)
+        self.parameters = ChartWidget(
+            "Parameters", [name.name for name in ParamName],
+            ScrollingChart(len(ParamName), -1.0, 1.0))
+        self.actions = ChartWidget(
+            "Actions", [action.name for action in Action],
+            ScrollingChart(len(Action), 0.0, 1.0))
+        self.timings = ChartWidget(
+            "Stages", STAGES, ScrollingChart(len(STAGES), 0.0, 20.0),
+            " ms")
+        for chart in (self.parameters, self.actions, self.timings):
+            layout.addWidget(chart)
+        self.show_group(self.group.currentText())
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(round(1000 / refresh_fps))
+        self.timer.timeout.connect(self.refresh)
+
+    def show_group(self, group):
+        shown = {name.value - 1 for name in PARAMETER_GROUPS[group]}
+        self.parameters.chart.show(np.array(
+            [i in shown for i in range(len(ParamName))]))
+        self.parameters.update()
+
+    def set_running(self, running):
+        if running == self.timer.isActive():
+            return
+        if running:
+            # Starts over at the current frame, the frames from the last
+            # time the panel was open would only leave a gap.
+            self.read_count = self.telemetry.count
+            for chart in (self.parameters, self.actions, self.timings):
+                chart.chart.clear()
+                chart.update()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def refresh(self):
+        if self.telemetry.count == self.read_count:
+            return
+        self.read_count, rows = self.telemetry.read(self.read_count)
+        self.parameters.chart.append(rows["parameters"])
+        self.actions.chart.append(rows["actions"])
+        self.timings.chart.append(rows["timings"] * 1000)
+        for chart in (self.parameters, self.actions, self.timings):
+            chart.update()
 
 
 class FaceControllerUI(QMainWindow):
     def __init__(self,
                  worker,
-                 image_queue: Queue,
                  mapper: ActionParameterMapper,
-                 param_transformers: dict[str, ParameterTransformer]):
+                 param_transformers: dict[str, ParameterTransformer],
+                 profiles=None):
         super().__init__()
         self.worker = worker
-        self.image_queue = image_queue
         self.mapper = mapper
         self.parameter_transformers = param_transformers
+        self.profiles = profiles
+        self.profile_version = None
         self.setWindowTitle("Face Controller")
         self.setGeometry(100, 100, 1000, 400)
 
@@ -27,9 +181,8 @@ class FaceControllerUI(QMainWindow):
         central_widget.setLayout(main_layout)
         self.setCentralWidget(central_widget)
 
-        self.image_label = QLabel()
-        self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        main_layout.addWidget(self.image_label, stretch=3)
+        self.preview_widget = PreviewWidget(self.worker.set_preview_size)
+        main_layout.addWidget(self.preview_widget, stretch=3)
 
         scroll_area = QScrollArea()
         scroll_area.setWidgetResizable(True)
@@ -39,9 +192,40 @@ class FaceControllerUI(QMainWindow):
         scroll_area.setWidget(dropdown_container)
         main_layout.addWidget(scroll_area, stretch=1)
 
+        if self.profiles is not None:
+            self.parameter_transformers = self.profiles.transformers
         param_transformer_names = [x for x in self.parameter_transformers]
         param_transformer_names.insert(0, None)
 
+        detail_dropdown = QComboBox()
+        detail_dropdown.addItems([detail.name.title() for detail in Detail])
+        detail_dropdown.setCurrentIndex(self.worker.renderer.detail.value)
+        detail_dropdown.currentIndexChanged.connect(
+            lambda index: self.worker.set_preview_detail(Detail(index)))
+        dropdown_layout.addWidget(QLabel("Preview Detail"))
+        dropdown_layout.addWidget(detail_dropdown)
+
+        self.timings_checkbox = QCheckBox("Measure Stage Timings")
+        self.timings_checkbox.setChecked(self.worker.timers.enabled)
+        self.timings_checkbox.toggled.connect(self.update_timers)
+        dropdown_layout.addWidget(self.timings_checkbox)
+
+        self.telemetry_panel = TelemetryPanel(self.worker.telemetry)
+        self.telemetry_dock = QDockWidget("Telemetry", self)
+        self.telemetry_dock.setWidget(self.telemetry_panel)
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea,
+                           self.telemetry_dock)
+        telemetry_checkbox = QCheckBox("Show Telemetry")
+        telemetry_checkbox.toggled.connect(self.telemetry_dock.setVisible)
+        self.telemetry_dock.visibilityChanged.connect(
+            telemetry_checkbox.setChecked)
+        self.telemetry_dock.visibilityChanged.connect(
+            self.set_telemetry_visible)
+        dropdown_layout.addWidget(telemetry_checkbox)
+        self.telemetry_dock.setVisible(self.worker.debug)
+        telemetry_checkbox.setChecked(self.worker.debug)
+        self.set_telemetry_visible(self.worker.debug)
+
         self.dropdowns = []
         for action in Action:
             dropdown = QComboBox()
@@ -57,46 +241,141 @@ class FaceControllerUI(QMainWindow):
             dropdown_layout.addWidget(dropdown)
             self.dropdowns.append(dropdown)
         dropdown_layout.addStretch(1)
+        self.show_profile()
 
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_image)
         self.timer.start(20)
 
         self.show()
-        self.worker.start()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.worker.set_preview_visible(not self.isMinimized())
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.worker.set_preview_visible(False)
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.Type.WindowStateChange:
+            self.worker.set_preview_visible(
+                self.isVisible() and not self.isMinimized())
+            self.set_telemetry_visible(self.telemetry_dock.isVisible()
+                                       and not self.isMinimized())
+
+    def set_telemetry_visible(self, visible):
+        # The telemetry is only collected while its panel shows, and brings
+        # the stage timers along.
+        self.worker.telemetry.enabled = visible
+        self.telemetry_panel.set_running(visible)
+        self.update_timers()
+
+    def update_timers(self):
+        enabled = self.timings_checkbox.isChecked() \
+            or self.worker.telemetry.enabled
+        if enabled and not self.worker.timers.enabled:
+            self.worker.timers.reset()
+        self.worker.timers.enabled = enabled
 
     def get_param_transformer_change_handler(self, action):
         def change_handler(selected):
-            if selected:
+            if self.profiles is not None:
+                self.profiles.set_mapping(action, selected or None)
+            elif selected:
                 param_transformer = self.parameter_transformers[selected]
                 self.mapper.create_mapping(action, param_transformer)
+            else:
+                self.mapper.remove_mapping(action)
         return change_handler
 
+    def show_profile(self):
+        # Follows profiles reloaded from disk, which may also bring their own
+        # transformers along.
+        if self.profiles is None \
+                or self.profiles.version == self.profile_version:
+            return
+        self.profile_version = self.profiles.version
+        self.parameter_transformers = self.profiles.transformers
+        names = [None] + list(self.parameter_transformers)
+        for action, dropdown in zip(Action, self.dropdowns):
+            selected = self.profiles.profile.mappings.get(action)
+            dropdown.blockSignals(True)
+            dropdown.clear()
+            dropdown.addItems(names)
+            dropdown.setCurrentIndex(names.index(selected)
+                                     if selected in names else 0)
+            dropdown.blockSignals(False)
+
     def update_image(self):
-        try:
-            image = self.image_queue.get(False)
-        except Empty:
+        self.show_profile()
+        image, _ = self.worker.preview.take(0)
+        if image is not None:
+            self.preview_widget.set_image(image)
+
+
+# Full screen, shows the gaze calibration targets one after another. Each
+# target starts large and shrinks while the eyes settle on it, the sampler
+# only collects once it has reached its final size. Escape cancels.
+class GazeCalibrationWindow(QWidget):
+    finished: bool
+
+    def __init__(self, sampler, targets, settle_seconds, collect_seconds):
+        super().__init__()
+        self.sampler = sampler
+        self.targets = targets
+        self.settle_seconds = settle_seconds
+        self.collect_seconds = collect_seconds
+        self.current = 0
+        self.settled = 0.0
+        self.finished = False
+        self.setCursor(Qt.CursorShape.BlankCursor)
+        self.started = time.perf_counter()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.advance)
+        self.timer.start(20)
+
+    def advance(self):
+        elapsed = time.perf_counter() - self.started
+        duration = self.settle_seconds + self.collect_seconds
+        current = int(elapsed // duration)
+        if current >= len(self.targets):
+            self.sampler.target = None
+            self.finished = True
+            self.timer.stop()
+            self.close()
             return
+        self.current = current
+        self.settled = min((elapsed - current * duration)
+                           / self.settle_seconds, 1.0)
+        self.sampler.target = current if self.settled >= 1.0 else None
+        self.update()
 
-        height, width, channels = image.shape
-        bytes_per_line = channels * width
+    def screen_area(self) -> tuple[int, int, int, int]:
+        # In device pixels, the unit pynput moves the pointer in.
+        screen = self.screen()
+        geometry = screen.geometry()
+        ratio = screen.devicePixelRatio()
+        return (round(geometry.x() * ratio), round(geometry.y() * ratio),
+                round(geometry.width() * ratio),
+                round(geometry.height() * ratio))
 
-        if channels == 3:
-            q_image = QImage(image.data, width, height,
-                             bytes_per_line, QImage.Format.Format_BGR888)
-        elif channels == 4:
-            q_image = QImage(image.data, width, height,
-                             bytes_per_line, QImage.Format.Format_BGRA8888)
-        else:
-            q_image = QImage(image.data, width, height,
-                             width, QImage.Format.Format_Grayscale8)
+    def keyPressEvent(self, event):
+        if event.key() == Qt.Key.Key_Escape:
+            self.sampler.target = None
+            self.timer.stop()
+            self.close()
 
-        pixmap = QPixmap.fromImage(q_image)
-        self.image_label.setPixmap(pixmap.scaled(
-            self.image_label.size(),
-            Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.SmoothTransformation
-        ))
-        self.image_queue.task_done()
-        if self.image_queue.qsize() > 0:
-            self.update_image()
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.fillRect(self.rect(), QColor(32, 32, 32))
+        x, y = self.targets[self.current]
+        center = QPointF(x * (self.width() - 1), y * (self.height() - 1))
+        radius = 8 + 24 * (1.0 - self.settled)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(224, 224, 224))
+        painter.drawEllipse(center, radius, radius)
+        painter.setBrush(QColor(48, 48, 255))
+        painter.drawEllipse(center, 3, 3)